@@ -0,0 +1,82 @@
+"""
+Benchmark the per-pixel Omnibus change detection kernel.
+
+The synthetic stack is generated with
+:meth:`nd.testing.generate_test_dataset` and has a change halfway through
+the time series. It is generated and processed in blocks of rows, so that
+the default 5000x5000x30 stack (24 GB as float64) never has to fit into
+memory. Only the time spent in the change detection kernel is reported,
+once with the exact chi-square CDF and once with the interpolated CDF
+tables.
+
+Usage::
+
+    python benchmarks/bench_omnibus.py [--ny 5000] [--nx 5000] [--ntime 30]
+                                       [--rows 100] [--njobs 1]
+"""
+import argparse
+import time
+import numpy as np
+import xarray as xr
+from nd.testing import generate_test_dataset
+from nd.change import _omnibus
+
+
+VARIABLES = ['C11', 'C12__re', 'C12__im', 'C22']
+
+
+def generate_block(ny, nx, ntime, seed):
+    """Generate a block of the stack in the layout of the kernel,
+    (y, x, time, variable).
+    """
+    split = ntime // 2
+    before = generate_test_dataset(
+        ny=ny, nx=nx, ntime=ntime, mean=[1, 0, 0, 1], sigma=0.1,
+        random_seed=seed).isel(time=slice(None, split))
+    after = generate_test_dataset(
+        ny=ny, nx=nx, ntime=ntime, mean=[10, 0, 0, 10], sigma=0.1,
+        random_seed=seed + 1).isel(time=slice(split, None))
+    ds = xr.concat([before, after], dim='time')
+    return np.ascontiguousarray(
+        ds[VARIABLES].to_array().transpose('y', 'x', 'time', 'variable')
+        .values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--ny', type=int, default=5000)
+    parser.add_argument('--nx', type=int, default=5000)
+    parser.add_argument('--ntime', type=int, default=30)
+    parser.add_argument('--rows', type=int, default=100,
+                        help='The number of rows generated at once.')
+    parser.add_argument('--njobs', type=int, default=1)
+    parser.add_argument('--alpha', type=float, default=0.01)
+    parser.add_argument('--n', type=int, default=9,
+                        help='The number of looks.')
+    args = parser.parse_args()
+
+    timings = {'exact': 0.0, 'cdf_table': 0.0}
+    nchanges = {'exact': 0, 'cdf_table': 0}
+    for i, start in enumerate(range(0, args.ny, args.rows)):
+        rows = min(args.rows, args.ny - start)
+        values = generate_block(rows, args.nx, args.ntime, seed=2 * i)
+        for name, kwargs in [('exact', {}),
+                             ('cdf_table', {'cdf_table': True})]:
+            t = time.perf_counter()
+            result = _omnibus.change_detection(
+                values, alpha=args.alpha, n=args.n, njobs=args.njobs,
+                **kwargs)
+            timings[name] += time.perf_counter() - t
+            nchanges[name] += int(np.asarray(result).sum())
+
+    npixels = args.ny * args.nx
+    print('Stack: {} x {} x {}, njobs={}'.format(
+        args.ny, args.nx, args.ntime, args.njobs))
+    for name in timings:
+        print('{:>9s}: {:8.1f} s ({:.2f} us/pixel, {} changes)'.format(
+            name, timings[name], 1e6 * timings[name] / npixels,
+            nchanges[name]))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import numpy as np
 cimport numpy as np
 from scipy.stats import chi2
 from libc.math cimport abs, log, isnan
+from libc.stdlib cimport malloc, free
 # from cpython.mem cimport PyMem_Malloc, PyMem_Realloc, PyMem_Free
 from cython cimport floating
 from cython_gsl cimport gsl_ran_chisq_pdf, gsl_cdf_chisq_P, gsl_cdf_chisq_Q
@@ -15,6 +16,27 @@ ctypedef Py_ssize_t SIZE_TYPE
 ctypedef unsigned char BOOL
 # ctypedef np.uint8_t BOOL
 
+# Number of nodes of the interpolated chi-square CDF tables.
+DEF CDF_TABLE_SIZE = 4096
+# The tables cover [0, z_max] where CDF(z_max) = 1 - CDF_TABLE_EPS.
+DEF CDF_TABLE_EPS = 1e-12
+
+
+cdef struct omnibus_constants:
+    # All arrays are indexed by the number of matrices `k` in the
+    # (sub-)series that is being tested.
+    double p
+    double n
+    double *f
+    double *rho
+    double *omega2
+    double *pklogk
+    # Interpolated CDF tables for the `f` and `f+4` degrees of freedom,
+    # laid out as table[(2*k + i) * CDF_TABLE_SIZE + j]. NULL if the exact
+    # CDF is used.
+    double *table
+    double *table_step
+
 # =================================================================
 
 # cpdef double chisq_pdf(double x, double nu):
@@ -55,21 +77,17 @@ cdef double _omega2(double p, double k, double n, double rho) nogil:
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
-# cpdef floating _z(np.ndarray[floating, ndim=2] ts, unsigned int n):
-cpdef floating _z(floating [:, :] ts, unsigned int n) nogil:
+cdef inline double _log_Q_dual(floating [:, :] ts, double n,
+                               double pklogk) nogil:
     """
-    The 4 columns in ts are [C11, C12.real, C21.imag, C22]
+    The 4 columns in ts are [C11, C12.real, C21.imag, C22].
+    `pklogk` is the precomputed constant p*k*log(k).
     """
     cdef:
-        floating p = 2,             # dual pol: p=2, full pol: p=3
         size_t k = ts.shape[0],     # number of matrices (time steps)
         floating c11sum = 0, c22sum = 0, c12rsum = 0, c12isum = 0
         floating det_of_sum
         DOUBLE prod_of_dets = 1.0
-        floating rho
-        DOUBLE logQ
-        floating z
-        floating prob
         size_t i
 
     # Compute the individual matrix determinants and the sum along the
@@ -84,11 +102,285 @@ cpdef floating _z(floating [:, :] ts, unsigned int n) nogil:
     # The determinant of the sum of all matrices.
     det_of_sum = ((c11sum * c22sum) - (c12rsum**2 + c12isum**2))
 
-    logQ = n * (p*k*log(k) + log(prod_of_dets) - k*log(det_of_sum))
+    return n * (pklogk + log(prod_of_dets) - k*log(det_of_sum))
+
+
+@cython.cdivision(True)
+cdef inline double _det3(double c11, double c12r, double c12i,
+                         double c13r, double c13i, double c22,
+                         double c23r, double c23i, double c33) nogil:
+    """
+    The determinant of a 3x3 Hermitian matrix given its upper triangle.
+    """
+    return c11 * c22 * c33 \
+        + 2 * ((c12r * c23r - c12i * c23i) * c13r +
+               (c12r * c23i + c12i * c23r) * c13i) \
+        - c11 * (c23r**2 + c23i**2) \
+        - c22 * (c13r**2 + c13i**2) \
+        - c33 * (c12r**2 + c12i**2)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double _log_Q_quad(floating [:, :] ts, double n,
+                               double pklogk) nogil:
+    """
+    The 9 columns in ts are [C11, C12.real, C12.imag, C13.real, C13.imag,
+    C22, C23.real, C23.imag, C33].
+    `pklogk` is the precomputed constant p*k*log(k).
+    """
+    cdef:
+        size_t k = ts.shape[0],     # number of matrices (time steps)
+        double [9] sums = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+        double det_of_sum
+        DOUBLE sum_of_log_dets = 0
+        size_t i, v
+
+    # Compute the individual matrix determinants and the sum along the
+    # time dimension. The determinants are accumulated as logarithms, as
+    # their product quickly underflows for 3x3 matrices.
+    for i in range(k):
+        sum_of_log_dets += log(_det3(ts[i, 0], ts[i, 1], ts[i, 2],
+                                     ts[i, 3], ts[i, 4], ts[i, 5],
+                                     ts[i, 6], ts[i, 7], ts[i, 8]))
+        for v in range(9):
+            sums[v] += ts[i, v]
+
+    # The determinant of the sum of all matrices.
+    det_of_sum = _det3(sums[0], sums[1], sums[2], sums[3], sums[4],
+                       sums[5], sums[6], sums[7], sums[8])
+
+    return n * (pklogk + sum_of_log_dets - k*log(det_of_sum))
+
+
+cdef inline double _log_Q(floating [:, :] ts, double n, double pklogk) nogil:
+    """
+    Dispatch to the dual pol (4 columns) or full pol (9 columns) kernel.
+    """
+    if ts.shape[1] == 9:
+        return _log_Q_quad(ts, n, pklogk)
+    else:
+        return _log_Q_dual(ts, n, pklogk)
+
+
+cpdef unsigned int _get_p(SIZE_TYPE ncols) except 0:
+    """
+    The dimension of the covariance matrix represented by `ncols` real
+    values.
+    """
+    if ncols == 4:
+        return 2
+    elif ncols == 9:
+        return 3
+    raise ValueError('Expected 4 (dual pol) or 9 (full pol) variables, '
+                     'got {}.'.format(ncols))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+# cpdef floating _z(np.ndarray[floating, ndim=2] ts, unsigned int n):
+cpdef floating _z(floating [:, :] ts, unsigned int n) nogil:
+    """
+    The 4 columns in ts are [C11, C12.real, C21.imag, C22] (dual pol), or
+    the 9 columns are [C11, C12.real, C12.imag, C13.real, C13.imag, C22,
+    C23.real, C23.imag, C33] (full pol).
+    """
+    cdef:
+        floating p = 3 if ts.shape[1] == 9 else 2
+        size_t k = ts.shape[0]      # number of matrices (time steps)
+        floating rho
+        DOUBLE logQ
+
+    logQ = _log_Q(ts, n, p*k*log(k))
     rho = _rho(p, k, n)
-    z = -2 * rho * logQ
-    return z
+    return -2 * rho * logQ
+
 
+cpdef dict _precompute_constants(double p, size_t kmax, double n,
+                                 bint cdf_table=False):
+    """
+    Precompute all constants of the omnibus test that only depend on
+    (p, k, n), for every series length k <= kmax.
+
+    Parameters
+    ----------
+    p : double
+        The dimension of the covariance matrices.
+    kmax : size_t
+        The length of the full time series.
+    n : double
+        The number of looks.
+    cdf_table : bool, optional
+        If True, also tabulate the chi-square CDF for the degrees of freedom
+        `f` and `f+4` of every k (default: False).
+
+    Returns
+    -------
+    dict
+        A dictionary of arrays of length kmax + 1, indexed by k.
+    """
+    cdef:
+        size_t k
+        double z_max
+        np.ndarray[DOUBLE, ndim=1] f = np.zeros(kmax + 1)
+        np.ndarray[DOUBLE, ndim=1] rho = np.zeros(kmax + 1)
+        np.ndarray[DOUBLE, ndim=1] omega2 = np.zeros(kmax + 1)
+        np.ndarray[DOUBLE, ndim=1] pklogk = np.zeros(kmax + 1)
+        np.ndarray[DOUBLE, ndim=3] table
+        np.ndarray[DOUBLE, ndim=2] table_step
+
+    # The omnibus test is only defined for k >= 2.
+    for k in range(2, kmax + 1):
+        f[k] = _f(p, k, n)
+        rho[k] = _rho(p, k, n)
+        omega2[k] = _omega2(p, k, n, rho[k])
+        pklogk[k] = p * k * log(k)
+
+    constants = {'f': f, 'rho': rho, 'omega2': omega2, 'pklogk': pklogk}
+
+    if cdf_table:
+        table = np.zeros((kmax + 1, 2, CDF_TABLE_SIZE))
+        table_step = np.ones((kmax + 1, 2))
+        for k in range(2, kmax + 1):
+            for i, df in enumerate([f[k], f[k] + 4]):
+                z_max = chi2.ppf(1 - CDF_TABLE_EPS, df)
+                nodes = np.linspace(0, z_max, CDF_TABLE_SIZE)
+                table[k, i, :] = chi2.cdf(nodes, df)
+                table_step[k, i] = nodes[1]
+        constants['table'] = table
+        constants['table_step'] = table_step
+
+    return constants
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double _chisq_P(double z, size_t k, int i,
+                            omnibus_constants *c) nogil:
+    """
+    The chi-square CDF for the degrees of freedom `f[k]` (i = 0) or
+    `f[k] + 4` (i = 1), either exact or linearly interpolated from the
+    precomputed table.
+    """
+    cdef:
+        double *row
+        double pos, w
+        size_t j
+
+    if c.table == NULL:
+        if i == 0:
+            return gsl_cdf_chisq_P(z, c.f[k])
+        else:
+            return gsl_cdf_chisq_P(z, c.f[k] + 4)
+
+    if z <= 0:
+        return 0
+    row = c.table + (2 * k + i) * CDF_TABLE_SIZE
+    pos = z / c.table_step[2 * k + i]
+    if pos >= CDF_TABLE_SIZE - 1:
+        return row[CDF_TABLE_SIZE - 1]
+    j = <size_t>pos
+    w = pos - j
+    return (1 - w) * row[j] + w * row[j + 1]
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+cdef inline double _omnibus_P(floating [:, :] ts,
+                              omnibus_constants *c,
+                              double *z) nogil:
+    """
+    Like `single_pixel_omnibus`, but using precomputed constants.
+    The test statistic -2*rho*log(Q) is stored in `z`.
+    """
+    cdef:
+        size_t k = ts.shape[0]
+        double P1, P2
+
+    z[0] = -2 * c.rho[k] * _log_Q(ts, c.n, c.pklogk[k])
+    P1 = _chisq_P(z[0], k, 0, c)
+    P2 = _chisq_P(z[0], k, 1, c)
+    return P1 + c.omega2[k] * (P2 - P1)
+
+
+@cython.cdivision(True)
+cdef inline double _omnibus_Q(double z, size_t k,
+                              omnibus_constants *c) nogil:
+    """
+    The upper tail probability 1 - P of the omnibus test statistic `z`.
+    It is evaluated directly from the chi-square survival functions rather
+    than as the complement of the CDF, which cancels to zero for
+    significant changes.
+    """
+    cdef:
+        double Q1 = gsl_cdf_chisq_Q(z, c.f[k])
+        double Q2 = gsl_cdf_chisq_Q(z, c.f[k] + 4)
+
+    return Q1 + c.omega2[k] * (Q2 - Q1)
+
+
+@cython.cdivision(True)
+cdef void _fill_constants(omnibus_constants *c, double p, size_t kmax,
+                          double n, double *buffer) noexcept nogil:
+    """
+    Like `_precompute_constants` and `_constants_struct`, but without the
+    GIL and without CDF tables. The arrays are stored in `buffer`, which
+    must hold 4 * (kmax + 1) doubles and be kept alive by the caller.
+    """
+    cdef size_t k
+
+    c.p = p
+    c.n = n
+    c.f = buffer
+    c.rho = buffer + (kmax + 1)
+    c.omega2 = buffer + 2 * (kmax + 1)
+    c.pklogk = buffer + 3 * (kmax + 1)
+    c.table = NULL
+    c.table_step = NULL
+    for k in range(kmax + 1):
+        if k < 2:
+            # The omnibus test is only defined for k >= 2.
+            c.f[k] = c.rho[k] = c.omega2[k] = c.pklogk[k] = 0
+        else:
+            c.f[k] = _f(p, k, n)
+            c.rho[k] = _rho(p, k, n)
+            c.omega2[k] = _omega2(p, k, n, c.rho[k])
+            c.pklogk[k] = p * k * log(k)
+
+
+cdef omnibus_constants _constants_struct(dict constants, double p, double n):
+    """
+    Create the C struct pointing at the arrays generated by
+    `_precompute_constants`. The arrays must be kept alive by the caller.
+    """
+    cdef:
+        omnibus_constants c
+        double [::1] f = constants['f']
+        double [::1] rho = constants['rho']
+        double [::1] omega2 = constants['omega2']
+        double [::1] pklogk = constants['pklogk']
+        double [:, :, ::1] table
+        double [:, ::1] table_step
+
+    c.p = p
+    c.n = n
+    c.f = &f[0]
+    c.rho = &rho[0]
+    c.omega2 = &omega2[0]
+    c.pklogk = &pklogk[0]
+    if 'table' in constants:
+        table = constants['table']
+        table_step = constants['table_step']
+        c.table = &table[0, 0, 0]
+        c.table_step = &table_step[0, 0]
+    else:
+        c.table = NULL
+        c.table_step = NULL
+    return c
 
 
 #
@@ -144,7 +436,7 @@ cpdef np.ndarray[floating, ndim=2] array_omnibus(floating [:, :, :, :] ts, unsig
 @cython.cdivision(True)
 cpdef floating single_pixel_omnibus(floating [:, :] ts, unsigned int n) nogil:
     cdef:
-        double p = 2
+        double p = 3 if ts.shape[1] == 9 else 2
         size_t k = ts.shape[0]
         double f, rho, omega2
         double prob
@@ -233,22 +525,29 @@ cpdef np.ndarray[BOOL, ndim=3] change_array_to_bool(np.ndarray[floating, ndim=3]
 @cython.wraparound(False)
 @cython.cdivision(True)
 @cython.boundscheck(False)
-cpdef void single_pixel_change_detection(floating [:, :] ts,
+cdef void _single_pixel_change_detection(floating [:, :] ts,
                                          BOOL [:] result,
                                          double alpha,
-                                         unsigned int n) nogil:
+                                         omnibus_constants *c,
+                                         DOUBLE [:, :] stats,
+                                         bint record_stats) noexcept nogil:
+    """
+    If `record_stats` is True, the p-value and test statistic of the
+    marginal test that detected each change are stored in
+    ``stats[t, 0]`` and ``stats[t, 1]``, respectively. `stats` must be
+    initialized by the caller.
+    """
     cdef:
-        floating [:, :] subset
         SIZE_TYPE k = ts.shape[0]
         SIZE_TYPE l, j, r
-        floating p_H0_l, p_H0_lj
+        double p_H0_l, p_H0_lj
+        double z
         BOOL _change
 
     l = 0
     while True:
         # Test global hypotheses H0_l
-        subset = ts[l:, :]
-        p_H0_l = single_pixel_omnibus(subset, n=n)
+        p_H0_l = _omnibus_P(ts[l:, :], c, &z)
         _change = (p_H0_l > alpha)
         if not _change:
             break
@@ -256,27 +555,72 @@ cpdef void single_pixel_change_detection(floating [:, :] ts,
             # Test marginal hypotheses
             # j is the number of time points to consider in the omnibus tests
             for j in range(2, k - l + 1):
-                subset = ts[l:l+j, :]
-                p_H0_lj = single_pixel_omnibus(subset, n=n)
+                p_H0_lj = _omnibus_P(ts[l:l+j, :], c, &z)
                 _change = (p_H0_lj > alpha)
                 # Break on first significant change
                 r = j - 1
                 if _change:
                     result[l + r] = 1
+                    if record_stats:
+                        stats[l + r, 0] = _omnibus_Q(z, j, c)
+                        stats[l + r, 1] = z
                     break
         l = l + r
         if l >= k - 1:
             break
 
 
+cpdef void single_pixel_change_detection(floating [:, :] ts,
+                                         BOOL [:] result,
+                                         double alpha,
+                                         unsigned int n) nogil:
+    """
+    Run the change detection on the time series of a single pixel.
+
+    The constants of the omnibus test are computed for this pixel only.
+    `change_detection` computes them once and passes them to the
+    `_single_pixel_change_detection` fast path for every pixel.
+    """
+    cdef:
+        double p = 3 if ts.shape[1] == 9 else 2
+        size_t k = ts.shape[0]
+        omnibus_constants c
+        DOUBLE [:, :] no_stats = None
+        double *buffer = <double *> malloc(4 * (k + 1) * sizeof(double))
+
+    if buffer == NULL:
+        with gil:
+            raise MemoryError()
+    _fill_constants(&c, p, k, n, buffer)
+    _single_pixel_change_detection(ts, result, alpha, &c, no_stats, False)
+    free(buffer)
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
 cpdef BOOL [:, :, :] change_detection(floating [:, :, :, :] values,
                                       double alpha, unsigned int n=1,
-                                      unsigned int njobs=1):
+                                      unsigned int njobs=1,
+                                      bint cdf_table=False,
+                                      DOUBLE [:, :, :, :] stats=None):
     """
     `ds` is already multilooked (with `n` looks).
+
+    The last dimension of `values` contains either the 4 real components
+    [C11, C12.real, C12.imag, C22] of the dual pol covariance matrix (p=2),
+    or the 9 real components [C11, C12.real, C12.imag, C13.real, C13.imag,
+    C22, C23.real, C23.imag, C33] of the full pol covariance matrix (p=3).
+
+    The constants of the omnibus test are computed once for every possible
+    series length. If `cdf_table` is True, the chi-square CDF is linearly
+    interpolated from precomputed tables rather than evaluated exactly.
+
+    If `stats` is given, it must be an array of shape (nrows, ncols, k, 2).
+    For every detected change, the p-value and the test statistic
+    -2*rho*log(Q) of the detecting test are written to
+    ``stats[..., 0]`` and ``stats[..., 1]``, respectively. All other entries
+    are set to NaN.
     """
     cdef:
         SIZE_TYPE nrows = values.shape[0]
@@ -287,13 +631,28 @@ cpdef BOOL [:, :, :] change_detection(floating [:, :, :, :] values,
         BOOL [:, :, :] result = np.zeros((nrows, ncols, k), dtype=np.uint8,
                                          order='C')
         unsigned int num_threads = njobs
+        double p = _get_p(values.shape[3])
+        dict constants = _precompute_constants(p, k, n, cdf_table=cdf_table)
+        omnibus_constants c = _constants_struct(constants, p, n)
+        bint record_stats = stats is not None
+        DOUBLE [:, :] no_stats = np.empty((1, 2))
+
+    if record_stats:
+        stats[:, :, :, :] = np.nan
 
     # Do change detection completely independently for each pixel.
     for i_lat in prange(nrows, nogil=True, schedule='dynamic', chunksize=100,
                         num_threads=num_threads):
         for i_lon in range(ncols):
-            single_pixel_change_detection(values[i_lat, i_lon, :, ::1],
-                                          result[i_lat, i_lon, :],
-                                          alpha=alpha, n=n)
+            if record_stats:
+                _single_pixel_change_detection(values[i_lat, i_lon, :, ::1],
+                                               result[i_lat, i_lon, :],
+                                               alpha, &c,
+                                               stats[i_lat, i_lon, :, :],
+                                               True)
+            else:
+                _single_pixel_change_detection(values[i_lat, i_lon, :, ::1],
+                                               result[i_lat, i_lon, :],
+                                               alpha, &c, no_stats, False)
 
     return result
@@ -5,11 +5,13 @@ Conradsen et al. (2015).
 TODO: Make all functions work with xarray Datasets
 
 """
-from ..io import disassemble_complex
+from ..io import disassemble_complex, to_netcdf, open_netcdf
 from ..filters import BoxcarFilter
 from . import ChangeDetection
 import numpy as np
 import xarray as xr
+import dask.array as da
+from scipy.stats import chi2
 # Cannot install libgsl-dev on ReadTheDocs.
 # So if we are building the documentation ignore the error raised.
 try:
@@ -20,15 +22,201 @@ except Exception:
         raise
 
 
-def _change_detection(ds, alpha=0.01, ml=None, n=1, njobs=1):
+# The real valued components of the covariance matrix that are passed to the
+# omnibus kernel, for dual polarimetric (p=2) and full polarimetric (p=3)
+# data.
+DUALPOL_VARIABLES = ['C11', 'C12__re', 'C12__im', 'C22']
+FULLPOL_VARIABLES = ['C11', 'C12__re', 'C12__im', 'C13__re', 'C13__im',
+                     'C22', 'C23__re', 'C23__im', 'C33']
+
+
+def _prepare(ds, ml=None, n=1):
+    """
+    Convert a dataset in covariance matrix format into the real valued
+    components expected by the omnibus kernel, multilooking if required.
+
+    Returns
+    -------
+    tuple (xarray.Dataset, list of str, int)
+        The prepared dataset, the names of the variables to be passed to the
+        kernel (in order), and the number of looks.
+    """
+    ds_m = disassemble_complex(ds)
+
+    # Multilooking
+    if ml is not None:
+        ds_m = BoxcarFilter(dims=('y', 'x'), w=ml).apply(ds_m)
+        n = ml ** 2
+
+    if 'C33' in ds_m.data_vars:
+        variables = FULLPOL_VARIABLES
+    else:
+        variables = DUALPOL_VARIABLES
+
+    return ds_m, variables, n
+
+
+def _det(ds, variables):
+    """
+    The determinant of the covariance matrix given by the real valued
+    components `variables` of `ds`.
+    """
+    c = [ds[v] for v in variables]
+    if len(variables) == 4:
+        c11, c12r, c12i, c22 = c
+        return c11 * c22 - (c12r**2 + c12i**2)
+
+    c11, c12r, c12i, c13r, c13i, c22, c23r, c23i, c33 = c
+    return c11 * c22 * c33 \
+        + 2 * ((c12r * c23r - c12i * c23i) * c13r +
+               (c12r * c23i + c12i * c23r) * c13i) \
+        - c11 * (c23r**2 + c23i**2) \
+        - c22 * (c13r**2 + c13i**2) \
+        - c33 * (c12r**2 + c12i**2)
+
+
+def _omnibus_probability(log_Q, k, p, n):
+    """
+    Vectorized version of the omnibus probability computed by the kernel,
+    for test statistics `log_Q` of series of (varying) length `k`.
+    """
+    k = np.asarray(k, dtype=int)
+    if k.size == 0:
+        return np.zeros(k.shape)
+    constants = _omnibus._precompute_constants(p, int(k.max()), n)
+    z = -2 * constants['rho'][k] * log_Q
+    f = constants['f'][k]
+    P1 = chi2.cdf(z, f)
+    P2 = chi2.cdf(z, f + 4)
+    return P1 + constants['omega2'][k] * (P2 - P1)
+
+
+def _omnibus_state(ds, change, ml=None, n=1):
+    """
+    Compute the per-pixel state of the sequential omnibus test after
+    processing `ds`, given the detected changes.
+
+    The state consists of the sums of the covariance matrix components and of
+    the log-determinants since the last change (inclusive), and the time
+    index of the last change.
+    """
+    ds_m, variables, n = _prepare(ds, ml=ml, n=n)
+    ntime = ds_m.sizes['time']
+    t = xr.DataArray(np.arange(ntime), dims='time',
+                     coords={'time': ds_m['time']})
+    last_change = t.where(change).max('time').fillna(0).astype(int)
+    since = t >= last_change
+
+    state = xr.Dataset()
+    for v in variables:
+        state['sum_' + v] = ds_m[v].where(since).sum('time')
+    state['sum_log_det'] = np.log(_det(ds_m, variables)) \
+        .where(since).sum('time')
+    state['last_change'] = last_change
+    state.attrs = {'ntime': ntime, 'n': n}
+    return state
+
+
+def _omnibus_update(state, ds, alpha=0.01, ml=None):
+    """
+    Update the state of the sequential omnibus test with new acquisitions.
+    Each acquisition is tested against the series since the last change.
+
+    Returns
+    -------
+    tuple (xarray.DataArray, xarray.Dataset)
+        The detected changes at the new acquisitions, and the new state.
+    """
+    ds_m, variables, _ = _prepare(ds, ml=ml)
+    # A state read from disk will have its complex sums reassembled.
+    state = disassemble_complex(state)
+    n = state.attrs['n']
+    p = 3 if len(variables) == 9 else 2
+
+    changes = []
+    for i in range(ds_m.sizes['time']):
+        new = ds_m[variables].isel(time=i, drop=True)
+        ntime = state.attrs['ntime']
+        # The number of matrices in the tested series.
+        k = ntime - state['last_change'] + 1
+
+        sums = xr.Dataset({v: state['sum_' + v] + new[v] for v in variables})
+        log_det = np.log(_det(new, variables))
+        sum_log_det = state['sum_log_det'] + log_det
+        log_Q = n * (p * k * np.log(k) + sum_log_det -
+                     k * np.log(_det(sums, variables)))
+        prob = xr.apply_ufunc(_omnibus_probability, log_Q, k,
+                              kwargs={'p': p, 'n': n}, dask='parallelized',
+                              output_dtypes=[np.float64])
+        change = prob > alpha
+
+        # Where a change was detected, start a new series from the new
+        # acquisition.
+        new_state = xr.Dataset()
+        for v in variables:
+            new_state['sum_' + v] = xr.where(change, new[v], sums[v])
+        new_state['sum_log_det'] = xr.where(change, log_det, sum_log_det)
+        new_state['last_change'] = xr.where(change, ntime,
+                                            state['last_change'])
+        new_state.attrs = {'ntime': ntime + 1, 'n': n}
+
+        changes.append(change)
+        state = new_state
+
+    change = xr.concat(changes, dim=ds_m['time']) \
+        .transpose('y', 'x', 'time')
+    change.name = 'change'
+    return change, state
+
+
+def _stats_dtype(values):
+    """
+    The dtype of the p-values and test statistics for input `values`.
+    """
+    return np.result_type(values.dtype, np.float32)
+
+
+def _omnibus_block(values, alpha, n, njobs, cdf_table=False, stats=False):
+    """
+    Run the per-pixel change detection on a single in-memory block of shape
+    (y, x, time, variable). The full time series must be contained in the
+    block.
+
+    If `stats` is True, return a float array of shape (y, x, time, 3)
+    containing the change mask, the p-value and the test statistic, in the
+    floating point precision of `values`.
+    """
+    values = np.ascontiguousarray(values)
+    if not stats:
+        change = _omnibus.change_detection(values, alpha=alpha, n=n,
+                                           njobs=njobs, cdf_table=cdf_table)
+        return np.asarray(change, dtype=bool)
+
+    result = np.empty(values.shape[:3] + (3,), dtype=_stats_dtype(values))
+    test_stats = np.empty(values.shape[:3] + (2,), dtype=np.float64)
+    result[..., 0] = _omnibus.change_detection(
+        values, alpha=alpha, n=n, njobs=njobs, cdf_table=cdf_table,
+        stats=test_stats)
+    result[..., 1:] = test_stats
+    return result
+
+
+def _change_detection(ds, alpha=0.01, ml=None, n=1, njobs=1, chunks=None,
+                      cdf_table=False, stats=False):
     """
     Implement the change detection algorithm proposed by Conradsen et al.
     (2015).
 
+    If the dataset is backed by dask arrays (or `chunks` is given), the
+    change detection is evaluated lazily, one spatial block at a time.
+    Each block always contains the full time series.
+
     Parameters
     ----------
     ds : xarray.Dataset
-        A (multilooked) dataset in covariance matrix format.
+        A (multilooked) dataset in covariance matrix format. If the dataset
+        contains the variable ``C33``, it is treated as full polarimetric
+        (3x3 covariance matrix), otherwise as dual polarimetric.
     alpha : float (0. ... 1.), optional
         The significance level (default: 0.01).
     ml : int, optional
@@ -37,34 +225,63 @@ def _change_detection(ds, alpha=0.01, ml=None, n=1, njobs=1):
     n : int, optional
         The number of looks in `ds`. If `ml` is specified this parameter is
         ignored (default: 1).
+    njobs : int, optional
+        The number of threads used within each block (default: 1).
+    chunks : dict, optional
+        The spatial block size, e.g. ``{'y': 1000, 'x': 1000}``. Chunking
+        along `time` is ignored.
+    cdf_table : bool, optional
+        If True, interpolate the chi-square CDF from precomputed tables
+        instead of evaluating it exactly for every test (default: False).
+    stats : bool, optional
+        If True, also return the p-value and the test statistic of the test
+        that detected each change (default: False).
 
     Returns
     -------
-    xarray.DataArray
+    xarray.DataArray or xarray.Dataset
         A boolean DataArray indicating whether a change occurred at each
-        (y, x, time) coordinate.
+        (y, x, time) coordinate. The DataArray is dask-backed if the input
+        was. If `stats` is True, a Dataset with the variables ``change``,
+        ``pvalue`` and ``statistic`` is returned instead.
     """
-    ds.persist()
+    if chunks is not None:
+        ds = ds.chunk(chunks)
 
-    ds_m = disassemble_complex(ds)
-
-    # Multilooking
-    if ml is not None:
-        ds_m = BoxcarFilter(w=ml).apply(ds_m)
-        n = ml ** 2
+    ds_m, variables, n = _prepare(ds, ml=ml, n=n)
 
-    values = ds_m[['C11', 'C12__re', 'C12__im', 'C22']].to_array() \
-        .transpose('y', 'x', 'time', 'variable').values
+    values = ds_m[variables].to_array() \
+        .transpose('y', 'x', 'time', 'variable').data
 
-    change = _omnibus.change_detection(values, alpha=alpha, n=n, njobs=njobs)
+    if isinstance(values, da.Array):
+        # The sequential test needs the entire time series of a pixel,
+        # so only split along the spatial dimensions.
+        values = values.rechunk({2: -1, 3: -1})
+        if stats:
+            change = values.map_blocks(
+                _omnibus_block, alpha=alpha, n=n, njobs=njobs,
+                cdf_table=cdf_table, stats=True,
+                chunks=values.chunks[:3] + ((3,),),
+                dtype=_stats_dtype(values))
+        else:
+            change = values.map_blocks(
+                _omnibus_block, alpha=alpha, n=n, njobs=njobs,
+                cdf_table=cdf_table, drop_axis=3, dtype=bool)
+    else:
+        change = _omnibus_block(values, alpha=alpha, n=n, njobs=njobs,
+                                cdf_table=cdf_table, stats=stats)
 
     coords = ds.coords
     dims = ['y', 'x', 'time']
-    change_arr = xr.DataArray(np.asarray(change, dtype=bool),
-                              dims=dims, coords=coords,
-                              attrs=ds.attrs, name='change')
+    if not stats:
+        return xr.DataArray(change, dims=dims, coords=coords,
+                            attrs=ds.attrs, name='change')
 
-    return change_arr
+    result = xr.Dataset(coords=coords, attrs=ds.attrs)
+    result['change'] = (dims, change[..., 0].astype(bool))
+    result['pvalue'] = (dims, change[..., 1])
+    result['statistic'] = (dims, change[..., 2])
+    return result
 
 
 class OmnibusTest(ChangeDetection):
@@ -77,7 +294,10 @@ class OmnibusTest(ChangeDetection):
     Parameters
     ----------
     ds : xarray.Dataset
-        A (multilooked) dataset in covariance matrix format.
+        A (multilooked) dataset in covariance matrix format. Both dual
+        polarimetric (``C11``, ``C12``, ``C22``) and full polarimetric
+        (``C11``, ``C12``, ``C13``, ``C22``, ``C23``, ``C33``) data are
+        supported; the kernel is chosen based on the variables present.
     ml : int, optional
         Multilooking window size. By default, no multilooking is performed and
         the dataset is assumed to already be multilooked.
@@ -86,17 +306,130 @@ class OmnibusTest(ChangeDetection):
         ignored (default: 1).
     alpha : float (0. ... 1.), optional
         The significance level (default: 0.01).
+    chunks : dict, optional
+        If given, process the dataset lazily in spatial blocks of this size,
+        e.g. ``{'y': 1000, 'x': 1000}``. Dask-backed datasets are always
+        processed blockwise using their existing spatial chunks.
+    cdf_table : bool, optional
+        If True, the chi-square CDF is linearly interpolated from tables
+        precomputed for the degrees of freedom of the test, which is
+        considerably faster than evaluating it exactly (default: False).
+    stats : bool, optional
+        If True, :meth:`apply` returns a Dataset which in addition to the
+        boolean ``change`` variable contains the ``pvalue`` and the test
+        statistic -2*rho*ln(Q) (``statistic``) of the test that detected each
+        change, and NaN everywhere else. Both are computed in the same pass
+        as the change mask (default: False).
+
+        A test detects a change if its p-value is below ``1 - alpha``, so
+        the changes of a run with a stricter ``alpha2 >= alpha`` are
+        approximated by ``pvalue < 1 - alpha2``. This does not hold for
+        ``alpha2 < alpha``, i.e. a more sensitive test, because changes
+        that were not detected have no p-value. Even for ``alpha2 >=
+        alpha``, the result may differ from an actual run with ``alpha2``,
+        because the sub-series that are tested after a change depend on
+        the change points found with the original ``alpha``.
     kwargs : dict, optional
         Extra keyword arguments to be applied to
         ``ChangeDetection.__init__``.
     """
 
-    def __init__(self, ml=None, n=1, alpha=0.01, *args, **kwargs):
+    def __init__(self, ml=None, n=1, alpha=0.01, chunks=None,
+                 cdf_table=False, stats=False, *args, **kwargs):
         self.ml = ml
         self.n = n
         self.alpha = alpha
+        self.chunks = chunks
+        self.cdf_table = cdf_table
+        self.stats = stats
         super().__init__(*args, **kwargs)
 
-    def apply(self, ds):
-        return _change_detection(ds, alpha=self.alpha, ml=self.ml, n=self.n,
-                                 njobs=self.njobs)
+    def apply(self, ds, path=None):
+        """
+        Apply the change detection to a dataset.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+            A (multilooked) dataset in covariance matrix format.
+        path : str, optional
+            If given, the change cube is computed block by block and written
+            to this NetCDF file as it is computed, so that it is never held
+            in memory in its entirety. The result is then read lazily from
+            that file.
+
+        Returns
+        -------
+        xarray.DataArray or xarray.Dataset
+            A boolean DataArray indicating whether a change occurred at each
+            (y, x, time) coordinate. If `stats` is True, a Dataset also
+            containing the p-values and test statistics.
+        """
+        change = _change_detection(ds, alpha=self.alpha, ml=self.ml,
+                                   n=self.n, njobs=self.njobs,
+                                   chunks=self.chunks,
+                                   cdf_table=self.cdf_table,
+                                   stats=self.stats)
+        if path is None:
+            return change
+
+        if self.stats:
+            to_netcdf(change, path)
+            return open_netcdf(path, chunks={})
+
+        to_netcdf(change.to_dataset(), path)
+        return open_netcdf(path, chunks={})['change']
+
+    def get_state(self, ds, change):
+        """
+        Compute the per-pixel state of the test after processing `ds`.
+
+        The state can be stored alongside the results (e.g. using
+        :meth:`nd.io.to_netcdf`) and later passed to :meth:`update` to
+        process new acquisitions without reprocessing the entire time series.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+            The dataset that was passed to :meth:`apply`.
+        change : xarray.DataArray
+            The boolean change cube returned by :meth:`apply`.
+
+        Returns
+        -------
+        xarray.Dataset
+            The state, containing for each pixel the sums of the covariance
+            matrix components (``sum_*``) and of the log-determinants
+            (``sum_log_det``) since the last change, as well as the time
+            index of the last change (``last_change``).
+        """
+        if isinstance(change, xr.Dataset):
+            change = change['change']
+        return _omnibus_state(ds, change, ml=self.ml, n=self.n)
+
+    def update(self, state, ds):
+        """
+        Fold new acquisitions into an existing state.
+
+        Each new acquisition is tested against the series since the last
+        detected change, at a cost independent of the length of the time
+        series. Unlike :meth:`apply`, changes that only become significant
+        in hindsight within an earlier part of the series are not revisited.
+
+        Parameters
+        ----------
+        state : xarray.Dataset
+            The state as returned by :meth:`get_state` or :meth:`update`.
+        ds : xarray.Dataset
+            The new acquisition(s), in the same format as the dataset that
+            the state was computed from.
+
+        Returns
+        -------
+        tuple (xarray.DataArray, xarray.Dataset)
+            A boolean DataArray indicating whether a change occurred at each
+            new acquisition, and the updated state.
+        """
+        if 'time' not in ds.dims:
+            ds = ds.expand_dims('time')
+        return _omnibus_update(state, ds, alpha=self.alpha, ml=self.ml)
@@ -1,6 +1,14 @@
+import os
+import pytest
+import numpy as np
 import xarray as xr
+from numpy.testing import assert_allclose, assert_equal
+from scipy.stats import chi2
+from xarray.testing import assert_equal as xr_assert_equal
 from nd import testing
-from nd.change import OmnibusTest
+from nd.change import OmnibusTest, _omnibus
+from nd.change.omnibus_ import _prepare
+from nd.io import to_netcdf, open_netcdf, disassemble_complex
 
 
 def test_change():
@@ -14,3 +22,165 @@ def test_change():
     changes = OmnibusTest(n=9, alpha=0.9).apply(ds)
     assert changes.isel(time=5).all()
     assert (changes.sum(dim='time') == 1).all()
+
+
+def _generate_change_dataset():
+    ds1 = testing.generate_test_dataset(
+        mean=[1, 0, 0, 1], sigma=0.1, ny=5, nx=5
+        ).isel(time=slice(None, 5))
+    ds2 = testing.generate_test_dataset(
+        mean=[10, 0, 0, 10], sigma=0.1, ny=5, nx=5
+        ).isel(time=slice(5, None))
+    return xr.concat([ds1, ds2], dim='time')
+
+
+def test_change_chunked():
+    ds = _generate_change_dataset()
+    changes = OmnibusTest(n=9, alpha=0.9).apply(ds)
+    changes_chunked = OmnibusTest(
+        n=9, alpha=0.9, chunks={'y': 2, 'x': 3, 'time': 2}).apply(ds)
+    assert changes_chunked.chunks is not None
+    xr_assert_equal(changes, changes_chunked.compute())
+
+
+@pytest.mark.parametrize('chunks', [None, {'y': 2, 'x': 3, 'time': 2}])
+def test_change_multilook_spatial_only(chunks):
+    # Multilooking must average over space only, never over time.
+    ds = _generate_change_dataset()
+    ds = ds.mean(['y', 'x']).broadcast_like(ds).transpose(*ds.dims)
+    if chunks is not None:
+        ds = ds.chunk(chunks)
+    ds_m, _, n = _prepare(ds, ml=3)
+    assert n == 9
+    xr.testing.assert_allclose(ds_m.compute(),
+                               disassemble_complex(ds).compute())
+
+
+def test_change_write_to_path(tmpdir):
+    ds = _generate_change_dataset().chunk({'y': 2, 'x': 2})
+    path = str(tmpdir.join('change.nc'))
+    changes = OmnibusTest(n=9, alpha=0.9).apply(ds, path=path)
+    assert os.path.isfile(path)
+    assert changes.isel(time=5).all()
+    assert (changes.sum(dim='time') == 1).all()
+
+
+def test_change_cdf_table():
+    ds = _generate_change_dataset()
+    xr_assert_equal(
+        OmnibusTest(n=9, alpha=0.9).apply(ds),
+        OmnibusTest(n=9, alpha=0.9, cdf_table=True).apply(ds)
+    )
+
+
+def test_single_pixel_change_detection():
+    ds = _generate_change_dataset()
+    values = np.ascontiguousarray(
+        ds[['C11', 'C12__re', 'C12__im', 'C22']].to_array()
+        .transpose('y', 'x', 'time', 'variable').values)
+    expected = np.asarray(_omnibus.change_detection(values, alpha=0.9, n=9))
+    for i in range(values.shape[0]):
+        for j in range(values.shape[1]):
+            result = np.zeros(values.shape[2], dtype=np.uint8)
+            _omnibus.single_pixel_change_detection(
+                values[i, j], result, alpha=0.9, n=9)
+            assert_equal(result, expected[i, j])
+
+
+def test_change_stats():
+    ds = _generate_change_dataset()
+    alpha = 0.9
+    changes = OmnibusTest(n=9, alpha=alpha).apply(ds)
+    result = OmnibusTest(n=9, alpha=alpha, stats=True).apply(ds)
+    assert isinstance(result, xr.Dataset)
+    xr_assert_equal(changes, result['change'])
+    # The statistics are only stored where a change was detected.
+    xr_assert_equal(result['change'], result['pvalue'].notnull())
+    xr_assert_equal(result['change'], result['statistic'].notnull())
+    assert (result['pvalue'].where(result['change']) < 1 - alpha).sum() \
+        == result['change'].sum()
+
+
+@pytest.mark.parametrize('cdf_table', [False, True])
+def test_change_stats_small_pvalues(cdf_table):
+    ds = _generate_change_dataset()
+    result = OmnibusTest(n=9, alpha=0.9, stats=True,
+                         cdf_table=cdf_table).apply(ds)
+    # The change at t=5 is detected by the test of the series up to t=5.
+    k = 6
+    constants = _omnibus._precompute_constants(2, k, 9)
+    f, omega2 = constants['f'][k], constants['omega2'][k]
+    z = result['statistic'].isel(time=5).values
+    expected = chi2.sf(z, f) + omega2 * (chi2.sf(z, f + 4) - chi2.sf(z, f))
+    pvalue = result['pvalue'].isel(time=5).values
+    assert (expected < 1e-10).all()
+    assert_allclose(pvalue, expected, rtol=1e-8)
+
+
+def test_change_stats_chunked():
+    ds = _generate_change_dataset()
+    result = OmnibusTest(n=9, alpha=0.9, stats=True).apply(ds)
+    result_chunked = OmnibusTest(
+        n=9, alpha=0.9, stats=True, chunks={'y': 2, 'x': 2}).apply(ds)
+    xr.testing.assert_allclose(result, result_chunked.compute())
+
+
+@pytest.mark.parametrize('chunks', [None, {'y': 2, 'x': 2}])
+def test_change_float32(chunks):
+    ds = _generate_change_dataset()
+    ds32 = ds.astype(np.float32)
+    result = OmnibusTest(n=9, alpha=0.9, stats=True).apply(ds)
+    result32 = OmnibusTest(n=9, alpha=0.9, stats=True,
+                           chunks=chunks).apply(ds32)
+    assert result32['pvalue'].dtype == np.float32
+    assert result32['statistic'].dtype == np.float32
+    xr_assert_equal(result['change'], result32['change'])
+    xr.testing.assert_allclose(result, result32.compute().astype(np.float64),
+                               rtol=1e-4)
+
+
+def test_change_fullpol():
+    variables = ['C11', 'C12__re', 'C12__im', 'C13__re', 'C13__im',
+                 'C22', 'C23__re', 'C23__im', 'C33']
+    ds1 = testing.generate_test_dataset(
+        var=variables, mean=[1, 0, 0, 0, 0, 1, 0, 0, 1], sigma=0.1,
+        ny=5, nx=5
+        ).isel(time=slice(None, 5))
+    ds2 = testing.generate_test_dataset(
+        var=variables, mean=[10, 0, 0, 0, 0, 10, 0, 0, 10], sigma=0.1,
+        ny=5, nx=5
+        ).isel(time=slice(5, None))
+    ds = xr.concat([ds1, ds2], dim='time')
+    changes = OmnibusTest(n=9, alpha=0.9).apply(ds)
+    assert changes.isel(time=5).all()
+    assert (changes.sum(dim='time') == 1).all()
+
+
+def test_change_update():
+    ds = _generate_change_dataset()
+    omnibus = OmnibusTest(n=9, alpha=0.9)
+    changes = omnibus.apply(ds)
+
+    # Process the first acquisitions at once, then fold in the remaining
+    # acquisitions one at a time.
+    ds_init = ds.isel(time=slice(None, 4))
+    state = omnibus.get_state(ds_init, omnibus.apply(ds_init))
+    updates = []
+    for t in range(4, ds.sizes['time']):
+        change, state = omnibus.update(state, ds.isel(time=[t]))
+        updates.append(change)
+    xr_assert_equal(changes.isel(time=slice(4, None)),
+                    xr.concat(updates, dim='time'))
+    assert (state['last_change'] == 5).all()
+
+
+def test_change_update_from_file(tmpdir):
+    ds = _generate_change_dataset()
+    omnibus = OmnibusTest(n=9, alpha=0.9)
+    ds_init = ds.isel(time=slice(None, 4))
+    state = omnibus.get_state(ds_init, omnibus.apply(ds_init))
+    path = str(tmpdir.join('state.nc'))
+    to_netcdf(state, path)
+    change, _ = omnibus.update(open_netcdf(path),
+                               ds.isel(time=slice(4, None)))
+    xr_assert_equal(omnibus.apply(ds).isel(time=slice(4, None)), change)
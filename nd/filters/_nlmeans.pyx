@@ -8,6 +8,9 @@ from libc.math cimport abs, log, isnan, exp
 
 ctypedef Py_ssize_t SIZE_TYPE
 
+# The approximate memory used by the buffers of _pixelwise_nlmeans_3d.
+DEF BLOCK_BYTES = 2**26
+
 cdef short EDGE_MODE_REFLECT = 0
 cdef short EDGE_MODE_REPEAT = 1
 
@@ -33,8 +36,8 @@ cdef double _dsquare(floating [:, :, :] Bp, floating [:, :, :] Bq):
     return dsquare
 
 
-cdef Py_ssize_t _idx(Py_ssize_t i, Py_ssize_t shape,
-                     short mode=EDGE_MODE_REFLECT):
+cdef inline Py_ssize_t _idx(Py_ssize_t i, Py_ssize_t shape,
+                            short mode=EDGE_MODE_REFLECT) nogil:
     """
     Sanitize index i given the shape of its dimension
     by reflecting at the boundary.
@@ -60,10 +63,22 @@ cdef Py_ssize_t _idx(Py_ssize_t i, Py_ssize_t shape,
         else:
             return i
 
+    return i
+
+
+def _pad(arr, width):
+    """
+    Return a C-contiguous copy of `arr`, reflect-padded by `width[i]` pixels
+    on both sides of axis i. The last axis (variables) is not padded.
+    The reflection matches that of `_idx()`.
+    """
+    pad_width = [(w, w) for w in width] + [(0, 0)]
+    return np.ascontiguousarray(np.pad(arr, pad_width, mode='reflect'))
+
 
-# @cython.boundscheck(False)
-# @cython.wraparound(False)
-# @cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
 cpdef void _patchwise_nlmeans(np.ndarray[floating, ndim=3] arr,
                               np.ndarray[floating, ndim=3] output,
                               unsigned int r, unsigned int f,
@@ -73,19 +88,23 @@ cpdef void _patchwise_nlmeans(np.ndarray[floating, ndim=3] arr,
         SIZE_TYPE ncols = arr.shape[1]
         SIZE_TYPE nvars = arr.shape[2]
         SIZE_TYPE ndims = 2
+        SIZE_TYPE R = r, F = f, B = r + f
         SIZE_TYPE i, j, v
         SIZE_TYPE ip, jp, iq, jq
-        int di, dj
+        SIZE_TYPE di, dj
         double total_weight, max_weight, weight, dsquare
-        np.ndarray[floating, ndim=3] weighted_sum
+        floating [:, :, ::1] padded = _pad(arr, (B, B))
+        SIZE_TYPE W = 2*max(R, F) + 1
+        double [:, :, ::1] weighted_sum = np.zeros((W, W, nvars))
+        # The output of patches that extend beyond the image is accumulated
+        # in a padded buffer and reflected back onto the image at the end.
+        double [:, :, ::1] padded_output = \
+            np.zeros((nrows + 2*R, ncols + 2*R, nvars))
         short m = EDGE_MODE_REFLECT
 
-    # Make sure output is zero before we start.
-    for i in range(nrows):
-        for j in range(ncols):
-            for v in range(nvars):
-                output[i, j, v] = 0
-
+    # All indices below refer to the padded arrays, such that the pixel
+    # (ip, jp) of the image is padded[ip + B, jp + B] and
+    # padded_output[ip + R, jp + R].
     for ip in range(0, nrows):
         for jp in range(0, ncols):
             #
@@ -95,31 +114,28 @@ cpdef void _patchwise_nlmeans(np.ndarray[floating, ndim=3] arr,
             # Initialize weights
             total_weight = 0
             max_weight = 0
-            weighted_sum = np.zeros((2*r+1, 2*r+1, nvars))
+            weighted_sum[:, :, :] = 0
 
             # Loop through all patches Q in neighborhood of P
-            for iq in range(ip - r, ip + r + 1):
-                for jq in range(jp - r, jp + r + 1):
+            for iq in range(ip, ip + 2*R + 1):
+                for jq in range(jp, jp + 2*R + 1):
                     # Exclude p == q for now.
-                    if (ip == iq) and (jp == jq):
+                    if (iq == ip + R) and (jq == jp + R):
                         continue
 
                     #
-                    # (iq, jq) is now the center of patch Q
+                    # (iq - R, jq - R) is now the center of patch Q
                     #
                     dsquare = 0
-                    for di in range(-f, f+1):
-                        for dj in range(-f, f+1):
+                    for di in range(2*F + 1):
+                        for dj in range(2*F + 1):
                             for v in range(nvars):
                                 dsquare += (
-                                    arr[_idx(ip + di, nrows, m),
-                                        _idx(jp + dj, ncols, m), v] -
-                                    arr[_idx(iq + di, nrows, m),
-                                        _idx(jq + dj, ncols, m), v]
+                                    padded[ip + R + di, jp + R + dj, v] -
+                                    padded[iq + di, jq + dj, v]
                                 ) ** 2
 
-
-                    dsquare /= nvars * (2*f + 1)**ndims
+                    dsquare /= nvars * (2*F + 1)**ndims
 
                     weight = exp( -max(dsquare - 2*sigma**2, 0) / h**2 )
 
@@ -127,12 +143,11 @@ cpdef void _patchwise_nlmeans(np.ndarray[floating, ndim=3] arr,
                     if weight > max_weight:
                         max_weight = weight
 
-                    for i in range(iq - f, iq + f + 1):
-                        for j in range(jq - f, jq + f + 1):
+                    for i in range(2*F + 1):
+                        for j in range(2*F + 1):
                             for v in range(nvars):
-                                weighted_sum[i - iq + f, j - jq + f, v] += \
-                                    weight * arr[_idx(i, nrows, m),
-                                                 _idx(j, ncols, m), v]
+                                weighted_sum[i, j, v] += \
+                                    weight * padded[iq + i, jq + j, v]
 
             # Now we have the weighted sum w(Bp, Bq)
 
@@ -140,28 +155,26 @@ cpdef void _patchwise_nlmeans(np.ndarray[floating, ndim=3] arr,
             # And assign to output pixel
             total_weight += max_weight
 
-            for i in range(ip - r, ip + r + 1):
-                for j in range(jp - r, jp + r + 1):
+            for i in range(2*R + 1):
+                for j in range(2*R + 1):
                     for v in range(nvars):
-                        # weighted_sum[i-iP_min, j-jP_min, v] += \
-                        #     max_weight * arr[i, j, v]
-                        # output[i, j, v] = weighted_sum[i, j, v] / total_weight
-                        output[_idx(i, nrows, m), _idx(j, ncols, m), v] += (
-                            weighted_sum[i - ip + r, j - jp + r, v] + \
-                            max_weight * \
-                            arr[_idx(i, nrows, m), _idx(j, ncols, m), v]
+                        padded_output[ip + i, jp + j, v] += (
+                            weighted_sum[i, j, v] + max_weight *
+                            padded[ip + F + i, jp + F + j, v]
                         ) / total_weight
-                        # output[i, j, v] = \
-                        #     (weighted_sum[i-iP_min, j-jP_min, v] + \
-                        #     max_weight * arr[i, j, v]) / total_weight
 
-    # Need to renormalize every output pixel by the number of times it has been
-    # computed.
+    # Reflect the padded output back onto the image and renormalize every
+    # output pixel by the number of times it has been computed.
+    output[:, :, :] = 0
+    for i in range(nrows + 2*R):
+        for j in range(ncols + 2*R):
+            for v in range(nvars):
+                output[_idx(i - R, nrows, m), _idx(j - R, ncols, m), v] += \
+                    padded_output[i, j, v]
     for i in range(nrows):
         for j in range(ncols):
             for v in range(nvars):
-                output[i, j, v] /= (2*r + 1)**2
-
+                output[i, j, v] /= (2*R + 1)**2
 
 
 @cython.boundscheck(False)
@@ -175,20 +188,16 @@ cpdef void _pixelwise_nlmeans(floating [:, :, :] arr,
         SIZE_TYPE nrows = arr.shape[0]
         SIZE_TYPE ncols = arr.shape[1]
         SIZE_TYPE nvars = arr.shape[2]
-        SIZE_TYPE i, j, v, ip, jp, iq, jq
+        SIZE_TYPE R = r, F = f, B = r + f
+        SIZE_TYPE v, ip, jp, iq, jq
         SIZE_TYPE di, dj
         double total_weight, max_weight, weight, dsquare
-        floating [:] weighted_sum = np.zeros(nvars)
+        floating [:, :, ::1] padded = _pad(arr, (B, B))
+        double [:] weighted_sum = np.zeros(nvars)
         SIZE_TYPE ndims = 2
-        short m = EDGE_MODE_REFLECT
-
-    # Make sure output is zero before we start.
-    for i in range(nrows):
-        for j in range(ncols):
-            for v in range(nvars):
-                output[i, j, v] = 0
 
     # Loop through all pixels p in the image.
+    # The pixel (ip, jp) of the image is padded[ip + B, jp + B].
     for ip in range(nrows):
         for jp in range(ncols):
             # Initialize all weights to 0
@@ -199,27 +208,26 @@ cpdef void _pixelwise_nlmeans(floating [:, :, :] arr,
 
             # For the pixel p = (ip, jp), compute the weight
             # of every other pixel in the neighborhood B(p, r).
-            for iq in range(ip - r, ip + r + 1):
-                for jq in range(jp - r, jp + r + 1):
+            # The patch around q = (iq, jq) starts at padded[iq, jq].
+            for iq in range(ip, ip + 2*R + 1):
+                for jq in range(jp, jp + 2*R + 1):
                     # Compute the weight between pixel p = (ip, jp)
-                    # and pixel q = (iq, jq)
+                    # and pixel q = (iq - R, jq - R)
 
                     # Exclude p == q for now.
-                    if (ip == iq) and (jp == jq):
+                    if (iq == ip + R) and (jq == jp + R):
                         continue
 
                     dsquare = 0
-                    for di in range(-f, f + 1):
-                        for dj in range(-f, f + 1):
+                    for di in range(2*F + 1):
+                        for dj in range(2*F + 1):
                             for v in range(nvars):
                                 dsquare += (
-                                    arr[_idx(ip + di, nrows, m),
-                                        _idx(jp + dj, ncols, m), v] -
-                                    arr[_idx(iq + di, nrows, m),
-                                        _idx(jq + dj, ncols, m), v]
+                                    padded[ip + R + di, jp + R + dj, v] -
+                                    padded[iq + di, jq + dj, v]
                                 ) ** 2
 
-                    dsquare /= nvars * (2*f + 1)**ndims
+                    dsquare /= nvars * (2*F + 1)**ndims
 
                     # Update weights
                     weight = exp( -max(dsquare - 2*sigma**2, 0) / h**2 )
@@ -229,8 +237,7 @@ cpdef void _pixelwise_nlmeans(floating [:, :, :] arr,
                         max_weight = weight
 
                     for v in range(nvars):
-                        weighted_sum[v] += weight * arr[_idx(iq, nrows, m),
-                                                        _idx(jq, ncols, m), v]
+                        weighted_sum[v] += weight * padded[iq + F, jq + F, v]
 
             # Include pixel itself
             # And assign to output pixel
@@ -240,7 +247,6 @@ cpdef void _pixelwise_nlmeans(floating [:, :, :] arr,
                 output[ip, jp, v] = weighted_sum[v] / total_weight
 
 
-
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
@@ -248,85 +254,174 @@ cpdef void _pixelwise_nlmeans_3d(floating [:, :, :, :] arr,
                                  floating [:, :, :, :] output,
                                  unsigned int [:] r,
                                  unsigned int [:] f,
-                                 double sigma, double h):
+                                 double sigma, double h,
+                                 unsigned int njobs=1,
+                                 SIZE_TYPE block_rows=0):
+    """
+    Pixelwise Non-Local Means in up to three dimensions. The last axis
+    of `arr` contains the variables.
+
+    Rather than comparing every pair of patches separately, the search
+    window is traversed one offset at a time (Darbon2008). For each offset,
+    the squared difference between the image and its shifted copy is
+    computed once, and the distances of all patch pairs are read from its
+    summed-area table. The cost per pixel is therefore independent of the
+    patch size `f`.
+
+    The summed-area table and the accumulated weights take about
+    ``8 * (nvars + 3)`` bytes per pixel in double precision. To bound this,
+    the image is processed in blocks of `block_rows` along the first axis,
+    by default as many as fit into ``BLOCK_BYTES``. Each block recomputes
+    the squared differences of the ``2*f[0]`` rows it shares with its
+    neighbours. Pixels whose weights all underflow to zero keep their
+    value.
+
+    The pixels are distributed across `njobs` OpenMP threads.
+
+    Darbon, J., Cunha, A., Chan, T. F., Osher, S., & Jensen, G. J. (2008).
+    Fast nonlocal filtering applied to electron cryomicroscopy.
+    ISBI 2008, 1331–1334. https://doi.org/10.1109/ISBI.2008.4541250
+    """
     cdef:
-        SIZE_TYPE ndims = 3
-        SIZE_TYPE [3] N = [arr.shape[0], arr.shape[1], arr.shape[2]]
+        SIZE_TYPE N0 = arr.shape[0]
+        SIZE_TYPE N1 = arr.shape[1]
+        SIZE_TYPE N2 = arr.shape[2]
         SIZE_TYPE nvars = arr.shape[3]
-        SIZE_TYPE [3] i, p, q, d
-        floating total_weight, max_weight, weight, dsquare
-        floating [:] weighted_sum
-        floating dsq_norm = nvars * (2*f[0] + 1) * (2*f[1] + 1) * (2*f[2] + 1)
-        short m = EDGE_MODE_REFLECT
+        SIZE_TYPE R0 = r[0], R1 = r[1], R2 = r[2]
+        SIZE_TYPE F0 = f[0], F1 = f[1], F2 = f[2]
+        # The pixel p of the image is padded[p0 + R0 + F0, p1 + R1 + F1,
+        # p2 + R2 + F2].
+        floating [:, :, :, ::1] padded = _pad(arr, (R0 + F0, R1 + F1,
+                                                    R2 + F2))
+        # The extent of the patches centered on all pixels.
+        SIZE_TYPE M1 = N1 + 2*F1
+        SIZE_TYPE M2 = N2 + 2*F2
+        SIZE_TYPE i, j, k, v, o0, o1, o2, p0, p1, p2, q0, q1, q2
+        # The first row of the current block, and its number of rows
+        # without (n0) and with (m0) the extent of the patches.
+        SIZE_TYPE a, n0, m0
+        double dsq_norm = nvars * (2*F0 + 1) * (2*F1 + 1) * (2*F2 + 1)
+        double s2 = 2 * sigma**2
+        double h2 = h**2
+        double diff, dsquare, weight, mw
+        int num_threads = max(njobs, 1)
+        double [:, :, ::1] S
+        double [:, :, ::1] total_weight
+        double [:, :, ::1] max_weight
+        double [:, :, :, ::1] weighted_sum
+
+    if block_rows <= 0:
+        block_rows = BLOCK_BYTES // (8 * ((M1 + 1) * (M2 + 1) +
+                                          N1 * N2 * (nvars + 2)))
+    block_rows = max(1, min(block_rows, N0))
+
+    # Summed-area table of the squared differences, with a leading
+    # row of zeros along each axis.
+    S = np.zeros((block_rows + 2*F0 + 1, M1 + 1, M2 + 1))
+    total_weight = np.empty((block_rows, N1, N2))
+    max_weight = np.empty((block_rows, N1, N2))
+    # The weighted sums are accumulated in double precision, and only
+    # the final result is stored in the output.
+    weighted_sum = np.empty((block_rows, N1, N2, nvars))
+
+    for a in range(0, N0, block_rows):
+        n0 = min(block_rows, N0 - a)
+        m0 = n0 + 2*F0
+        total_weight[:, :, :] = 0
+        max_weight[:, :, :] = 0
+        weighted_sum[:, :, :, :] = 0
+
+        for o0 in range(-R0, R0 + 1):
+            for o1 in range(-R1, R1 + 1):
+                for o2 in range(-R2, R2 + 1):
+                    # Exclude p == q for now.
+                    if o0 == 0 and o1 == 0 and o2 == 0:
+                        continue
 
-    dtype = np.float32 if floating is float else np.float64
-    weighted_sum = np.zeros(nvars, dtype=dtype)
+                    #
+                    # Squared difference between the block and its copy
+                    # shifted by the offset o.
+                    #
+                    for i in prange(m0, nogil=True, schedule='static',
+                                    num_threads=num_threads):
+                        for j in range(M1):
+                            for k in range(M2):
+                                dsquare = 0
+                                for v in range(nvars):
+                                    diff = (
+                                        padded[a + i + R0, j + R1, k + R2,
+                                               v] -
+                                        padded[a + i + R0 + o0, j + R1 + o1,
+                                               k + R2 + o2, v]
+                                    )
+                                    dsquare = dsquare + diff * diff
+                                S[i + 1, j + 1, k + 1] = dsquare
 
-    # Make sure output is zero before we start.
-    for i[0] in range(N[0]):
-        for i[1] in range(N[1]):
-            for i[2] in range(N[2]):
-                for v in range(nvars):
-                    output[i[0], i[1], i[2], v] = 0
+                    #
+                    # Cumulative sums along each axis.
+                    #
+                    for i in prange(1, m0 + 1, nogil=True, schedule='static',
+                                    num_threads=num_threads):
+                        for j in range(1, M1 + 1):
+                            for k in range(2, M2 + 1):
+                                S[i, j, k] = S[i, j, k] + S[i, j, k - 1]
+                            if j > 1:
+                                for k in range(1, M2 + 1):
+                                    S[i, j, k] = S[i, j, k] + S[i, j - 1, k]
+                    for j in prange(1, M1 + 1, nogil=True, schedule='static',
+                                    num_threads=num_threads):
+                        for i in range(2, m0 + 1):
+                            for k in range(1, M2 + 1):
+                                S[i, j, k] = S[i, j, k] + S[i - 1, j, k]
 
-    # Loop through all pixels p in the image.
-    for p[0] in range(N[0]):
-        for p[1] in range(N[1]):
-            for p[2] in range(N[2]):
-                # Initialize all weights to 0
-                total_weight = 0
-                max_weight = 0
-                for v in range(nvars):
-                    weighted_sum[v] = 0
-
-                # For the pixel p, compute the weight
-                # of every other pixel in the neighborhood B(p, r).
-                for q[0] in range(p[0] - r[0], p[0] + r[0] + 1):
-                    for q[1] in range(p[1] - r[1], p[1] + r[1] + 1):
-                        for q[2] in range(p[2] - r[2], p[2] + r[2] + 1):
-                            # Compute the weight between pixel p and q
-
-                            # Exclude p == q for now.
-                            if (p[0] == q[0]) and (p[1] == q[1]) and (p[2] == q[2]):
-                                continue
-
-                            dsquare = 0
-                            for d[0] in range(-f[0], f[0] + 1):
-                                for d[1] in range(-f[1], f[1] + 1):
-                                    for d[2] in range(-f[2], f[2] + 1):
-                                        for v in range(nvars):
-                                            dsquare += (
-                                                arr[_idx(p[0] + d[0], N[0], m),
-                                                    _idx(p[1] + d[1], N[1], m),
-                                                    _idx(p[2] + d[2], N[2], m),
-                                                    v] -
-                                                arr[_idx(q[0] + d[0], N[0], m),
-                                                    _idx(q[1] + d[1], N[1], m),
-                                                    _idx(q[2] + d[2], N[2], m),
-                                                    v]
-                                            ) ** 2
-
-                            dsquare /= dsq_norm
-
-                            # Update weights
-                            weight = exp( -max(dsquare - 2*sigma**2, 0) / h**2 )
-
-                            total_weight += weight
-                            if weight > max_weight:
-                                max_weight = weight
+                    #
+                    # Read the patch distances from the summed-area table
+                    # and update the weights. p0 is relative to the block.
+                    #
+                    for i in prange(n0 * N1, nogil=True, schedule='static',
+                                    num_threads=num_threads):
+                        p0 = i // N1
+                        p1 = i % N1
+                        q0 = a + p0 + R0 + F0 + o0
+                        q1 = p1 + R1 + F1 + o1
+                        for p2 in range(N2):
+                            q2 = p2 + R2 + F2 + o2
+                            dsquare = (
+                                S[p0 + 2*F0 + 1, p1 + 2*F1 + 1,
+                                  p2 + 2*F2 + 1] -
+                                S[p0, p1 + 2*F1 + 1, p2 + 2*F2 + 1] -
+                                S[p0 + 2*F0 + 1, p1, p2 + 2*F2 + 1] -
+                                S[p0 + 2*F0 + 1, p1 + 2*F1 + 1, p2] +
+                                S[p0, p1, p2 + 2*F2 + 1] +
+                                S[p0, p1 + 2*F1 + 1, p2] +
+                                S[p0 + 2*F0 + 1, p1, p2] -
+                                S[p0, p1, p2]
+                            ) / dsq_norm
+
+                            weight = exp(-max(dsquare - s2, 0) / h2)
+
+                            total_weight[p0, p1, p2] = \
+                                total_weight[p0, p1, p2] + weight
+                            if weight > max_weight[p0, p1, p2]:
+                                max_weight[p0, p1, p2] = weight
 
                             for v in range(nvars):
-                                weighted_sum[v] += weight * \
-                                    arr[_idx(q[0], N[0], m),
-                                        _idx(q[1], N[1], m),
-                                        _idx(q[2], N[2], m), v]
-
-                if max_weight == 0:
-                    max_weight = 1
-
-                # Include pixel itself
-                # And assign to output pixel
-                total_weight += max_weight
+                                weighted_sum[p0, p1, p2, v] = \
+                                    weighted_sum[p0, p1, p2, v] + \
+                                    weight * padded[q0, q1, q2, v]
+
+        # Include pixel itself
+        # And normalize the output
+        for i in prange(n0 * N1, nogil=True, schedule='static',
+                        num_threads=num_threads):
+            p0 = i // N1
+            p1 = i % N1
+            for p2 in range(N2):
+                mw = max_weight[p0, p1, p2]
+                if mw == 0:
+                    mw = 1
                 for v in range(nvars):
-                    weighted_sum[v] += max_weight * arr[p[0], p[1], p[2], v]
-                    output[p[0], p[1], p[2], v] = weighted_sum[v] / total_weight
+                    output[a + p0, p1, p2, v] = <floating>((
+                        weighted_sum[p0, p1, p2, v] +
+                        mw * arr[a + p0, p1, p2, v]
+                    ) / (total_weight[p0, p1, p2] + mw))
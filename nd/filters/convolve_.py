@@ -1,8 +1,23 @@
 import numpy as np
 import scipy.ndimage.filters as snf
+import scipy.signal
 from . import Filter
 
 
+# Kernels with more elements than this are convolved via FFT if they are
+# not separable.
+FFT_MIN_KERNEL_SIZE = 64
+
+# Translate scipy.ndimage boundary modes into numpy.pad modes.
+_PAD_MODES = {
+    'reflect': 'symmetric',
+    'mirror': 'reflect',
+    'nearest': 'edge',
+    'wrap': 'wrap',
+    'constant': 'constant'
+}
+
+
 def _expand_kernel(kernel, kernel_dims, new_dims):
     """
     Reshape a kernel spanning some dimensions to cover a superset of
@@ -45,6 +60,147 @@ def _expand_kernel(kernel, kernel_dims, new_dims):
     return kernel.reshape(new_kernel_shape)
 
 
+def _separate_kernel(kernel):
+    """
+    Factorize a kernel into one-dimensional kernels if it is separable,
+    i.e. the outer product of one vector per axis.
+
+    Parameters
+    ----------
+    kernel : ndarray
+        An n-dimensional kernel.
+
+    Returns
+    -------
+    list of ndarray or None
+        The one-dimensional kernels, or None if `kernel` is not separable.
+    """
+    if kernel.ndim == 0 or not np.any(kernel):
+        return None
+
+    # If the kernel is separable, any line through its largest element
+    # is proportional to the corresponding factor.
+    center = np.unravel_index(np.argmax(np.abs(kernel)), kernel.shape)
+    factors = []
+    for axis in range(kernel.ndim):
+        index = list(center)
+        index[axis] = slice(None)
+        factors.append(np.array(kernel[tuple(index)], dtype=np.float64))
+    for f in factors[1:]:
+        f /= kernel[center]
+
+    outer = factors[0]
+    for f in factors[1:]:
+        outer = np.multiply.outer(outer, f)
+    if not np.allclose(outer, kernel, rtol=1e-12, atol=0):
+        return None
+    return factors
+
+
+def _select_method(kernel):
+    """
+    Choose the fastest convolution method for a kernel.
+    """
+    if kernel.size > 1 and np.all(kernel == kernel.flat[0]):
+        return 'uniform'
+    elif kernel.ndim > 1 and _separate_kernel(kernel) is not None:
+        return 'separable'
+    elif kernel.size > FFT_MIN_KERNEL_SIZE:
+        return 'fft'
+    else:
+        return 'direct'
+
+
+def _convolve(arr, kernel, output, axes, method, mode='reflect', cval=0.0,
+              origin=0):
+    """
+    Convolve a real valued array with a kernel spanning `axes`, writing the
+    result to `output`. All methods are equivalent to
+    ``scipy.ndimage.filters.convolve`` up to numerical precision.
+
+    Parameters
+    ----------
+    arr : ndarray
+        The input array.
+    kernel : ndarray
+        The kernel, with one dimension per entry in `axes`.
+    output : ndarray
+        The output array.
+    axes : tuple of int
+        The axes of `arr` corresponding to the kernel axes.
+    method : str {'direct', 'separable', 'fft', 'uniform'}
+        The convolution method.
+    mode, cval
+        See ``scipy.ndimage.filters.convolve``.
+    origin : int or sequence of int, optional
+        The placement of the kernel. A single value applies to all `axes`,
+        a sequence has one value per dimension of `arr`.
+    """
+    if np.ndim(origin) == 0:
+        origins = np.zeros(arr.ndim, dtype=int)
+        origins[list(axes)] = origin
+    else:
+        origins = np.asarray(origin, dtype=int)
+
+    if method == 'direct':
+        new_kernel_shape = np.ones(arr.ndim, dtype=int)
+        new_kernel_shape[list(axes)] = kernel.shape
+        snf.convolve(arr, kernel.reshape(new_kernel_shape), output=output,
+                     mode=mode, cval=cval, origin=tuple(origins))
+
+    elif method in ('separable', 'uniform') and mode == 'constant' and cval:
+        # Successive one-dimensional passes would pad the intermediate
+        # results with `cval`, so convolve the offset input instead.
+        _convolve(arr - cval, kernel, output, axes, method, mode=mode,
+                  cval=0.0, origin=origin)
+        output += cval * kernel.sum()
+
+    elif method == 'separable':
+        factors = _separate_kernel(kernel)
+        if factors is None:
+            raise ValueError('The kernel is not separable.')
+        source = arr
+        for ax, f in zip(axes, factors):
+            snf.convolve1d(source, f, axis=ax, output=output,
+                           mode=mode, cval=cval, origin=origins[ax])
+            source = output
+
+    elif method == 'uniform':
+        # A running-sum implementation whose cost is independent of the
+        # kernel size.
+        if not np.all(kernel == kernel.flat[0]):
+            raise ValueError('The kernel is not uniform.')
+        source = arr
+        for ax, w in zip(axes, kernel.shape):
+            # The running sum is a correlation. Convolution mirrors the
+            # origin and shifts kernels of even width by one.
+            _origin = -origins[ax] if w % 2 else -origins[ax] - 1
+            snf.uniform_filter1d(source, w, axis=ax, output=output,
+                                 mode=mode, cval=cval, origin=_origin)
+            source = output
+        output *= kernel.flat[0] * kernel.size
+
+    elif method == 'fft':
+        if np.any(origins):
+            raise ValueError('FFT convolution does not support `origin`.')
+        new_kernel_shape = np.ones(arr.ndim, dtype=int)
+        new_kernel_shape[list(axes)] = kernel.shape
+        pad = [(0, 0)] * arr.ndim
+        for ax, w in zip(axes, kernel.shape):
+            pad[ax] = ((w - 1) // 2, w // 2)
+        pad_kwargs = {'constant_values': cval} if mode == 'constant' else {}
+        padded = np.pad(arr, pad, mode=_PAD_MODES[mode], **pad_kwargs)
+        # Match the kernel precision to the data, so that single precision
+        # data is transformed in single precision.
+        kernel = kernel.astype(np.result_type(arr.dtype, np.float32),
+                               copy=False)
+        output[...] = scipy.signal.fftconvolve(
+            padded, kernel.reshape(new_kernel_shape), mode='valid')
+
+    else:
+        raise ValueError("Unsupported method: '{}'".format(method))
+
+
 class ConvolutionFilter(Filter):
     """
     Kernel-convolution of an xarray.Dataset.
@@ -57,33 +213,62 @@ class ConvolutionFilter(Filter):
         number of dimensions of the kernel.
     kernel : ndarray
         The convolution kernel.
+    method : str {'auto', 'direct', 'separable', 'fft', 'uniform'}, optional
+        The convolution method (default: 'auto').
+
+        * 'direct': ``scipy.ndimage.filters.convolve`` with the full kernel.
+
+        * 'separable': A sequence of one-dimensional convolutions.
+          Requires the kernel to be separable.
+
+        * 'fft': FFT convolution, efficient for large kernels.
+
+        * 'uniform': A running sum whose cost per pixel does not depend on
+          the kernel size. Requires all kernel elements to be equal.
+
+        * 'auto': Choose 'uniform' or 'separable' if the kernel allows it,
+          otherwise 'fft' for kernels with more than
+          ``FFT_MIN_KERNEL_SIZE`` elements and 'direct' for small kernels.
     kwargs : dict, optional
         Extra keyword arguments passed on to
-        ``scipy.ndimage.filters.convolve``.
+        ``scipy.ndimage.filters.convolve``: `mode`, `cval`, and `origin`.
+        A single `origin` applies to the kernel dimensions only.
     """
 
     per_variable = True
     kwargs = {}
+    method = 'auto'
 
-    def __init__(self, dims, kernel=None, **kwargs):
+    def __init__(self, dims, kernel=None, method='auto', **kwargs):
         if kernel is None:
             kernel = np.ones([1] * len(dims))
         self.dims = tuple(dims)
         self.kernel = kernel
+        self.method = method
         self.kwargs = kwargs
 
+    def _get_method(self):
+        if self.method != 'auto':
+            return self.method
+        method = _select_method(self.kernel)
+        if method == 'fft' and np.any(self.kwargs.get('origin', 0)):
+            # FFT convolution does not support `origin`.
+            return 'direct'
+        return method
+
+    def _halo(self):
+        origin = np.abs(self.kwargs.get('origin', 0))
+        return tuple(np.array(self.kernel.shape) // 2 + origin)
+
     def _filter(self, arr, axes, output):
-        # Reshape kernel to match dimension of input array.
-        new_kernel_shape = np.ones(arr.ndim, dtype=int)
-        new_kernel_shape[list(axes)] = self.kernel.shape
-        nd_kernel = self.kernel.reshape(new_kernel_shape)
+        method = self._get_method()
         if np.iscomplexobj(arr):
-            snf.convolve(np.real(arr), nd_kernel, output=np.real(output),
-                         **self.kwargs)
-            snf.convolve(np.imag(arr), nd_kernel, output=np.imag(output),
-                         **self.kwargs)
+            _convolve(np.real(arr), self.kernel, np.real(output), axes,
+                      method, **self.kwargs)
+            _convolve(np.imag(arr), self.kernel, np.imag(output), axes,
+                      method, **self.kwargs)
         else:
-            snf.convolve(arr, nd_kernel, output=output, **self.kwargs)
+            _convolve(arr, self.kernel, output, axes, method, **self.kwargs)
 
 
 class BoxcarFilter(ConvolutionFilter):
@@ -98,15 +283,19 @@ class BoxcarFilter(ConvolutionFilter):
     w : int
         The width of the boxcar window. Should be an odd integer in order to
         ensure symmetry.
+    method : str, optional
+        The convolution method, see :class:`ConvolutionFilter`. By default,
+        a running sum is used, whose cost does not depend on `w`.
     kwargs : dict, optional
         Extra keyword arguments passed on to
         ``scipy.ndimage.filters.convolve``.
     """
 
-    def __init__(self, dims, w=3, **kwargs):
+    def __init__(self, dims, w=3, method='auto', **kwargs):
         N = len(dims)
         self.dims = tuple(dims)
         self.kernel = np.ones((w,) * N, dtype=np.float64) / w**N
+        self.method = method
         self.kwargs = kwargs
 
 
@@ -139,6 +328,11 @@ class GaussianFilter(Filter):
         self.sigma = sigma
         self.kwargs = kwargs
 
+    def _halo(self):
+        # This is the kernel radius used by scipy.
+        truncate = self.kwargs.get('truncate', 4.0)
+        return tuple(int(truncate * float(s) + 0.5) for s in self.sigma)
+
     def _filter(self, arr, axes, output):
         # Generate n-dimensional sigma
         ndsigma = [0] * arr.ndim
@@ -149,7 +343,7 @@ class GaussianFilter(Filter):
             snf.gaussian_filter(np.real(arr), sigma=ndsigma,
                                 output=np.real(output), **self.kwargs)
             snf.gaussian_filter(np.imag(arr), sigma=ndsigma,
-                                output=np.real(output), **self.kwargs)
+                                output=np.imag(output), **self.kwargs)
         else:
             snf.gaussian_filter(arr, sigma=ndsigma, output=output,
                                 **self.kwargs)
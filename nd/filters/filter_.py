@@ -1,6 +1,8 @@
 from ..algorithm import Algorithm
 from abc import abstractmethod
 from ..utils import get_vars_for_dims, expand_variables
+import numpy as np
+import dask.array as da
 
 
 class Filter(Algorithm):
@@ -27,6 +29,10 @@ class Filter(Algorithm):
         """
         Apply the filter to the input dataset.
 
+        If the dataset is backed by dask arrays, the result is computed
+        lazily, block by block. Each block is extended by a halo of
+        neighboring pixels that is large enough for the filter footprint.
+
         Parameters
         ----------
         ds : xarray.Dataset
@@ -57,13 +63,12 @@ class Filter(Algorithm):
         #
         if self.per_variable:
             # Apply independently for each variable.
-            result = ds.copy(deep=True)
+            result = ds.copy()
             for v in variables:
-                vdims = result[v].dims
+                vdims = ds[v].dims
                 axes = tuple([vdims.index(d) for d in self.dims])
-                # Prepare data and output as numpy arrays
-                self._filter(ds[v].values, axes,
-                             output=result[v].values)
+                result[v] = ds[v].copy(
+                    data=self._filter_array(ds[v].data, axes))
 
         else:
             # The variables are an additional dimension.
@@ -71,11 +76,13 @@ class Filter(Algorithm):
 
             # convert to DataArray
             da_ordered = ds[variables].to_array().transpose(*ordered_dims)
-            da_filtered = da_ordered.copy()
             axes = tuple([da_ordered.dims.index(d) for d in self.dims])
-
-            # Prepare data and output as numpy arrays
-            self._filter(da_ordered.values, axes, output=da_filtered.values)
+            data = da_ordered.data
+            if isinstance(data, da.Array):
+                # All variables are required to compute the filter weights.
+                data = data.rechunk({data.ndim - 1: -1})
+            da_filtered = da_ordered.copy(
+                data=self._filter_array(data, axes))
 
             # Reassemble Dataset
             result = expand_variables(da_filtered)
@@ -88,6 +95,48 @@ class Filter(Algorithm):
 
         return result
 
+    def _filter_array(self, arr, axes):
+        """
+        Apply the filter to a numpy or dask array and return the result.
+        Dask arrays are filtered lazily.
+        """
+        if not isinstance(arr, da.Array):
+            output = np.empty_like(arr)
+            self._filter(arr, axes, output=output)
+            return output
+
+        def _filter_block(block):
+            output = np.empty_like(block)
+            self._filter(block, axes, output=output)
+            return output
+
+        halo = self._halo()
+        if halo is None:
+            # Without a known footprint, each block must span the
+            # filtered dimensions entirely.
+            arr = arr.rechunk({ax: -1 for ax in axes})
+            return arr.map_blocks(_filter_block, dtype=arr.dtype)
+
+        # Blocks at the edge of the array are not padded, so that the
+        # filter applies its own boundary handling there.
+        depth = {ax: 0 for ax in range(arr.ndim)}
+        for ax, h in zip(axes, halo):
+            depth[ax] = int(h)
+        return arr.map_overlap(_filter_block, depth=depth, boundary='none',
+                               dtype=arr.dtype)
+
+    def _halo(self):
+        """
+        The number of neighboring pixels along each of `dims` on which the
+        filtered value of a pixel depends.
+
+        Returns
+        -------
+        tuple of int or None
+            The halo size for each dimension in `dims`, or None if unknown.
+        """
+        return None
+
     @abstractmethod
     def _filter(self, arr, axes, output=None):
         """
@@ -21,11 +21,13 @@ class NLMeansFilter(Filter):
         The standard deviation of the noise present in the data.
     h : float
     f : int
+    njobs : int, optional
+        The number of threads to use (default: 1).
     """
 
     per_variable = False
 
-    def __init__(self, dims, r=1, sigma=1, h=1, f=1):
+    def __init__(self, dims, r=1, sigma=1, h=1, f=1, njobs=1):
         if isinstance(r, (int, float)):
             r = [r] * len(dims)
         self.dims = tuple(dims)
@@ -33,6 +35,10 @@ class NLMeansFilter(Filter):
         self.f = np.array([f if _ > 0 else 0 for _ in self.r], dtype=np.uint32)
         self.sigma = sigma
         self.h = h
+        self.njobs = njobs
+
+    def _halo(self):
+        return tuple(self.r + self.f)
 
     def _filter(self, arr, axes, output):
         #
@@ -49,7 +55,18 @@ class NLMeansFilter(Filter):
         values = np.array(arr, ndmin=4, copy=False)
         _out = np.array(output, ndmin=4, copy=False)
 
-        _pixelwise_nlmeans_3d(values, _out, r, f, self.sigma, self.h)
+        if np.iscomplexobj(values):
+            # Treat the real and imaginary parts as separate variables.
+            # The patch distance is then the squared modulus of the
+            # complex difference.
+            values = np.ascontiguousarray(values).view(values.real.dtype)
+            _out_real = np.empty_like(values)
+            _pixelwise_nlmeans_3d(values, _out_real, r, f, self.sigma,
+                                  self.h, njobs=self.njobs)
+            _out[...] = _out_real.view(_out.dtype)
+        else:
+            _pixelwise_nlmeans_3d(values, _out, r, f, self.sigma, self.h,
+                                  njobs=self.njobs)
 
     def _pixelfilter(self, pixel, output):
         ...
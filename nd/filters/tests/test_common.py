@@ -1,6 +1,8 @@
 import pytest
+import numpy as np
 import inspect
 import xarray as xr
+import dask.array as da
 from numpy.testing import assert_equal
 from xarray.testing import assert_equal as xr_assert_equal
 from xarray.testing import assert_allclose as xr_assert_allclose
@@ -49,3 +51,27 @@ def test_filter_mutable_dimension(f):
         f(dims=('y', 'x')).apply(ds),
         f(dims=('x', 'y')).apply(ds)
     )
+
+
+@pytest.mark.parametrize('f', filter_classes)
+def test_filter_dask(f):
+    # Check that filtering a dask-backed dataset is lazy and matches
+    # the eager result across chunk boundaries.
+    instance = f(dims=('y', 'x'))
+    result = instance.apply(ds.chunk({'y': 7, 'x': 9}))
+    for v in result.data_vars:
+        assert isinstance(result[v].data, da.Array)
+    xr_assert_allclose(result.compute(), instance.apply(ds))
+
+
+@pytest.mark.parametrize('f', filter_classes)
+@pytest.mark.parametrize('dtype', [np.float32, np.complex64])
+def test_filter_dtype(f, dtype):
+    # Check that single precision data remains single precision.
+    ds32 = ds.astype(dtype)
+    result = f(dims=('y', 'x')).apply(ds32)
+    for v in result.data_vars:
+        assert result[v].dtype == dtype
+    expected = f(dims=('y', 'x')).apply(ds.astype(np.result_type(dtype, 1.)))
+    xr_assert_allclose(result.astype(expected.C11.dtype), expected,
+                       rtol=1e-4, atol=1e-5)
@@ -1,12 +1,15 @@
 from nd.filters import ConvolutionFilter, BoxcarFilter
-from nd.filters.convolve_ import _expand_kernel
+from nd.filters.convolve_ import (_expand_kernel, _separate_kernel,
+                                  _select_method)
 from nd.testing import generate_test_dataset
 from nd.io import assemble_complex
 import scipy.ndimage.filters as snf
 import numpy as np
-from numpy.testing import assert_equal
+import pytest
+from numpy.testing import assert_equal, assert_allclose
 from xarray.testing import assert_equal as xr_assert_equal
 from xarray.testing import assert_identical as xr_assert_identical
+from xarray.testing import assert_allclose as xr_assert_allclose
 
 
 ds = generate_test_dataset()
@@ -65,3 +68,61 @@ def test_boxcar():
         BoxcarFilter(dims, w).apply(ds),
         ConvolutionFilter(dims, kernel).apply(ds)
     )
+
+
+def test_separate_kernel():
+    np.random.seed(42)
+    factors = [np.random.rand(3), np.random.rand(5), np.random.rand(4)]
+    kernel = np.multiply.outer(np.multiply.outer(*factors[:2]), factors[2])
+    separated = _separate_kernel(kernel)
+    assert len(separated) == 3
+    outer = np.multiply.outer(np.multiply.outer(*separated[:2]), separated[2])
+    assert_allclose(outer, kernel)
+    assert _separate_kernel(np.random.rand(5, 5)) is None
+
+
+@pytest.mark.parametrize('kernel,method', [
+    (np.ones((5, 5)) / 25, 'uniform'),
+    (np.outer(np.hanning(7), np.hanning(5)), 'separable'),
+    (np.random.RandomState(42).rand(11, 11), 'fft'),
+    (np.random.RandomState(42).rand(3, 3), 'direct'),
+])
+def test_select_method(kernel, method):
+    assert_equal(_select_method(kernel), method)
+
+
+@pytest.mark.parametrize('mode', ['reflect', 'nearest', 'constant'])
+@pytest.mark.parametrize('method,kernel', [
+    ('separable', np.outer(np.hanning(7), np.arange(1, 5))),
+    ('uniform', np.ones((4, 3))),
+    ('fft', np.random.RandomState(42).rand(9, 8)),
+])
+def test_convolve_methods(method, kernel, mode):
+    dims = ('y', 'x')
+    kwargs = dict(mode=mode, cval=0.5)
+    xr_assert_allclose(
+        ConvolutionFilter(dims, kernel, method=method, **kwargs).apply(ds),
+        ConvolutionFilter(dims, kernel, method='direct', **kwargs).apply(ds)
+    )
+
+
+@pytest.mark.parametrize('origin', [1, -1, (1, -1, 0), (-1, 0, 0)])
+@pytest.mark.parametrize('method,kernel', [
+    ('separable', np.outer(np.hanning(5), np.arange(1, 5))),
+    ('uniform', np.ones((4, 3))),
+    ('uniform', np.ones((3, 3))),
+])
+def test_convolve_methods_origin(method, kernel, origin):
+    dims = ('y', 'x')
+    xr_assert_allclose(
+        ConvolutionFilter(dims, kernel, method=method,
+                          origin=origin).apply(ds),
+        ConvolutionFilter(dims, kernel, method='direct',
+                          origin=origin).apply(ds)
+    )
+
+
+def test_convolve_method_unsupported_kernel():
+    kernel = np.random.RandomState(42).rand(3, 3)
+    with pytest.raises(ValueError):
+        ConvolutionFilter(('y', 'x'), kernel, method='uniform').apply(ds)
@@ -1,4 +1,5 @@
 from nd.filters import NLMeansFilter
+from nd.filters._nlmeans import _pixelwise_nlmeans_3d
 from nd.testing import generate_test_dataset, assert_all_true
 import numpy as np
 
@@ -41,3 +42,81 @@ def test_ignore_time_dimension():
     t0_nlm = NLMeansFilter(
         dims=('y', 'x'), r=1, sigma=2, h=2).apply(t0)
     assert (np.abs((ds_nlm.isel(time=0) - t0_nlm).to_array()) < 1e-8).all()
+
+
+def test_nlmeans_njobs():
+    # Check that the result does not depend on the number of threads.
+    kwargs = dict(dims=('y', 'x', 'time'), r=(1, 1, 1), f=1, sigma=1, h=1)
+    ds_serial = NLMeansFilter(njobs=1, **kwargs).apply(ds)
+    ds_parallel = NLMeansFilter(njobs=4, **kwargs).apply(ds)
+    assert ds_serial.equals(ds_parallel)
+
+
+def test_nlmeans_float32_accumulation():
+    # The weighted sums of single precision input are accumulated in double
+    # precision, so the result is the double precision result rounded.
+    ds32 = ds.astype(np.float32)
+    kwargs = dict(dims=('y', 'x', 'time'), r=(3, 3, 3), f=1, sigma=1, h=1)
+    ds_nlm32 = NLMeansFilter(**kwargs).apply(ds32)
+    ds_nlm64 = NLMeansFilter(**kwargs).apply(ds32.astype(np.float64))
+    for v in ds.data_vars:
+        assert ds_nlm32[v].dtype == np.float32
+        scale = float(np.abs(ds_nlm64[v]).max())
+        np.testing.assert_allclose(ds_nlm32[v], ds_nlm64[v], rtol=2e-7,
+                                   atol=1e-7 * scale)
+
+
+def _nlmeans_reference(arr, r, f, sigma, h):
+    # Brute-force NL-means of a (y, x, variables) array.
+    pad = np.pad(arr, [(r + f, r + f)] * 2 + [(0, 0)], mode='reflect')
+    output = np.empty_like(arr)
+    for ip, jp in np.ndindex(*arr.shape[:2]):
+        P = pad[ip + r:ip + r + 2*f + 1, jp + r:jp + r + 2*f + 1]
+        total_weight = max_weight = 0
+        weighted_sum = np.zeros(arr.shape[2])
+        for iq, jq in np.ndindex(2*r + 1, 2*r + 1):
+            if iq == r and jq == r:
+                continue
+            Q = pad[ip + iq:ip + iq + 2*f + 1, jp + jq:jp + jq + 2*f + 1]
+            dsquare = ((P - Q)**2).mean()
+            weight = np.exp(-max(dsquare - 2*sigma**2, 0) / h**2)
+            total_weight += weight
+            max_weight = max(max_weight, weight)
+            weighted_sum += weight * pad[ip + iq + f, jp + jq + f]
+        output[ip, jp] = (weighted_sum + max_weight * arr[ip, jp]) / \
+            (total_weight + max_weight)
+    return output
+
+
+def test_nlmeans_patch_distance():
+    # Compare against a brute-force implementation.
+    t0 = ds.isel(time=0)
+    ds_nlm = NLMeansFilter(
+        dims=('y', 'x'), r=2, f=2, sigma=0.5, h=1).apply(t0)
+    arr = t0.to_array().transpose('y', 'x', 'variable').values
+    expected = _nlmeans_reference(arr, r=2, f=2, sigma=0.5, h=1)
+    result = ds_nlm.to_array().transpose('y', 'x', 'variable').values
+    np.testing.assert_allclose(result, expected)
+
+
+def test_nlmeans_blocks():
+    # Processing the first axis in blocks of rows gives the same result,
+    # up to the rounding of the summed-area tables.
+    arr = ds.to_array().transpose('y', 'x', 'time', 'variable').values
+    r = np.array([2, 1, 1], dtype=np.uintc)
+    f = np.array([2, 1, 0], dtype=np.uintc)
+    expected = np.empty_like(arr)
+    _pixelwise_nlmeans_3d(arr, expected, r, f, 1., 1.)
+    for block_rows in [1, 3, 7]:
+        result = np.empty_like(arr)
+        _pixelwise_nlmeans_3d(arr, result, r, f, 1., 1.,
+                              block_rows=block_rows)
+        np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_nlmeans_zero_weights():
+    # If the weights of all other pixels underflow to zero, a pixel keeps
+    # its value.
+    ds_nlm = NLMeansFilter(
+        dims=('y', 'x', 'time'), r=1, f=0, sigma=0, h=1e-100).apply(ds)
+    assert ds.equals(ds_nlm)
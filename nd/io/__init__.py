@@ -6,18 +6,50 @@ TODO: For any operation that affects nrows, ncols, or extent,
 need to update the metadata!
 
 """
-from .open_ import open_dataset
-from .netcdf_ import open_netcdf, to_netcdf
-from .beamdimap_ import open_beam_dimap
-from .rasterio_ import open_rasterio
+import importlib
+from .open_ import open_dataset, open_mfdataset, open_many
+from .formats_ import register_format
 from .convert_ import disassemble_complex, assemble_complex, add_time
 
 
+# The readers and writers of the individual formats are only imported when
+# they are first accessed, so that opening a file only loads its backend.
+_LAZY = {'open_netcdf': 'netcdf_',
+         'to_netcdf': 'netcdf_',
+         'open_zarr': 'zarr_',
+         'to_zarr': 'zarr_',
+         'open_beam_dimap': 'beamdimap_',
+         'open_rasterio': 'rasterio_',
+         'open_envi': 'envi_',
+         'TiePointGrid': 'tiepoints_'}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module '{}' has no attribute '{}'".format(
+            __name__, name))
+    module = importlib.import_module('.' + _LAZY[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
+
 __all__ = ['open_dataset',
+           'open_mfdataset',
+           'open_many',
            'open_netcdf',
            'open_beam_dimap',
            'open_rasterio',
+           'open_envi',
+           'register_format',
            'to_netcdf',
+           'open_zarr',
+           'to_zarr',
            'assemble_complex',
            'disassemble_complex',
-           'add_time']
+           'add_time',
+           'TiePointGrid']
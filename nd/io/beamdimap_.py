@@ -1,28 +1,240 @@
 from .. import utils
 from .convert_ import assemble_complex
+from .envi_ import open_envi
+from .rasterio_ import _block_aligned_chunks
 import lxml.etree as ET
 import rasterio as rio
 import numpy as np
 import os
+import json
+import hashlib
 import affine
 import xarray as xr
 import pandas as pd
-from scipy.ndimage.interpolation import map_coordinates
+import dask.array as da
 
 
-def open_beam_dimap(path, read_data=True):
+# The metadata attributes (``MDATTR`` elements within ``Dataset_Sources``)
+# that are extracted from a BEAM Dimap product.
+METADATA_ATTRIBUTES = [
+    'first_line_time', 'PASS', 'ACQUISITION_MODE', 'REL_ORBIT', 'ABS_ORBIT',
+    'orbit_cycle', 'first_near_lat', 'first_far_lat', 'last_near_lat',
+    'last_far_lat', 'first_near_long', 'first_far_long', 'last_near_long',
+    'last_far_long'
+]
+
+# Increment whenever the output of `_parse_metadata()` changes, to invalidate
+# existing metadata caches.
+METADATA_CACHE_VERSION = 1
+
+
+def _parse_metadata(path):
+    """
+    Extract the metadata required by :meth:`open_beam_dimap` from a BEAM
+    Dimap XML file in a single pass.
+
+    Elements are discarded as soon as they have been processed, and parsing
+    stops once all metadata attributes have been found within
+    ``Dataset_Sources``, which is the last section of a Dimap header.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ``.dim`` file.
+
+    Returns
+    -------
+    dict
+        The extracted metadata. All values are strings, or lists of
+        strings.
+    """
+    raw = {'ncols': None, 'nrows': None, 'nbands': None, 'crs': None,
+           'image_to_model_transform': None, 'data_files': [],
+           'tie_point_grid_files': [], 'tie_point_grids': {},
+           'attributes': {}}
+    wanted = set(METADATA_ATTRIBUTES)
+    attributes = raw['attributes']
+    # The tags of the currently open elements.
+    stack = []
+    in_sources = False
+    # The layout of the tie point grid currently being parsed.
+    tpg_info = {}
+
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem.tag)
+            if elem.tag == 'Dataset_Sources':
+                in_sources = True
+            continue
+
+        tag = stack.pop()
+        parent = stack[-1] if stack else None
+        if in_sources:
+            if tag == 'MDATTR':
+                name = elem.get('name')
+                if name in wanted and name not in attributes:
+                    attributes[name] = elem.text
+                    if len(attributes) == len(wanted):
+                        break
+            elif tag == 'Dataset_Sources':
+                in_sources = False
+        elif tag in ('NCOLS', 'NROWS', 'NBANDS') and \
+                parent == 'Raster_Dimensions':
+            key = tag.lower()
+            if raw[key] is None:
+                raw[key] = elem.text
+        elif tag == 'DATA_FILE_PATH' and parent == 'Data_File':
+            raw['data_files'].append(elem.get('href'))
+        elif tag == 'TIE_POINT_GRID_FILE_PATH' and \
+                parent == 'Tie_Point_Grid_File':
+            raw['tie_point_grid_files'].append(elem.get('href'))
+        elif parent == 'Tie_Point_Grid_Info' and tag in (
+                'TIE_POINT_GRID_NAME', 'OFFSET_X', 'OFFSET_Y', 'STEP_X',
+                'STEP_Y'):
+            tpg_info[tag.lower()] = elem.text
+        elif tag == 'Tie_Point_Grid_Info':
+            name = tpg_info.pop('tie_point_grid_name', None)
+            if name is not None:
+                raw['tie_point_grids'][name] = tpg_info
+            tpg_info = {}
+        elif len(stack) == 2 and parent == 'Coordinate_Reference_System' \
+                and tag == 'WKT':
+            raw['crs'] = elem.text
+        elif len(stack) == 2 and parent == 'Geoposition' and \
+                tag == 'IMAGE_TO_MODEL_TRANSFORM':
+            raw['image_to_model_transform'] = elem.text
+
+        # Free the memory of processed elements.
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    missing = wanted - set(attributes)
+    if missing:
+        raise ValueError('Missing metadata attributes in {}: {}'.format(
+            path, ', '.join(sorted(missing))))
+
+    return raw
+
+
+def _cache_path(path, cache):
+    """
+    The location of the metadata cache file of a product.
+    """
+    if cache is True:
+        return path + '.meta.json'
+    # Cache files from different directories must not collide.
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    name = '{}.{}.meta.json'.format(os.path.basename(path), key[:12])
+    return os.path.join(cache, name)
+
+
+def _read_metadata(path, cache=None):
+    """
+    Return the parsed metadata of a BEAM Dimap product, using the on-disk
+    cache if enabled and valid. See :meth:`open_beam_dimap`.
+    """
+    if not cache:
+        return _parse_metadata(path)
+
+    stat = os.stat(path)
+    key = {'mtime': stat.st_mtime, 'size': stat.st_size,
+           'version': METADATA_CACHE_VERSION}
+    cache_file = _cache_path(path, cache)
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return cached['metadata']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    raw = _parse_metadata(path)
+    try:
+        with open(cache_file, 'w') as f:
+            json.dump({'key': key, 'metadata': raw}, f)
+    except OSError:
+        # The cache is an optimization only.
+        pass
+    return raw
+
+
+def _tie_point_positions(info, axis, n, size):
+    """
+    The image pixel indices of the tie points along one axis.
+
+    Parameters
+    ----------
+    info : dict
+        The tie point grid layout parsed from the metadata. May be empty.
+    axis : str {'x', 'y'}
+        The image axis.
+    n : int
+        The number of tie points along `axis`.
+    size : int
+        The number of image pixels along `axis`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (possibly fractional) pixel indices.
+    """
+    offset = info.get('offset_' + axis)
+    step = info.get('step_' + axis)
+    if offset is None or step is None:
+        # Assume that the tie points span the entire image.
+        return np.linspace(0, size - 1, n)
+    # In BEAM, pixel i extends from i to i + 1, so that its center is
+    # located at i + 0.5.
+    return float(offset) - 0.5 + float(step) * np.arange(n)
+
+
+def _open_band(path, chunks=None):
+    """
+    Lazily open a single band image as a dask-backed DataArray. Only the
+    blocks required for a computation are read from disk.
+
+    ENVI images, which is what BEAM Dimap uses, are memory-mapped rather than
+    read through GDAL (see :meth:`nd.io.open_envi`).
+    """
+    if os.path.isfile(os.path.splitext(path)[0] + '.hdr'):
+        return open_envi(path, chunks=chunks)
+    with rio.open(path) as src:
+        band_chunks = _block_aligned_chunks(
+            (src.height, src.width), src.block_shapes[0],
+            src.dtypes[0], chunks)
+    return xr.open_rasterio(path, chunks=band_chunks)
+
+
+def open_beam_dimap(path, read_data=True, chunks=None, cache=None):
     """Read a BEAM Dimap product into an xarray Dataset.
 
     BEAM Dimap is the native file format of the SNAP software. It consists of
     a ``*.dim`` XML file and a ``*.data`` directory containing the data.
     ``path`` should point to the XML file.
 
+    The data is read lazily: every band is a dask array whose chunks
+    consist of whole blocks of the underlying ``.img`` file, and complex
+    bands are assembled lazily. Opening a product therefore only parses
+    its metadata.
+
     Parameters
     ----------
     path : str
         The file path to the BEAM Dimap product.
     read_data : bool, optional
         If True (default), read all data. Otherwise, read only the metadata.
+    chunks : dict, optional
+        The chunk sizes along ``y`` and ``x``, e.g.
+        ``{'y': 1000, 'x': 1000}``. Chunk sizes are rounded up to a multiple
+        of the file's block size. By default, the chunk sizes are chosen
+        automatically.
+    cache : bool or str, optional
+        If True, cache the parsed metadata in a sidecar file next to the
+        product (``<path>.meta.json``). If a directory is given, the cache
+        file is stored there instead, e.g. for read-only archives. The cache
+        is invalidated when the size or modification time of the product
+        changes (default: None, no cache).
 
     Returns
     -------
@@ -34,49 +246,25 @@ def open_beam_dimap(path, read_data=True):
     # Read metadata
     # -------------------------------------------------------------------------
     basepath = os.path.split(path)[0]
+    raw = _read_metadata(path, cache=cache)
+    attrs = raw['attributes']
+    data_files = [os.path.join(basepath, _) for _ in raw['data_files']]
+    tie_point_grid_files = [os.path.join(basepath, _)
+                            for _ in raw['tie_point_grid_files']]
     meta = {}
-    tree = ET.parse(path)
-    root = tree.getroot()
-    data_files = [os.path.join(basepath, _.attrib['href']) for _ in
-                  root.findall('.//Data_File/DATA_FILE_PATH')]
-    tie_point_grid_files = \
-        [os.path.join(basepath, _.attrib['href']) for _ in
-         root.findall('.//Tie_Point_Grid_File/TIE_POINT_GRID_FILE_PATH')]
-    meta['ncols'] = int(root.find('.//Raster_Dimensions/NCOLS').text)
-    meta['nrows'] = int(root.find('.//Raster_Dimensions/NROWS').text)
-    meta['nbands'] = int(root.find('.//Raster_Dimensions/NBANDS').text)
-    meta['time_start'] = root.find(
-        './/Dataset_Sources//MDATTR[@name="first_line_time"]').text
-    meta['orbit_direction'] = root.find(
-        './/Dataset_Sources//MDATTR[@name="PASS"]').text
-    meta['mode'] = root.find(
-        './/Dataset_Sources//MDATTR[@name="ACQUISITION_MODE"]').text
-    meta['rel_orbit'] = int(root.find(
-        './/Dataset_Sources//MDATTR[@name="REL_ORBIT"]').text)
-    meta['abs_orbit'] = int(root.find(
-        './/Dataset_Sources//MDATTR[@name="ABS_ORBIT"]').text)
-    meta['orbit_cycle'] = int(root.find(
-        './/Dataset_Sources//MDATTR[@name="orbit_cycle"]').text)
-    lats = [
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="first_near_lat"]').text),
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="first_far_lat"]').text),
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="last_near_lat"]').text),
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="last_far_lat"]').text)
-    ]
-    lons = [
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="first_near_long"]').text),
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="first_far_long"]').text),
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="last_near_long"]').text),
-        float(root.find(
-            './/Dataset_Sources//MDATTR[@name="last_far_long"]').text)
-    ]
+    meta['ncols'] = int(raw['ncols'])
+    meta['nrows'] = int(raw['nrows'])
+    meta['nbands'] = int(raw['nbands'])
+    meta['time_start'] = attrs['first_line_time']
+    meta['orbit_direction'] = attrs['PASS']
+    meta['mode'] = attrs['ACQUISITION_MODE']
+    meta['rel_orbit'] = int(attrs['REL_ORBIT'])
+    meta['abs_orbit'] = int(attrs['ABS_ORBIT'])
+    meta['orbit_cycle'] = int(attrs['orbit_cycle'])
+    lats = [float(attrs[_]) for _ in ['first_near_lat', 'first_far_lat',
+                                      'last_near_lat', 'last_far_lat']]
+    lons = [float(attrs[_]) for _ in ['first_near_long', 'first_far_long',
+                                      'last_near_long', 'last_far_long']]
     meta['lon_range'] = (min(lons), max(lons))
     meta['lat_range'] = (min(lats), max(lats))
 
@@ -87,12 +275,13 @@ def open_beam_dimap(path, read_data=True):
     # OPTION A:
     # Affine coordinate transform
     # ---------------------------
-    crs_info = root.find('./Coordinate_Reference_System/WKT')
-    transf_info = root.find('./Geoposition/IMAGE_TO_MODEL_TRANSFORM')
+    crs_info = raw['crs']
+    transf_info = raw['image_to_model_transform']
 
     # OPTION B:
     # Ground Control Points (Tie Point Grids)
     # ---------------------------------------
+    # The grids are kept at their native resolution.
     tp_grids = {}
     for tf in tie_point_grid_files:
         p = os.path.splitext(tf)[0] + '.img'
@@ -108,7 +297,7 @@ def open_beam_dimap(path, read_data=True):
         #
         # Extract the GeoTransform.
         #
-        transf = np.array([float(_) for _ in transf_info.text.split(',')])
+        transf = np.array([float(_) for _ in transf_info.split(',')])
         # The transform is in a weird order, reorder to GDAL standard:
         transf_gdal = transf[::-1].reshape((3, 2)).T.flatten()
         # Now reorder to affine transformation:
@@ -141,44 +330,20 @@ def open_beam_dimap(path, read_data=True):
     # Are there tie point grids for latitude and longitude?
     #
     elif 'latitude' in tp_grids and 'longitude' in tp_grids:
-        # NOTE: In future, read these from the metadata.
-        xstep = (meta['ncols'] - 1) / (tp_grids['latitude'].shape[1] - 1)
-        ystep = (meta['nrows'] - 1) / (tp_grids['latitude'].shape[0] - 1)
-
-        xs = np.linspace(0, meta['ncols'] - 1, tp_grids['latitude'].shape[1])
-        ys = np.linspace(0, meta['nrows'] - 1, tp_grids['latitude'].shape[0])
-        xi, yi = xs.astype(int), ys.astype(int)
-        xg, yg = np.meshgrid(xi, yi, copy=False)
-        # convert to integers so they can actually be assigned to pixels
-        # don't want to carry over the error from the integer truncation,
-        # therefore do an interpolation:
-        # tpg_index = np.stack((yi, xi), axis=0)
-        # xy_scaled = tpg_index.astype(float) / np.array((ystep, xstep))
-        x_scaled = xg.astype(float) / xstep
-        y_scaled = yg.astype(float) / ystep
-        map_xy = np.stack((y_scaled, x_scaled), axis=0)
-        tp_grids_int = {}
-        for name, tpg in tp_grids.items():
-            tp_grids_int[name] = map_coordinates(tpg, map_xy, output=tpg.dtype,
-                                                 order=3, cval=np.nan)
-
-        # Create GCP dataframe ...
-        # gcp_data = {'GCPLine': y.flatten(), 'GCPPixel': x.flatten(),
-        #             'GCPX': lon.flatten(), 'GCPY': lat.flatten()}
-        # gcps = pd.DataFrame(gcp_data)
-
-        # Create tie point grids as sparse matrix
-        # (np.nan wherever there is no entry)
-        tp_grids_sparse = {}
-        # tpg_index = np.stack((y, x), axis=-1)
-        for name, tpg in tp_grids_int.items():
-            tpg_sparse = np.full((meta['nrows'], meta['ncols']), np.nan)
-            tpg_sparse[yi[:, np.newaxis], xi] = tpg
-            tp_grids_sparse[name] = tpg_sparse
-
+        # Store all tie point grids that share the layout of the latitude
+        # grid as coordinates over the dimensions ('tp_y', 'tp_x'), which
+        # hold the image row and column index of each tie point.
+        # See `nd.io.TiePointGrid` and `nd.warp.get_geolocation()` for
+        # interpolating the grids to image pixels.
+        shape = tp_grids['latitude'].shape
+        info = raw['tie_point_grids'].get('latitude', {})
+        tp_y = _tie_point_positions(info, 'y', shape[0], meta['nrows'])
+        tp_x = _tie_point_positions(info, 'x', shape[1], meta['ncols'])
         data_coords = ('y', 'x')
-        coords = {'lat': (data_coords, tp_grids_sparse['latitude']),
-                  'lon': (data_coords, tp_grids_sparse['longitude'])}
+        coords = {'tp_y': tp_y, 'tp_x': tp_x}
+        for name, tpg in tp_grids.items():
+            if tpg.shape == shape:
+                coords['tp_' + name] = (('tp_y', 'tp_x'), tpg)
 
     #
     # Create xarray dataset.
@@ -194,7 +359,7 @@ def open_beam_dimap(path, read_data=True):
             # we don't want to open the ENVI .hdr file...
             im_path = os.path.splitext(rpath)[0] + '.img'
             name = os.path.splitext(os.path.split(im_path)[1])[0]
-            ds[name] = xr.open_rasterio(im_path)
+            ds[name] = _open_band(im_path, chunks=chunks)
 
         # All attributes that are the same for each band
         # should be attributes of the dataset instead.
@@ -206,5 +371,10 @@ def open_beam_dimap(path, read_data=True):
                     del ds[v].attrs[col]
 
     ds = assemble_complex(ds)
+    ds.attrs['start_date'] = meta['time_start']
+
+    if 'tp_y' in coords:
+        ds = ds.assign_coords(**{k: v for k, v in coords.items()
+                                 if k.startswith('tp_')})
 
     return ds
@@ -1,12 +1,19 @@
 import numpy as np
 import xarray as xr
+import dask.array as da
 import re
+import functools
 from .. import utils
 
 
 def disassemble_complex(ds):
     """Disassemble complex valued data into real and imag parts.
 
+    The real and imaginary parts are views of the complex data, so no data
+    is copied. For dask arrays, the parts are computed lazily. Every
+    variable keeps the type and chunks of its input: numpy data is not
+    converted to dask arrays, and dask arrays are not rechunked.
+
     Parameters
     ----------
     ds : xarray.Dataset
@@ -34,15 +41,58 @@ def disassemble_complex(ds):
         if not np.iscomplexobj(var):
             continue
 
+        # For numpy arrays, `real` and `imag` are strided views.
         new_ds[vn + '__re'] = var.real
         new_ds[vn + '__im'] = var.imag
         del new_ds[vn]
 
-    # reapply chunks
-    new_ds = new_ds.chunk(ds.chunks)
     return new_ds
 
 
+def _complex_block(real, imag, dtype):
+    """Combine real and imaginary parts into a newly allocated complex array.
+    """
+    out = np.empty(real.shape, dtype=dtype)
+    out.real = real
+    out.imag = imag
+    return out
+
+
+def _combine_complex(real, imag, block_bytes=2 ** 22):
+    """
+    Combine two variables holding the real and imaginary parts into a
+    complex array without any full-size temporary arrays.
+
+    Parameters
+    ----------
+    real, imag : xarray.Variable
+        The real and imaginary parts.
+    block_bytes : int, optional
+        Lazily loaded variables are read in blocks of about this size along
+        the first dimension.
+
+    Returns
+    -------
+    numpy.ndarray or dask.array.Array
+        The complex data. Dask arrays are combined lazily.
+    """
+    dtype = np.result_type(real.dtype, imag.dtype, np.complex64)
+    # Note that accessing `.data` would load lazily indexed arrays.
+    if real.chunks is not None or imag.chunks is not None:
+        return da.map_blocks(functools.partial(_complex_block, dtype=dtype),
+                             real.chunk().data, imag.chunk().data,
+                             dtype=dtype)
+    if real.ndim == 0:
+        return _complex_block(real.values, imag.values, dtype)
+    out = np.empty(real.shape, dtype=dtype)
+    row_bytes = max(1, out.itemsize * int(np.prod(out.shape[1:])))
+    step = max(1, block_bytes // row_bytes)
+    for i in range(0, real.shape[0], step):
+        out.real[i:i + step] = real[i:i + step].values
+        out.imag[i:i + step] = imag[i:i + step].values
+    return out
+
+
 def assemble_complex(ds, inplace=False):
     """Reassemble complex valued data.
 
@@ -84,7 +134,9 @@ def assemble_complex(ds, inplace=False):
         vn_im = utils.select(matches['im'], lambda x: x.group(1) == vn,
                              first=True)
         if vn_re is not None and vn_im is not None:
-            new_ds[vn] = new_ds[vn_re.group(0)] + new_ds[vn_im.group(0)] * 1j
+            real = new_ds[vn_re.group(0)].variable
+            imag = new_ds[vn_im.group(0)].variable
+            new_ds[vn] = (real.dims, _combine_complex(real, imag))
             del new_ds[vn_re.group(0)]
             del new_ds[vn_im.group(0)]
 
@@ -144,10 +196,14 @@ def dualpol_to_complex(ds, inplace=False):
     else:
         ds_c = ds.copy()
     dims = ds_c['i_VV.img'].dims
+    # Single precision i/q bands yield complex64, double precision bands
+    # complex128.
+    ctype = np.promote_types(ds_c['i_VV.img'].dtype, np.complex64)
+    rtype = np.finfo(ctype).dtype
     vv = np.stack([ds_c['i_VV.img'], ds_c['q_VV.img']], axis=-1)
     vh = np.stack([ds_c['i_VH.img'], ds_c['q_VH.img']], axis=-1)
-    ds_c['VV'] = (dims, vv.view(dtype=np.complex64)[:, :, 0])
-    ds_c['VH'] = (dims, vh.view(dtype=np.complex64)[:, :, 0])
+    ds_c['VV'] = (dims, vv.astype(rtype, copy=False).view(ctype)[..., 0])
+    ds_c['VH'] = (dims, vh.astype(rtype, copy=False).view(ctype)[..., 0])
     del ds_c['i_VV.img']
     del ds_c['q_VV.img']
     del ds_c['i_VH.img']
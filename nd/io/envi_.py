@@ -0,0 +1,263 @@
+import os
+import numpy as np
+import xarray as xr
+import dask.array as da
+from affine import Affine
+from rasterio.crs import CRS
+from .rasterio_ import _block_aligned_chunks
+
+
+# The ENVI data type codes and the corresponding numpy data types.
+ENVI_DTYPES = {
+    1: np.uint8,
+    2: np.int16,
+    3: np.int32,
+    4: np.float32,
+    5: np.float64,
+    6: np.complex64,
+    9: np.complex128,
+    12: np.uint16,
+    13: np.uint32,
+    14: np.int64,
+    15: np.uint64,
+}
+
+
+def _read_envi_header(path):
+    """
+    Parse an ENVI ``.hdr`` file.
+
+    Parameters
+    ----------
+    path : str
+        The path to the header file.
+
+    Returns
+    -------
+    dict
+        The header entries, with lower case keys. Values enclosed in curly
+        braces, which may span several lines, are returned without braces.
+    """
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if len(lines) == 0 or lines[0].strip() != 'ENVI':
+        raise ValueError('{} is not an ENVI header file.'.format(path))
+    header = {}
+    i = 1
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        value = value.strip()
+        if value.startswith('{'):
+            while not value.endswith('}') and i < len(lines):
+                value += '\n' + lines[i].strip()
+                i += 1
+            value = value[1:-1].strip()
+        header[key.strip().lower()] = value
+    return header
+
+
+class _ENVIArray:
+    """
+    A lazily indexed, memory-mapped ENVI image, with dimensions
+    ``(band, y, x)`` regardless of the interleave of the file.
+
+    Indexing maps the file into memory and returns the selected values in
+    native byte order. Only the selection is copied, and only if the file is
+    not stored in native byte order. Pages of the file are shared via the
+    operating system's page cache.
+
+    The object only stores the file path and layout, so it can be pickled
+    cheaply, e.g. for distributed dask schedulers.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ``.img`` file. The header is expected next to it,
+        with the extension ``.hdr``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header = _read_envi_header(os.path.splitext(path)[0] + '.hdr')
+        if header.get('file type', 'ENVI Standard') != 'ENVI Standard':
+            raise ValueError('Unsupported ENVI file type: {}'.format(
+                header['file type']))
+        nbands = int(header['bands'])
+        nrows = int(header['lines'])
+        ncols = int(header['samples'])
+        byteorder = '>' if int(header.get('byte order', 0)) == 1 else '<'
+        self.file_dtype = np.dtype(
+            ENVI_DTYPES[int(header['data type'])]).newbyteorder(byteorder)
+        self.dtype = self.file_dtype.newbyteorder('=')
+        self.offset = int(header.get('header offset', 0))
+        self.interleave = header.get('interleave', 'bsq').lower()
+        if self.interleave == 'bsq':
+            self._file_shape = (nbands, nrows, ncols)
+            self._axes = (0, 1, 2)
+        elif self.interleave == 'bil':
+            self._file_shape = (nrows, nbands, ncols)
+            self._axes = (1, 0, 2)
+        elif self.interleave == 'bip':
+            self._file_shape = (nrows, ncols, nbands)
+            self._axes = (2, 0, 1)
+        else:
+            raise ValueError('Unsupported ENVI interleave: {}'.format(
+                self.interleave))
+        self.shape = (nbands, nrows, ncols)
+        self.ndim = 3
+
+    def __dask_tokenize__(self):
+        stat = os.stat(self.path)
+        return (type(self).__name__, os.path.abspath(self.path),
+                stat.st_mtime, stat.st_size)
+
+    def memmap(self):
+        """
+        Map the image into memory.
+
+        Returns
+        -------
+        numpy.memmap
+            A read-only, memory-mapped view of the image in file byte order,
+            with dimensions ``(band, y, x)``.
+        """
+        mm = np.memmap(self.path, dtype=self.file_dtype, mode='r',
+                       offset=self.offset, shape=self._file_shape)
+        return mm.transpose(self._axes)
+
+    def __getitem__(self, key):
+        return np.asarray(self.memmap()[key], dtype=self.dtype)
+
+
+def _parse_map_info(header):
+    """
+    Determine the geometric transform and the coordinate reference system
+    from the ``map info`` and ``coordinate system string`` header entries,
+    following the conventions of GDAL's ENVI driver.
+
+    Parameters
+    ----------
+    header : dict
+        The header entries as returned by :meth:`_read_envi_header`.
+
+    Returns
+    -------
+    tuple (affine.Affine, rasterio.crs.CRS or None)
+        The transform and the CRS. The transform is the identity if the
+        header has no map info.
+    """
+    if 'map info' not in header:
+        return Affine.identity(), None
+    info = [_.strip() for _ in header['map info'].split(',')]
+    options = dict(_.split('=', 1) for _ in info if '=' in _)
+    info = [_ for _ in info if '=' not in _]
+    ref_x, ref_y, easting, northing, res_x, res_y = map(float, info[1:7])
+    rotation = np.radians(float(options.get('rotation', 0)))
+    if rotation == 0:
+        a, b, d, e = res_x, 0., 0., -res_y
+    else:
+        a, b = np.cos(rotation) * res_x, np.sin(rotation) * res_x
+        d, e = np.sin(rotation) * res_y, -np.cos(rotation) * res_y
+    # The reference pixel location is one-based.
+    c = easting - (ref_x - 1) * a - (ref_y - 1) * b
+    f = northing - (ref_x - 1) * d - (ref_y - 1) * e
+    transform = Affine(a, b, c, d, e, f)
+
+    crs = None
+    if 'coordinate system string' in header:
+        crs = CRS.from_wkt(header['coordinate system string'],
+                           morph_from_esri_dialect=True)
+    elif info[0].lower() == 'geographic lat/lon':
+        crs = CRS.from_epsg(4326)
+    elif info[0].lower() == 'utm' and len(info) >= 10 and \
+            info[9].upper() == 'WGS-84':
+        south = info[8].lower() == 'south'
+        crs = CRS.from_epsg((32700 if south else 32600) + int(info[7]))
+    return transform, crs
+
+
+def _envi_attrs(header, transform, crs):
+    """
+    The attributes of an ENVI image, as ``xarray.open_rasterio`` would
+    return them, derived from the header.
+    """
+    nbands = int(header['bands'])
+    attrs = {}
+    attrs['transform'] = tuple(transform)[:6]
+    if crs is not None:
+        attrs['crs'] = crs.to_proj4()
+    attrs['res'] = (np.sqrt(transform.a ** 2 + transform.d ** 2),
+                    np.sqrt(transform.b ** 2 + transform.e ** 2))
+    attrs['is_tiled'] = np.uint8(0)
+    nodata = float(header.get('data ignore value', np.nan))
+    attrs['nodatavals'] = (nodata,) * nbands
+
+    def _values(key, default):
+        if key not in header:
+            return (default,) * nbands
+        return tuple(float(_) for _ in header[key].split(','))
+
+    attrs['scales'] = _values('data gain values', 1.)
+    attrs['offsets'] = _values('data offset values', 0.)
+    if 'band names' in header:
+        attrs['descriptions'] = tuple(
+            _.strip() for _ in header['band names'].split(','))
+    for key, value in header.items():
+        if key != 'map info':
+            attrs[key.replace(' ', '_')] = value
+    return attrs
+
+
+def open_envi(path, chunks=None):
+    """Read an ENVI image into a dask-backed xarray DataArray.
+
+    The image is memory-mapped (see :class:`nd.io.envi_._ENVIArray`), so
+    pages of the file are cached by the operating system and shared between
+    processes, and only the pixels that are used are read. The coordinates
+    and georeferencing are read from the ``map info`` of the header, without
+    opening the image through GDAL.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ``.img`` file. The header is expected next to it,
+        with the extension ``.hdr``.
+    chunks : dict, optional
+        The chunk sizes along ``y`` and ``x``. By default, the chunks
+        consist of whole rows, and the number of rows is chosen
+        automatically.
+
+    Returns
+    -------
+    xarray.DataArray
+        The image with dimensions ``('band', 'y', 'x')``.
+    """
+    header = _read_envi_header(os.path.splitext(path)[0] + '.hdr')
+    arr = _ENVIArray(path)
+    nbands, nrows, ncols = arr.shape
+    transform, crs = _parse_map_info(header)
+
+    coords = {'band': np.arange(1, nbands + 1)}
+    if transform.is_rectilinear:
+        # The coordinates refer to the pixel centers.
+        coords['x'], _ = transform * (np.arange(ncols) + 0.5,
+                                      np.zeros(ncols) + 0.5)
+        _, coords['y'] = transform * (np.zeros(nrows) + 0.5,
+                                      np.arange(nrows) + 0.5)
+
+    # Any window of the memory map can be read, so the chunks are not
+    # aligned to blocks. Whole rows are read most efficiently.
+    requested = {'x': -1}
+    requested.update(chunks or {})
+    band_chunks = _block_aligned_chunks(
+        (nrows, ncols), (1, 1), arr.dtype, requested)
+    data = da.from_array(
+        arr, chunks=(band_chunks['band'], band_chunks['y'],
+                     band_chunks['x']),
+        name='envi-' + da.core.tokenize(arr, band_chunks))
+    return xr.DataArray(data, dims=('band', 'y', 'x'), coords=coords,
+                        attrs=_envi_attrs(header, transform, crs))
@@ -0,0 +1,151 @@
+"""
+The registry of file formats that :meth:`nd.io.open_dataset` can read.
+
+Every format has a reader, a function that cheaply detects the format from
+the first bytes of a file or the contents of a directory, and a list of file
+extensions. Readers may be given as ``'module:function'`` strings, which are
+only imported when a file of that format is opened.
+"""
+import os
+import importlib
+from collections import OrderedDict
+
+
+# The number of bytes at the start of a file passed to the detectors.
+HEAD_BYTES = 512
+
+FORMATS = OrderedDict()
+
+
+class _Format:
+    def __init__(self, name, reader, detect=None, extensions=()):
+        self.name = name
+        self._reader = reader
+        self.detect = detect
+        self.extensions = tuple(ext.lower() for ext in extensions)
+
+    @property
+    def reader(self):
+        if isinstance(self._reader, str):
+            module, func = self._reader.split(':')
+            self._reader = getattr(importlib.import_module(module), func)
+        return self._reader
+
+
+def register_format(name, reader, detect=None, extensions=()):
+    """
+    Register a file format with :meth:`nd.io.open_dataset`.
+
+    Registering an existing name replaces the format.
+
+    Parameters
+    ----------
+    name : str
+        The name of the format, e.g. ``'netcdf'``.
+    reader : callable or str
+        The function that opens a file of this format, with the signature
+        ``reader(path, *args, **kwargs)``. May also be given as a string
+        ``'module:function'``, in which case the module is only imported
+        when needed.
+    detect : callable, optional
+        A function ``detect(path, head)`` that returns True if `path` is a
+        file of this format. ``head`` contains the first bytes of the file,
+        or is None if `path` is a directory. It should be cheap: it must not
+        read more than ``head`` or list large directories.
+    extensions : list of str, optional
+        The file extensions of the format, including the leading dot. They
+        are used if no format detects the file, e.g. if it does not exist
+        yet.
+    """
+    FORMATS[name] = _Format(name, reader, detect=detect,
+                            extensions=extensions)
+
+
+def _read_head(path):
+    """Return the first bytes of a file, or None if `path` is a directory.
+    """
+    if os.path.isdir(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read(HEAD_BYTES)
+    except (IOError, OSError):
+        return b''
+
+
+def detect_format(path):
+    """
+    Determine the format of a file.
+
+    The registered detectors are tried first, in the order of registration,
+    then the file extensions.
+
+    Parameters
+    ----------
+    path : str
+        The file path.
+
+    Returns
+    -------
+    str or None
+        The name of the format, or None if the format is unknown.
+    """
+    head = _read_head(path)
+    for fmt in FORMATS.values():
+        if fmt.detect is not None and fmt.detect(path, head):
+            return fmt.name
+    ext = os.path.splitext(path.rstrip('/' + os.sep))[1].lower()
+    for fmt in FORMATS.values():
+        if ext in fmt.extensions:
+            return fmt.name
+    return None
+
+
+# -----------------------------------------------------------------------------
+# Detectors for the built-in formats
+# -----------------------------------------------------------------------------
+def _detect_netcdf(path, head):
+    # NetCDF classic and 64-bit offset files start with CDF, NetCDF-4 files
+    # are HDF5 files.
+    return head is not None and (head.startswith(b'CDF\x01') or
+                                 head.startswith(b'CDF\x02') or
+                                 head.startswith(b'\x89HDF\r\n\x1a\n'))
+
+
+def _detect_beam_dimap(path, head):
+    return head is not None and head.lstrip().startswith(b'<?xml') and \
+        b'<Dimap_Document' in head
+
+
+def _detect_zarr(path, head):
+    return head is None and (
+        os.path.isfile(os.path.join(path, '.zgroup')) or
+        os.path.isfile(os.path.join(path, '.zarray')))
+
+
+def _detect_envi(path, head):
+    if head is None or not path.lower().endswith('.img'):
+        return False
+    try:
+        with open(os.path.splitext(path)[0] + '.hdr', 'rb') as f:
+            return f.read(4) == b'ENVI'
+    except (IOError, OSError):
+        return False
+
+
+def _detect_geotiff(path, head):
+    # Little and big endian TIFF and BigTIFF
+    return head is not None and head[:4] in (
+        b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+
+
+register_format('netcdf', 'nd.io.netcdf_:open_netcdf',
+                detect=_detect_netcdf, extensions=['.nc', '.nc4', '.h5'])
+register_format('beam_dimap', 'nd.io.beamdimap_:open_beam_dimap',
+                detect=_detect_beam_dimap, extensions=['.dim'])
+register_format('zarr', 'nd.io.zarr_:open_zarr',
+                detect=_detect_zarr, extensions=['.zarr'])
+register_format('envi', 'nd.io.envi_:open_envi',
+                detect=_detect_envi, extensions=[])
+register_format('geotiff', 'nd.io.rasterio_:open_rasterio',
+                detect=_detect_geotiff, extensions=['.tif', '.tiff'])
@@ -1,31 +1,290 @@
+import contextlib
+import zlib
+import uuid
+import threading
+import numpy as np
 import xarray as xr
+import dask
+import dask.array as da
+from xarray import conventions
 from .convert_ import assemble_complex, disassemble_complex
 
 
-def to_netcdf(ds, path, *args, **kwargs):
+#: The default target size of a chunk in bytes. This matches the default
+#: size of the HDF5 chunk cache, so that every chunk that is read is cached.
+CHUNK_BYTES = 2 ** 20
+
+
+def _chunksizes(var, chunks='auto', chunk_bytes=CHUNK_BYTES):
+    """
+    Determine the chunk sizes of a variable in the NetCDF file.
+
+    Parameters
+    ----------
+    var : xarray.Variable
+        The variable.
+    chunks : 'auto' or dict or None, optional
+        If 'auto' (default), use the dask chunks of the variable, which are
+        split until they are no larger than `chunk_bytes`. Variables that
+        are not dask arrays are chunked into chunks of about `chunk_bytes`.
+        If dict, the chunk size along each dimension. Missing dimensions are
+        not chunked. If None, the variable is stored contiguously.
+    chunk_bytes : int, optional
+        The target size of a chunk in bytes.
+
+    Returns
+    -------
+    tuple or None
+        The chunk sizes, or None if the variable should not be chunked.
+    """
+    if chunks is None or var.ndim == 0 or 0 in var.shape:
+        return None
+    if isinstance(chunks, dict):
+        return tuple(min(chunks.get(d, n), n)
+                     for d, n in zip(var.dims, var.shape))
+    if var.chunks is None:
+        return tuple(c[0] for c in da.core.normalize_chunks(
+            'auto', shape=var.shape, limit=chunk_bytes, dtype=var.dtype))
+    # Split the dask chunks in half along their longest dimension until they
+    # are small enough, so that chunk boundaries remain aligned.
+    sizes = [max(c) for c in var.chunks]
+    while np.prod(sizes) * var.dtype.itemsize > chunk_bytes and \
+            max(sizes) > 1:
+        i = int(np.argmax(sizes))
+        sizes[i] = int(np.ceil(sizes[i] / 2))
+    return tuple(sizes)
+
+
+#: The encoding keys of a variable that are kept when writing it, as
+#: ``xarray.to_netcdf`` replaces the encoding of a variable by the one given.
+_CF_ENCODING = ('_FillValue', 'missing_value', 'scale_factor', 'add_offset',
+               'dtype', 'units', 'calendar')
+
+
+def _encoding(var, compression='zlib', complevel=5, shuffle=True,
+              chunks='auto', chunk_bytes=CHUNK_BYTES):
+    """Create the encoding of a data variable for `xarray.to_netcdf`.
+    """
+    encoding = {k: v for k, v in var.encoding.items() if k in _CF_ENCODING}
+    if np.dtype(encoding.get('dtype', var.dtype)).kind == 'c':
+        # The real and imaginary parts inherit the encoding of the complex
+        # variable.
+        encoding.pop('dtype', None)
+    if var.ndim == 0 or var.dtype.kind in 'OUS':
+        # Strings are neither chunked nor compressed.
+        return encoding
+    chunksizes = _chunksizes(var, chunks=chunks, chunk_bytes=chunk_bytes)
+    if chunksizes is not None:
+        encoding['chunksizes'] = chunksizes
+    if compression is None:
+        pass
+    elif compression == 'zlib':
+        encoding.update(zlib=True, complevel=complevel, shuffle=shuffle)
+    elif compression == 'lzf':
+        encoding.update(compression='lzf', shuffle=shuffle)
+    else:
+        raise ValueError("Invalid compression '{}'. Must be one of 'zlib', "
+                         "'lzf', or None.".format(compression))
+    return encoding
+
+
+class _DirectChunkWriter:
+    """
+    A target for ``dask.array.store`` that compresses each chunk in the
+    calling thread and writes it directly into an HDF5 dataset, bypassing
+    the HDF5 filter pipeline, which would compress one chunk at a time.
+    The filters are taken from the dataset, and the blocks must be aligned
+    with its chunks.
+    """
+
+    def __init__(self, h5ds, lock=None):
+        if h5ds.compression not in (None, 'gzip') or h5ds.fletcher32 or \
+                h5ds.scaleoffset is not None:
+            raise ValueError("Cannot write chunks directly with the filters "
+                             "of dataset '{}'.".format(h5ds.name))
+        self.h5ds = h5ds
+        self.complevel = h5ds.compression_opts \
+            if h5ds.compression == 'gzip' else None
+        self.shuffle = h5ds.shuffle
+        self.lock = threading.Lock() if lock is None else lock
+
+    def __setitem__(self, key, block):
+        chunks = self.h5ds.chunks
+        if block.shape != chunks:
+            # Edge chunks are stored at full size.
+            full = np.zeros(chunks, dtype=block.dtype)
+            full[tuple(slice(0, n) for n in block.shape)] = block
+            block = full
+        block = np.ascontiguousarray(block, dtype=self.h5ds.dtype)
+        itemsize = block.dtype.itemsize
+        if self.shuffle and itemsize > 1:
+            # The HDF5 shuffle filter groups the n-th bytes of all values.
+            data = block.view(np.uint8).reshape(-1, itemsize).T.tobytes()
+        else:
+            data = block.tobytes()
+        if self.complevel is not None:
+            data = zlib.compress(data, self.complevel)
+        offset = tuple(s.start for s in key)
+        with self.lock:
+            self.h5ds.id.write_direct_chunk(offset, data)
+
+
+def _write_direct(path, ds, names, encoding, njobs):
+    """
+    Append the data variables `names` of `ds` to the NetCDF file `path`,
+    compressing the chunks on `njobs` threads.
+    """
+    import h5netcdf
+    import h5py
+
+    variables, global_attrs = conventions.encode_dataset_coordinates(ds)
+    arrays = []
+    with h5netcdf.File(path, 'a') as f:
+        for name in names:
+            # Apply the CF encoding (fill value, scale factor, units) of
+            # the variable, as ``xarray.to_netcdf`` would.
+            var = conventions.encode_cf_variable(variables[name], name=name)
+            enc = encoding[name]
+            attrs = dict(var.attrs)
+            fillvalue = attrs.pop('_FillValue', None)
+            for dim, n in zip(var.dims, var.shape):
+                if dim not in f.dimensions:
+                    f.dimensions[dim] = n
+            kwargs = {}
+            if enc.get('zlib'):
+                kwargs.update(compression='gzip',
+                              compression_opts=enc['complevel'],
+                              shuffle=enc.get('shuffle', False))
+            nc_var = f.create_variable(
+                name, dimensions=var.dims, dtype=var.dtype,
+                fillvalue=fillvalue, chunks=enc['chunksizes'], **kwargs)
+            for k, v in attrs.items():
+                nc_var.attrs[k] = v
+            data = var.data
+            if not isinstance(data, da.Array):
+                data = da.from_array(data, chunks=enc['chunksizes'])
+            arrays.append(data.rechunk(enc['chunksizes']))
+        if 'coordinates' in global_attrs:
+            f.attrs['coordinates'] = global_attrs['coordinates']
+        elif 'coordinates' in f.attrs:
+            del f.attrs['coordinates']
+
+    # The chunks are written through h5py, with the filters declared by
+    # each dataset.
+    lock = threading.Lock()
+    with h5py.File(path, 'a') as f:
+        targets = [_DirectChunkWriter(f[name], lock=lock) for name in names]
+        da.store(arrays, targets, lock=False, scheduler='threads',
+                 num_workers=njobs)
+
+
+def to_netcdf(ds, path, *args, compression='zlib', complevel=5, shuffle=True,
+              chunks='auto', chunk_bytes=CHUNK_BYTES, njobs=1,
+              direct_chunks=False, **kwargs):
     """Write an xarray Dataset to disk.
 
     In addition to xarray.to_netcdf, this function allows to store complex
     valued data by converting it to a a pair of reals. This process is
     reverted when reading the file via `from_netcdf`.
 
+    The data variables and non-index coordinates, such as two-dimensional
+    ``lat`` and ``lon``, are stored in chunks, which are aligned with the
+    dask chunks of the dataset, and compressed. Dimension coordinates and
+    strings are stored uncompressed.
+
     Parameters
     ----------
     ds : xarray.Dataset
         The dataset to be stored to disk.
     path : str
         The path of the target NetCDF file.
+    compression : {'zlib', 'lzf', None}, optional
+        The compression filter (default: 'zlib'). 'lzf' is much faster than
+        'zlib' but compresses less, and can only be read with HDF5 based
+        libraries such as h5netcdf and h5py. Use None for temporary files
+        that are written once and read soon after.
+    complevel : int, optional
+        The zlib compression level between 1 and 9 (default: 5).
+    shuffle : bool, optional
+        If True (default), apply the shuffle filter before compression,
+        which usually improves the compression of floating point data.
+    chunks : 'auto' or dict or None, optional
+        If 'auto' (default), use the dask chunks of each variable, split
+        until they are no larger than `chunk_bytes`. Variables that are not
+        dask arrays are split into chunks of about `chunk_bytes`.
+        If dict, the chunk size along each dimension. If None, store the
+        variables contiguously, which rules out compression.
+    chunk_bytes : int, optional
+        The target size of a chunk in bytes (default: 1 MiB).
+    njobs : int, optional
+        The number of threads used to compute the chunks (default: 1).
+        HDF5 still compresses one chunk at a time, unless `direct_chunks`
+        is True.
+    direct_chunks : bool, optional
+        If True, the numeric data variables are also compressed on `njobs`
+        threads, and the compressed chunks are written directly into the
+        file, bypassing the HDF5 filter pipeline (default: False). Only
+        supported for 'zlib' or no compression, and not with
+        ``compute=False``.
+    *args : list
+        Extra positional arguments passed on to ``xarray.to_netcdf``.
+    **kwargs : dict
+        Extra keyword arguments passed on to ``xarray.to_netcdf``. An
+        ``encoding`` passed here takes precedence over the chunking and
+        compression options.
     """
 
+    if chunks is None and compression is not None:
+        raise ValueError('Compression requires `chunks` other than None.')
     write = disassemble_complex(ds)
-    comp = dict(zlib=True, complevel=5)
-    encoding = {var: comp for var in write.variables}
-    if 'encoding' in kwargs:
-        encoding.update(kwargs['encoding'])
-    kwargs['encoding'] = encoding
+    encoding = {var: _encoding(write[var].variable, compression=compression,
+                               complevel=complevel, shuffle=shuffle,
+                               chunks=chunks, chunk_bytes=chunk_bytes)
+                for var in write.variables if var not in write.dims}
+    user_encoding = kwargs.pop('encoding', {})
+    encoding.update(user_encoding)
+
+    # Write numpy arrays one chunk at a time, so that the real and imaginary
+    # parts of complex variables, which are strided views, are never copied
+    # as a whole.
+    for var in write.data_vars:
+        chunksizes = encoding[var].get('chunksizes')
+        if write[var].chunks is None and chunksizes is not None:
+            # Pass a token, as hashing the data would copy strided arrays.
+            write[var] = write[var].chunk(
+                dict(zip(write[var].dims, chunksizes)),
+                token=uuid.uuid4().hex)
     if 'engine' not in kwargs:
         kwargs['engine'] = 'h5netcdf'
-    return write.to_netcdf(path, *args, **kwargs)
+
+    direct = []
+    if direct_chunks:
+        if compression == 'lzf' or kwargs['engine'] != 'h5netcdf' or \
+                kwargs.get('mode', 'w') != 'w' or args:
+            raise ValueError('`direct_chunks` requires zlib or no '
+                             'compression, a new file and the h5netcdf '
+                             'engine.')
+        if not kwargs.get('compute', True):
+            raise ValueError('`direct_chunks` does not support '
+                             '`compute=False`.')
+        # HDF5 applies its filters one chunk at a time. To compress in
+        # parallel, the data variables are compressed by dask and their
+        # chunks written directly into the file.
+        direct = [var for var in write.data_vars
+                  if var not in user_encoding and
+                  'chunksizes' in encoding[var] and
+                  write[var].dtype.kind in 'biuf']
+
+    # Only override the scheduler of the caller if asked to.
+    config = dask.config.set(scheduler='threads', num_workers=njobs) \
+        if njobs != 1 else contextlib.nullcontext()
+    with config:
+        if len(direct) == 0:
+            return write.to_netcdf(path, *args, encoding=encoding, **kwargs)
+        write.drop_vars(direct).to_netcdf(
+            path, encoding={k: v for k, v in encoding.items()
+                            if k not in direct}, **kwargs)
+    _write_direct(path, write, direct, encoding, njobs)
 
 
 def open_netcdf(path, *args, **kwargs):
@@ -57,11 +316,14 @@ def open_netcdf(path, *args, **kwargs):
         kwargs['engine'] = 'h5netcdf'
     ds = xr.open_dataset(path, *args, **kwargs)
     ds = assemble_complex(ds)
-    #
-    # If the dataset dimensions are named lon and lat,
-    # rename them to x and y for consistency.
-    # Retain lat and lon as separate coordinates.
-    #
+    return _latlon_to_xy(ds)
+
+
+def _latlon_to_xy(ds):
+    """
+    If the dataset dimensions are named lon and lat, rename them to x and y
+    for consistency. Retain lat and lon as separate coordinates.
+    """
     if 'lon' in ds.dims and 'lat' in ds.dims:
         ds = ds.rename({'lat': 'y', 'lon': 'x'})
         ds.coords['lat'] = ds.coords['y']
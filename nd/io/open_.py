@@ -1,16 +1,22 @@
 import os
-from .beamdimap_ import open_beam_dimap
-from .netcdf_ import open_netcdf
-from nd.io.rasterio_ import open_rasterio
+import glob
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import xarray as xr
+from .formats_ import FORMATS, detect_format
+from .. import utils
 
 
-def open_dataset(path, *args, **kwargs):
+def open_dataset(path, *args, format=None, **kwargs):
     """
     The default way of reading a dataset from disk.
 
-    Determines the file format from the extension, and calls either
-    :meth:`nd.io.open_netcdf`, :meth:`nd.io.open_beam_dimap`, or
-    :meth:`nd.io.open_rasterio`.
+    Determines the file format from the first bytes of the file or, failing
+    that, from the extension, and calls the reader registered for that
+    format (see :meth:`nd.io.register_format`), e.g.
+    :meth:`nd.io.open_netcdf`, :meth:`nd.io.open_beam_dimap`,
+    :meth:`nd.io.open_zarr`, or :meth:`nd.io.open_envi`. Files of unknown
+    format are passed to :meth:`nd.io.open_rasterio`.
 
     Parameters
     ----------
@@ -19,6 +25,8 @@ def open_dataset(path, *args, **kwargs):
     *args : list
         Extra positional arguments passed on to the specialized ``open_*``
         function.
+    format : str, optional
+        The name of a registered format. Skips the format detection.
     **kwargs : dict
         Extra keyword arguments passed on to the specialized ``open_*``
         function.
@@ -26,24 +34,197 @@ def open_dataset(path, *args, **kwargs):
     Returns
     -------
     xarray.Dataset or xarray.DataArray
-        The opened dataset. In general, if the file is a NetCDF or BEAM-Dimap
-        file the result will be an xarray Dataset, otherwise an xarray
-        DataArray.
+        The opened dataset. In general, if the file is a NetCDF, BEAM-Dimap
+        or Zarr file the result will be an xarray Dataset, otherwise an
+        xarray DataArray.
 
     Raises
     ------
     IOError
-        Raises an IOError if the Dataset could not be opened.
+        Raises an IOError if the reader failed to open the Dataset. The
+        message names the format that was tried and the reason, and the
+        original exception is chained. Specific operating system errors
+        such as FileNotFoundError or PermissionError are raised unchanged.
     """
 
-    _, ext = os.path.splitext(path)
-    if ext == '.nc':
-        return open_netcdf(path, *args, **kwargs)
-
-    elif ext == '.dim':
-        return open_beam_dimap(path, *args, **kwargs)
+    if format is None:
+        format = detect_format(path)
+    if format is None:
+        # GDAL can read many more formats.
+        from .rasterio_ import open_rasterio
+        format, reader = 'rasterio', open_rasterio
+    elif format in FORMATS:
+        reader = FORMATS[format].reader
+    else:
+        raise ValueError("Unknown format '{}'. Must be one of {}.".format(
+            format, list(FORMATS)))
 
     try:
-        return open_rasterio(path, *args, **kwargs)
-    except Exception:
-        raise IOError('Could not read the file.')
+        return reader(path, *args, **kwargs)
+    except OSError as e:
+        if type(e) is not OSError:
+            raise
+        error = e
+    except Exception as e:
+        error = e
+    raise IOError("Could not read '{}' as {}: {}: {}".format(
+        path, format, type(error).__name__, error)) from error
+
+
+def open_many(paths, parallel=True, njobs=None, opener=None, **kwargs):
+    """
+    Open several files, optionally on a thread pool.
+
+    Opening a product is dominated by file I/O and metadata parsing, both of
+    which release the GIL, so threads give a near linear speedup.
+
+    Parameters
+    ----------
+    paths : list of str
+        The file paths.
+    parallel : bool, optional
+        If True (default), open the files concurrently.
+    njobs : int, optional
+        The number of threads. By default, use the default of
+        ``concurrent.futures.ThreadPoolExecutor``.
+    opener : callable, optional
+        The function used to open each file (default:
+        :meth:`nd.io.open_dataset`).
+    **kwargs : dict
+        Extra keyword arguments passed on to `opener`.
+
+    Returns
+    -------
+    list
+        The opened datasets, in the same order as `paths`.
+    """
+    if opener is None:
+        opener = open_dataset
+
+    def _open(path):
+        return opener(path, **kwargs)
+
+    if not parallel or len(paths) < 2:
+        return [_open(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=njobs) as executor:
+        return list(executor.map(_open, paths))
+
+
+def _as_dataset(obj):
+    """Convert a DataArray, as returned for GeoTIFF files, into a Dataset.
+    """
+    if isinstance(obj, xr.DataArray):
+        return obj.to_dataset(name=obj.name if obj.name else 'band_data')
+    return obj
+
+
+def _add_time(ds, time=None):
+    """Make sure that `ds` has a ``time`` coordinate along a ``time``
+    dimension, reading it from the ``start_date`` attribute if necessary.
+    """
+    if 'time' in ds.coords:
+        if 'time' not in ds.dims:
+            ds = ds.expand_dims('time')
+        return ds
+    if time is None:
+        if 'start_date' not in ds.attrs:
+            raise ValueError('Cannot determine the acquisition time of a '
+                             'dataset. Pass `times` explicitly.')
+        time = utils.str2date(ds.attrs['start_date'])
+    # Store naive UTC times, so that they can be compared with the
+    # datetime64 time coordinates of other datasets.
+    time = pd.Timestamp(time)
+    if time.tzinfo is not None:
+        time = time.tz_convert('UTC').tz_localize(None)
+    return ds.assign_coords(time=[time.to_datetime64()])
+
+
+def _check_coords(datasets):
+    """Make sure that the datasets share the same coordinates that are not
+    indexed and do not vary in time, such as tie point grids.
+    """
+    first = datasets[0]
+    for ds in datasets[1:]:
+        names = set(ds.coords) | set(first.coords)
+        for name in sorted(names - set(ds.indexes) - set(first.indexes)):
+            if name in ds.coords and 'time' in ds[name].dims:
+                continue
+            if name not in ds.coords or name not in first.coords or \
+                    not ds[name].variable.equals(first[name].variable):
+                raise ValueError(
+                    "The coordinate '{}' differs between the products. "
+                    "Align the products first (see nd.warp.Alignment), or "
+                    "open them with open_many() and drop it before "
+                    "concatenating.".format(name))
+
+
+def open_mfdataset(paths, parallel=True, njobs=None, chunks=None, times=None,
+                   **kwargs):
+    """
+    Open multiple products as a single dataset, concatenated along time.
+
+    Each file is opened with :meth:`nd.io.open_dataset`, so NetCDF,
+    BEAM-Dimap and GeoTIFF files are supported, and may be mixed. The files
+    are opened on a thread pool, which only reads the metadata. The data
+    itself is read lazily as dask arrays.
+
+    Parameters
+    ----------
+    paths : str or list of str
+        Either a glob expression or a list of file paths.
+    parallel : bool, optional
+        If True (default), open the files concurrently on a thread pool.
+    njobs : int, optional
+        The number of threads used to open the files. By default, use the
+        default of ``concurrent.futures.ThreadPoolExecutor``.
+    chunks : dict, optional
+        The chunk sizes passed on to the specialized ``open_*`` function.
+        By default, every file is read as a single chunk.
+    times : list, optional
+        The acquisition times of the products, in the same order as `paths`.
+        Only used for files that do not store their acquisition time, such
+        as GeoTIFF.
+    **kwargs : dict
+        Extra keyword arguments passed on to :meth:`nd.io.open_dataset`.
+
+    Returns
+    -------
+    xarray.Dataset
+        The lazily concatenated dataset, sorted by time. GeoTIFF data is
+        stored in the variable ``band_data``.
+
+    Raises
+    ------
+    ValueError
+        Raises a ValueError if no files were found, if the acquisition
+        time of a product cannot be determined, or if the products have
+        different non-index coordinates (e.g. the tie point grids
+        ``tp_latitude`` and ``tp_longitude`` of unaligned products).
+    """
+
+    # Treat `paths` as a glob expression
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(paths))
+
+    if len(paths) == 0:
+        raise ValueError("No files found!")
+
+    if times is None:
+        times = [None] * len(paths)
+    elif len(times) != len(paths):
+        raise ValueError('The length of `times` must match the number of '
+                         'files.')
+
+    if chunks is None:
+        chunks = {}
+    datasets = open_many(paths, parallel=parallel, njobs=njobs,
+                         chunks=chunks, **kwargs)
+    datasets = [_add_time(_as_dataset(ds), t)
+                for ds, t in zip(datasets, times)]
+    datasets.sort(key=lambda ds: ds['time'].values[0])
+
+    # Coordinates that do not vary in time, such as latitude and longitude,
+    # are kept only once, so they must be the same for all products.
+    _check_coords(datasets)
+    return xr.concat(datasets, dim='time', data_vars='all',
+                     coords='minimal', compat='override')
@@ -1,5 +1,44 @@
+import numpy as np
 import xarray as xr
+import dask.array as da
 
 
 def open_rasterio(path, *args, **kwargs):
     return xr.open_rasterio(path, *args, **kwargs)
+
+
+def _block_aligned_chunks(shape, block_shape, dtype, chunks=None):
+    """
+    Determine chunk sizes for a raster image such that every chunk consists
+    of whole internal blocks of the file.
+
+    Parameters
+    ----------
+    shape : tuple (int, int)
+        The number of rows and columns of the image.
+    block_shape : tuple (int, int)
+        The shape of the internal blocks of the file.
+    dtype : numpy.dtype
+        The data type of the image.
+    chunks : dict, optional
+        The requested chunk sizes along ``y`` and ``x``. Sizes are rounded up
+        to a multiple of the block size. Missing dimensions are chunked
+        automatically (default: None).
+
+    Returns
+    -------
+    dict
+        The chunks along ``band``, ``y`` and ``x``.
+    """
+    if chunks is None:
+        chunks = {}
+    requested = []
+    for dim, block in zip(('y', 'x'), block_shape):
+        c = chunks.get(dim, 'auto')
+        if isinstance(c, (int, np.integer)) and c > 0:
+            c = int(np.ceil(c / block)) * block
+        requested.append(c)
+    ychunks, xchunks = da.core.normalize_chunks(
+        tuple(requested), shape=shape, dtype=dtype,
+        previous_chunks=block_shape)
+    return {'band': 1, 'y': ychunks, 'x': xchunks}
@@ -1,12 +1,14 @@
 import pytest
 from nd.io.convert_ import (assemble_complex, disassemble_complex,
-                            generate_covariance_matrix)
+                            generate_covariance_matrix, dualpol_to_complex)
 from nd.testing import generate_test_dataset, generate_test_dataarray
 from xarray.testing import assert_identical as xr_assert_identical
 from xarray.testing import assert_equal as xr_assert_equal
 from xarray.testing import assert_allclose as xr_assert_allclose
 from numpy.testing import assert_equal, assert_allclose
 import numpy as np
+import xarray as xr
+import dask.array
 
 
 def test_disassemble_complex_dataset():
@@ -34,6 +36,23 @@ def test_disassemble_complex_dataarray():
     xr_assert_equal(da.imag, ds_real['data__im'])
 
 
+def test_disassemble_complex_chunks():
+    ds = generate_test_dataset(var=['b', 'c'])
+    ds['a'] = ds['b'] + 1j * ds['c']
+    # numpy data stays in memory.
+    ds_real = disassemble_complex(ds)
+    for v in ds_real.data_vars:
+        assert isinstance(ds_real[v].data, np.ndarray)
+    # dask arrays keep their chunks, other variables are not chunked.
+    ds['a'] = ds['a'].chunk({'y': 7, 'x': 5})
+    ds['b'] = ds['b'].chunk({'y': 3})
+    ds_real = disassemble_complex(ds)
+    assert ds_real['a__re'].chunks == ds['a'].chunks
+    assert ds_real['a__im'].chunks == ds['a'].chunks
+    assert ds_real['b'].chunks == ds['b'].chunks
+    assert isinstance(ds_real['c'].data, np.ndarray)
+
+
 def test_assemble_complex_dataset():
     # Create real dataset with real and imag part
     ds = generate_test_dataset(var=['a__im', 'a__re', 'b', 'c'])
@@ -51,12 +70,44 @@ def test_assemble_and_dissassemble_complex():
     xr_assert_identical(ds_orig, ds_real)
 
 
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_assemble_and_disassemble_complex_dtype(dtype):
+    ds = generate_test_dataset(var=['a__im', 'a__re', 'b']).astype(dtype)
+    ctype = np.result_type(dtype, np.complex64)
+    ds_complex = assemble_complex(ds)
+    assert ds_complex['a'].dtype == ctype
+    assert ds_complex['b'].dtype == dtype
+    ds_real = disassemble_complex(ds_complex)
+    for v in ds_real.data_vars:
+        assert ds_real[v].dtype == dtype
+
+
+@pytest.mark.parametrize('dtype', [np.complex64, np.complex128])
+def test_generate_covariance_matrix_dtype(dtype):
+    ds = assemble_complex(
+        generate_test_dataset(var=['VV__re', 'VV__im', 'VH__re', 'VH__im']))
+    ds = ds.astype(dtype)
+    ds_cov = generate_covariance_matrix(ds)
+    assert ds_cov['C12'].dtype == dtype
+    assert ds_cov['C11'].dtype == np.finfo(dtype).dtype
+    assert ds_cov['C22'].dtype == np.finfo(dtype).dtype
+
+
 def test_add_time():
     pass
 
 
-def test_dualpol_to_complex():
-    pass
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_dualpol_to_complex(dtype):
+    ds = generate_test_dataset(
+        var=['i_VV.img', 'q_VV.img', 'i_VH.img', 'q_VH.img']).astype(dtype)
+    ds_complex = dualpol_to_complex(ds)
+    ctype = np.result_type(dtype, np.complex64)
+    assert_equal(set(ds_complex.data_vars), {'VV', 'VH'})
+    for pol in ['VV', 'VH']:
+        assert ds_complex[pol].dtype == ctype
+        xr_assert_equal(ds_complex[pol].real, ds['i_{}.img'.format(pol)])
+        xr_assert_equal(ds_complex[pol].imag, ds['q_{}.img'.format(pol)])
 
 
 def test_generate_covariance_matrix():
@@ -70,3 +121,32 @@ def test_generate_covariance_matrix():
 
 def test_compact_to_complex():
     pass
+
+
+def test_disassemble_complex_views():
+    ds = assemble_complex(generate_test_dataset(var=['a__im', 'a__re']))
+    ds_real = disassemble_complex(ds)
+    assert np.shares_memory(ds_real['a__re'].values, ds['a'].values)
+    assert np.shares_memory(ds_real['a__im'].values, ds['a'].values)
+    # Dask chunks are retained
+    ds_real = disassemble_complex(ds.chunk({'x': 5}))
+    assert ds_real['a__re'].chunks == ds.chunk({'x': 5})['a'].chunks
+
+
+def test_assemble_complex_lazy():
+    ds = generate_test_dataset(var=['a__im', 'a__re']).chunk({'x': 5})
+    ds_complex = assemble_complex(ds)
+    assert isinstance(ds_complex['a'].data, dask.array.Array)
+    assert ds_complex['a'].chunks == ds['a__re'].chunks
+    xr_assert_equal(ds_complex['a'].real, ds['a__re'])
+    xr_assert_equal(ds_complex['a'].imag, ds['a__im'])
+
+
+@pytest.mark.parametrize('shape', [(0, 5, 3), (4, 0, 3), (0,)])
+def test_assemble_complex_empty(shape):
+    dims = ('y', 'x', 'time')[:len(shape)]
+    ds = xr.Dataset({'a__re': (dims, np.zeros(shape, dtype=np.float32)),
+                     'a__im': (dims, np.zeros(shape, dtype=np.float32))})
+    ds_complex = assemble_complex(ds)
+    assert ds_complex['a'].shape == shape
+    assert ds_complex['a'].dtype == np.complex64
@@ -0,0 +1,116 @@
+import pytest
+import os
+import numpy as np
+import rasterio as rio
+import xarray as xr
+from numpy.testing import assert_equal
+from nd.io.envi_ import _ENVIArray, _read_envi_header, open_envi
+from nd.warp import get_crs
+
+
+data_path = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '../../../data/'))
+envi_path = os.path.join(data_path, 'slc.data', 'C11.img')
+
+
+HEADER = """ENVI
+description = {{test
+  image}}
+samples = {ncols}
+lines = {nrows}
+bands = {nbands}
+header offset = {offset}
+file type = ENVI Standard
+data type = {dtype}
+interleave = {interleave}
+byte order = {byteorder}
+band names = {{ a, b, c }}
+"""
+
+
+def _create_envi(tmpdir, interleave, byteorder, dtype=4, offset=0):
+    nbands, nrows, ncols = 3, 7, 11
+    values = np.random.rand(nbands, nrows, ncols).astype(np.float32)
+    if dtype == 2:
+        values = (values * 1000).astype(np.int16)
+    axes = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (1, 2, 0)}[interleave]
+    fmt = ('>' if byteorder else '<') + values.dtype.str[1:]
+    path = str(tmpdir.join('image.img'))
+    with open(path, 'wb') as f:
+        f.write(b'\0' * offset)
+        f.write(values.transpose(axes).astype(fmt).tobytes())
+    with open(str(tmpdir.join('image.hdr')), 'w') as f:
+        f.write(HEADER.format(ncols=ncols, nrows=nrows, nbands=nbands,
+                              offset=offset, dtype=dtype,
+                              interleave=interleave, byteorder=byteorder))
+    return path, values
+
+
+def test_read_envi_header(tmpdir):
+    path, _ = _create_envi(tmpdir, 'bsq', 1)
+    header = _read_envi_header(os.path.splitext(path)[0] + '.hdr')
+    assert header['description'] == 'test\nimage'
+    assert header['band names'] == 'a, b, c'
+    assert header['byte order'] == '1'
+    assert header['interleave'] == 'bsq'
+
+
+@pytest.mark.parametrize('interleave', ['bsq', 'bil', 'bip'])
+@pytest.mark.parametrize('byteorder', [0, 1])
+@pytest.mark.parametrize('dtype', [2, 4])
+def test_envi_array(tmpdir, interleave, byteorder, dtype):
+    path, values = _create_envi(tmpdir, interleave, byteorder, dtype=dtype,
+                                offset=16)
+    arr = _ENVIArray(path)
+    assert arr.shape == values.shape
+    assert arr.dtype == values.dtype
+    assert arr.dtype.isnative
+    assert_equal(arr[:, 2:5, 3:9], values[:, 2:5, 3:9])
+    with rio.open(path) as src:
+        assert_equal(arr[:, :, :], src.read())
+
+
+def test_envi_array_no_copy(tmpdir):
+    path, values = _create_envi(tmpdir, 'bsq', 0 if np.little_endian else 1)
+    arr = _ENVIArray(path)
+    # In native byte order, a selection is a view of the memory map.
+    aoi = arr[0, 2:5, 3:9]
+    assert isinstance(aoi.base, np.memmap) or \
+        isinstance(aoi.base.base, np.memmap)
+    assert_equal(aoi, values[0, 2:5, 3:9])
+
+
+def test_open_envi_chunks(tmpdir):
+    path, values = _create_envi(tmpdir, 'bsq', 0)
+    arr = open_envi(path, chunks={'y': 3, 'x': 4})
+    assert arr.chunks == ((1, 1, 1), (3, 3, 1), (4, 4, 3))
+    assert_equal(arr.values, values)
+    # By default, the chunks consist of whole rows.
+    assert open_envi(path).chunks[2] == (11,)
+
+
+def _create_rotated_envi(tmpdir):
+    path = str(tmpdir.join('rotated.img'))
+    transform = rio.Affine.translation(500000, 6000000) * \
+        rio.Affine.rotation(-20) * rio.Affine.scale(12, -18)
+    with rio.open(path, 'w', driver='ENVI', width=5, height=4, count=2,
+                  dtype=np.float32, crs='epsg:32633',
+                  transform=transform) as dst:
+        dst.write(np.random.rand(2, 4, 5).astype(np.float32))
+    return path
+
+
+@pytest.mark.parametrize('rotated', [False, True])
+def test_open_envi_georeferencing(tmpdir, monkeypatch, rotated):
+    path = _create_rotated_envi(tmpdir) if rotated else envi_path
+    expected = xr.open_rasterio(path)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError('GDAL should not be used.')
+
+    monkeypatch.setattr(xr, 'open_rasterio', _fail)
+    arr = open_envi(path)
+    xr.testing.assert_equal(arr.compute(), expected.compute())
+    for key in ['transform', 'res', 'scales', 'offsets']:
+        assert arr.attrs[key] == expected.attrs[key]
+    assert get_crs(arr) == get_crs(expected)
@@ -1,10 +1,27 @@
 import pytest
 import os
+import sys
+import subprocess
+import shutil
+import json
+import tracemalloc
+import numpy as np
+import lxml.etree as ET
 import xarray as xr
-from nd.io import (open_dataset, open_netcdf, open_beam_dimap, open_rasterio,
-                   to_netcdf, assemble_complex)
+import dask.array as da
+import rasterio as rio
+import h5py
+from numpy.testing import assert_equal, assert_allclose
+from nd.io import (open_dataset, open_mfdataset, open_many, open_netcdf,
+                   open_beam_dimap, open_rasterio, to_netcdf, open_zarr,
+                   to_zarr, assemble_complex, register_format)
+from nd.io.formats_ import FORMATS, detect_format
+from nd.io.netcdf_ import _chunksizes, _DirectChunkWriter
+from nd.io.beamdimap_ import (_parse_metadata, _read_metadata,
+                              METADATA_ATTRIBUTES)
 from nd.testing import generate_test_dataset
 from xarray.testing import assert_equal as xr_assert_equal
+from xarray.testing import assert_identical as xr_assert_identical
 
 
 data_path = 'data/'
@@ -32,6 +49,110 @@ def test_open_beam_dimap():
     ds.close()
 
 
+def test_open_beam_dimap_lazy():
+    ds = open_beam_dimap(dim_path, chunks={'y': 50, 'x': 100})
+    for v in ds.data_vars:
+        assert isinstance(ds[v].data, da.Array)
+    assert ds['C11'].chunks == ((1,), (50, 50, 50, 50, 6), (100,) * 5)
+    assert ds['C12'].dtype == np.complex64
+    with rio.open(os.path.join(data_path, 'slc.data', 'C12_imag.img')) as src:
+        window = rio.windows.Window(10, 60, 20, 30)
+        expected = src.read(1, window=window)
+    assert_equal(ds['C12'][0, 60:90, 10:30].imag.values, expected)
+    ds.close()
+
+
+def test_beam_dimap_metadata():
+    raw = _parse_metadata(dim_path)
+    root = ET.parse(dim_path).getroot()
+    for name in METADATA_ATTRIBUTES:
+        expected = root.find(
+            './/Dataset_Sources//MDATTR[@name="{}"]'.format(name)).text
+        assert raw['attributes'][name] == expected
+    assert raw['ncols'] == root.find('.//Raster_Dimensions/NCOLS').text
+    assert raw['data_files'] == [
+        _.attrib['href'] for _ in root.findall('.//Data_File/DATA_FILE_PATH')]
+
+
+@pytest.mark.parametrize('sidecar', [True, False])
+def test_beam_dimap_metadata_cache(tmpdir, sidecar):
+    # Copy the header only, so that it can be modified.
+    path = str(tmpdir.join('slc.dim'))
+    shutil.copy(dim_path, path)
+    cache = True if sidecar else str(tmpdir.mkdir('cache'))
+    raw = _read_metadata(path, cache=cache)
+    cache_dir = str(tmpdir) if sidecar else cache
+    cache_files = [os.path.join(cache_dir, _) for _ in os.listdir(cache_dir)
+                   if _.endswith('.meta.json')]
+    assert len(cache_files) == 1
+    assert _read_metadata(path, cache=cache) == raw
+
+    # The cache is used as long as the product is unchanged ...
+    with open(cache_files[0]) as f:
+        cached = json.load(f)
+    cached['metadata']['ncols'] = 'cached'
+    with open(cache_files[0], 'w') as f:
+        json.dump(cached, f)
+    assert _read_metadata(path, cache=cache)['ncols'] == 'cached'
+
+    # ... and invalidated once the product is modified.
+    with open(path, 'a') as f:
+        f.write('\n')
+    assert _read_metadata(path, cache=cache) == raw
+
+
+def _create_tie_point_product(tmpdir):
+    # Convert the sample product into a product that is geocoded by
+    # latitude and longitude tie point grids at every 41.2th row and
+    # 50th column.
+    path = str(tmpdir.join('slc.dim'))
+    shutil.copy(dim_path, path)
+    shutil.copytree(os.path.join(data_path, 'slc.data'),
+                    str(tmpdir.join('slc.data')))
+    os.mkdir(str(tmpdir.join('slc.data', 'tie_point_grids')))
+    tree = ET.parse(path)
+    root = tree.getroot()
+    root.remove(root.find('Coordinate_Reference_System'))
+    root.remove(root.find('Geoposition'))
+    data_access = root.find('Data_Access')
+    tp_grids = ET.Element('Tie_Point_Grids')
+    data_access.addnext(tp_grids)
+    rows = 41.2 * np.arange(6)
+    cols = 50. * np.arange(11)
+    values = {'latitude': 60 - 0.01 * rows[:, np.newaxis] + 0 * cols,
+              'longitude': -10 + 0.02 * cols + 0 * rows[:, np.newaxis]}
+    for name, v in values.items():
+        tp_file = ET.SubElement(data_access, 'Tie_Point_Grid_File')
+        ET.SubElement(tp_file, 'TIE_POINT_GRID_FILE_PATH',
+                      href='slc.data/tie_point_grids/{}.hdr'.format(name))
+        info = ET.SubElement(tp_grids, 'Tie_Point_Grid_Info')
+        for tag, text in [('TIE_POINT_GRID_NAME', name), ('NCOLS', '11'),
+                          ('NROWS', '6'), ('OFFSET_X', '0.5'),
+                          ('OFFSET_Y', '0.5'), ('STEP_X', '50.0'),
+                          ('STEP_Y', '41.2')]:
+            ET.SubElement(info, tag).text = text
+        img = str(tmpdir.join('slc.data', 'tie_point_grids', name + '.img'))
+        with rio.open(img, 'w', driver='ENVI', width=11, height=6, count=1,
+                      dtype='float32') as dst:
+            dst.write(v.astype(np.float32), 1)
+    tree.write(path)
+    return path, values
+
+
+def test_open_beam_dimap_tie_point_grids(tmpdir):
+    path, values = _create_tie_point_product(tmpdir)
+    ds = open_beam_dimap(path)
+    # The tie point grids are stored at their native resolution.
+    assert ds['tp_latitude'].dims == ('tp_y', 'tp_x')
+    assert_allclose(ds['tp_latitude'].values, values['latitude'], rtol=1e-6)
+    assert_allclose(ds['tp_longitude'].values, values['longitude'],
+                    rtol=1e-6)
+    assert_allclose(ds['tp_y'].values, 41.2 * np.arange(6))
+    assert_allclose(ds['tp_x'].values, 50. * np.arange(11))
+    assert 'lat' not in ds.coords
+    ds.close()
+
+
 def test_open_rasterio():
     ds = open_rasterio(tif_path)
     assert isinstance(ds, xr.DataArray)
@@ -50,3 +171,313 @@ def test_write_read_netcdf(tmpdir):
     to_netcdf(ds, path)
     ds_read = open_dataset(path)
     xr_assert_equal(ds, ds_read)
+
+
+@pytest.mark.parametrize('parallel', [True, False])
+def test_open_mfdataset(tmpdir, parallel):
+    ds = assemble_complex(generate_test_dataset(ntime=6))
+    paths = []
+    # Write the time steps in reverse order, so that they must be sorted.
+    for i in range(0, 6, 2)[::-1]:
+        path = str(tmpdir.join('part{}.nc'.format(i)))
+        to_netcdf(ds.isel(time=slice(i, i + 2)), path)
+        paths.append(path)
+    ds_read = open_mfdataset(paths, parallel=parallel)
+    for v in ds_read.data_vars:
+        assert isinstance(ds_read[v].data, da.Array)
+    xr_assert_equal(ds_read.transpose(*ds.dims), ds)
+    # Glob expression
+    ds_glob = open_mfdataset(str(tmpdir.join('part*.nc')), parallel=parallel)
+    xr_assert_equal(ds_glob, ds_read)
+
+
+@pytest.mark.parametrize('parallel', [True, False])
+def test_open_many(parallel):
+    paths = [nc_path, dim_path, nc_path]
+    datasets = open_many(paths, parallel=parallel)
+    assert len(datasets) == len(paths)
+    xr_assert_identical(datasets[0], open_dataset(nc_path))
+    xr_assert_identical(datasets[1], open_dataset(dim_path))
+    assert open_many(paths, opener=os.path.basename) == \
+        [os.path.basename(p) for p in paths]
+
+
+def test_open_mfdataset_start_date():
+    ds = open_mfdataset([nc_path, nc_path])
+    assert ds.sizes['time'] == 2
+    assert ds['time'].dtype == np.dtype('datetime64[ns]')
+    ds_dim = open_mfdataset([dim_path, dim_path])
+    xr_assert_equal(ds_dim['time'], ds['time'])
+
+
+def test_open_mfdataset_coords(tmpdir):
+    ds = generate_test_dataset(ntime=2)
+    ds.coords['lat2d'] = (('y', 'x'), np.random.rand(ds.sizes['y'],
+                                                    ds.sizes['x']))
+    paths = [str(tmpdir.join('part{}.nc'.format(i))) for i in range(2)]
+    to_netcdf(ds.isel(time=[0]), paths[0])
+    to_netcdf(ds.isel(time=[1]), paths[1])
+    xr_assert_equal(open_mfdataset(paths)['lat2d'], ds['lat2d'])
+    # A coordinate that differs between the products is not silently
+    # taken from the first product.
+    other = ds.isel(time=[1])
+    other.coords['lat2d'] = other['lat2d'] + 1
+    to_netcdf(other, paths[1])
+    with pytest.raises(ValueError, match='lat2d'):
+        open_mfdataset(paths)
+
+
+def test_open_mfdataset_times():
+    times = ['2018-01-02', '2018-01-01']
+    ds = open_mfdataset([tif_path, tif_path], times=times)
+    assert_equal(ds['time'].values, np.array(times[::-1], 'datetime64[ns]'))
+    assert isinstance(ds['band_data'].data, da.Array)
+    with pytest.raises(ValueError):
+        open_mfdataset([tif_path, tif_path])
+    with pytest.raises(ValueError):
+        open_mfdataset([], times=[])
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzf', None])
+@pytest.mark.parametrize('njobs', [1, 2])
+def test_to_netcdf_compression(tmpdir, compression, njobs):
+    ds = assemble_complex(generate_test_dataset(ny=50, nx=60, ntime=4))
+    ds.coords['lat'] = (('y', 'x'), np.broadcast_to(
+        ds['y'].values[:, None], (ds.dims['y'], ds.dims['x'])))
+    ds['mask'] = ds['C11'] > 0
+    ds = ds.chunk({'y': 20, 'x': 30})
+    path = str(tmpdir.join('test_dataset.nc'))
+    to_netcdf(ds, path, compression=compression, njobs=njobs)
+    ds_read = open_netcdf(path)
+    xr_assert_identical(ds_read[list(ds.data_vars)].transpose(*ds.dims),
+                        ds.compute())
+    with h5py.File(path, 'r') as f:
+        for v in ['C11', 'C12__re', 'C12__im']:
+            assert f[v].chunks == (20, 30, 4)
+            assert f[v].compression == \
+                {'zlib': 'gzip', 'lzf': 'lzf', None: None}[compression]
+        # Non-index coordinates are compressed, dimension coordinates not
+        assert f['lat'].compression == \
+            {'zlib': 'gzip', 'lzf': 'lzf', None: None}[compression]
+        assert f['y'].compression is None
+
+
+def _h5_contents(path):
+    # The raw values and the attributes, except the dimension scale
+    # references, of all variables in a HDF5 file.
+    contents = {}
+    with h5py.File(path, 'r') as f:
+        for name, var in f.items():
+            attrs = {k: v for k, v in var.attrs.items()
+                     if k not in ('DIMENSION_LIST', 'REFERENCE_LIST')}
+            contents[name] = (var[()], attrs, var.compression, var.chunks)
+    return contents
+
+
+@pytest.mark.parametrize('compression', ['zlib', None])
+def test_to_netcdf_direct_chunks(tmpdir, compression):
+    ds = assemble_complex(generate_test_dataset(ny=50, nx=60, ntime=4))
+    ds['C11'].attrs['units'] = 'm'
+    ds['C11'].encoding = {'_FillValue': -9999.0}
+    ds['C22'].encoding = {'dtype': 'int16', 'scale_factor': 0.001,
+                          '_FillValue': -1}
+    ds = ds.chunk({'y': 20, 'x': 30})
+    path = str(tmpdir.join('direct.nc'))
+    reference = str(tmpdir.join('reference.nc'))
+    to_netcdf(ds, path, compression=compression, njobs=2,
+              direct_chunks=True)
+    to_netcdf(ds, reference, compression=compression)
+    direct = _h5_contents(path)
+    expected = _h5_contents(reference)
+    assert direct.keys() == expected.keys()
+    for name in expected:
+        values, attrs, filters, chunks = direct[name]
+        assert_equal(values, expected[name][0])
+        assert attrs.keys() == expected[name][1].keys()
+        for k in attrs:
+            assert_equal(attrs[k], expected[name][1][k])
+        assert (filters, chunks) == expected[name][2:]
+    xr_assert_identical(open_netcdf(path), open_netcdf(reference))
+    # The file can be read by the netCDF library as well.
+    netCDF4 = pytest.importorskip('netCDF4')
+    with netCDF4.Dataset(path) as f, netCDF4.Dataset(reference) as g:
+        for name in g.variables:
+            assert_equal(f[name][:], g[name][:])
+
+
+def test_to_netcdf_direct_chunks_invalid(tmpdir):
+    ds = generate_test_dataset().chunk({'y': 5})
+    path = str(tmpdir.join('direct.nc'))
+    with pytest.raises(ValueError):
+        to_netcdf(ds, path, njobs=2, direct_chunks=True, compute=False)
+    with pytest.raises(ValueError):
+        to_netcdf(ds, path, compression='lzf', direct_chunks=True)
+
+
+def test_to_netcdf_string_coordinate(tmpdir):
+    ds = assemble_complex(generate_test_dataset(ntime=3))
+    ds.coords['label'] = ('time', np.array(['a', 'b', 'c'], dtype=object))
+    path = str(tmpdir.join('test_dataset.nc'))
+    to_netcdf(ds, path)
+    ds_read = open_netcdf(path)
+    assert_equal(ds_read['label'].values, ds['label'].values)
+    xr_assert_equal(ds_read.transpose(*ds.dims), ds)
+
+
+def test_direct_chunk_writer_filters(tmpdir):
+    path = str(tmpdir.join('test.h5'))
+    with h5py.File(path, 'w') as f:
+        h5ds = f.create_dataset('a', shape=(10, 10), dtype='f4',
+                                chunks=(5, 5), compression='gzip',
+                                compression_opts=3, shuffle=True)
+        writer = _DirectChunkWriter(h5ds)
+        assert writer.complevel == 3
+        assert writer.shuffle
+        values = np.arange(100, dtype='f4').reshape((10, 10))
+        da.store(da.from_array(values, chunks=(5, 5)), writer, lock=False)
+        assert_equal(h5ds[()], values)
+        h5ds = f.create_dataset('b', shape=(10, 10), dtype='f4',
+                                chunks=(5, 5), fletcher32=True)
+        with pytest.raises(ValueError):
+            _DirectChunkWriter(h5ds)
+
+
+def test_to_netcdf_chunks():
+    var = xr.Variable(('y', 'x'), np.zeros((1000, 1000)))
+    assert _chunksizes(var, chunks={'y': 100}) == (100, 1000)
+    assert _chunksizes(var, chunks=None) is None
+    chunks = _chunksizes(var, chunk_bytes=2 ** 16)
+    assert np.prod(chunks) * 8 <= 2 ** 16
+    # Dask chunks are split evenly
+    var = var.chunk({'y': 400, 'x': 1000})
+    assert _chunksizes(var, chunk_bytes=2 ** 20) == (400, 250)
+
+
+def test_to_netcdf_invalid_compression(tmpdir):
+    ds = generate_test_dataset()
+    path = str(tmpdir.join('test_dataset.nc'))
+    with pytest.raises(ValueError):
+        to_netcdf(ds, path, compression='bzip2')
+
+
+def test_netcdf_complex_memory(tmpdir):
+    values = np.random.rand(1000, 1000) + 1j * np.random.rand(1000, 1000)
+    ds = xr.Dataset({'a': (('y', 'x'), values.astype(np.complex64))})
+    nbytes = ds['a'].nbytes
+    path = str(tmpdir.join('complex.nc'))
+    tracemalloc.start()
+    try:
+        to_netcdf(ds, path)
+        write_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        ds_read = open_netcdf(path)
+        read_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # No full-size copies of the real or imaginary parts are made.
+    assert write_peak < 0.25 * nbytes
+    assert read_peak < 1.5 * nbytes
+    xr_assert_identical(ds_read, ds)
+
+
+def test_write_read_zarr(tmpdir):
+    pytest.importorskip('zarr')
+    ds = assemble_complex(generate_test_dataset(ny=50, nx=60, ntime=4))
+    path = str(tmpdir.join('test_dataset.zarr'))
+    to_zarr(ds.chunk({'y': 25}), path, chunk_bytes=2 ** 14)
+    ds_read = open_dataset(path)
+    assert isinstance(ds_read['C12'].data, da.Array)
+    assert ds_read['C12'].dtype == ds['C12'].dtype
+    # Every dask chunk consists of whole Zarr chunks.
+    assert np.prod(ds_read['C11'].data.chunksize) * 8 <= 2 ** 14
+    xr_assert_identical(ds_read.transpose(*ds.dims).compute(), ds)
+
+
+def test_write_zarr_regions(tmpdir):
+    pytest.importorskip('zarr')
+    ds = generate_test_dataset(ny=40, nx=20, ntime=2).chunk({'y': 10})
+    path = str(tmpdir.join('test_dataset.zarr'))
+    # Initialize the store, then write disjoint regions independently.
+    to_zarr(ds, path, compute=False, chunks={'y': 5})
+    for start in range(0, 40, 20):
+        region = {'y': slice(start, start + 20)}
+        to_zarr(ds.isel(region).drop_vars(['x', 'time']), path,
+                region=region)
+    xr_assert_equal(open_zarr(path).compute(), assemble_complex(ds))
+
+
+def test_write_zarr_append_new_store(tmpdir):
+    pytest.importorskip('zarr')
+    ds = generate_test_dataset(ny=20, nx=10, ntime=2)
+    path = str(tmpdir.join('test_dataset.zarr'))
+    # Appending to a store that does not exist yet creates it.
+    to_zarr(ds, path, mode='a')
+    xr_assert_equal(open_zarr(path).compute(), assemble_complex(ds))
+
+
+def test_open_zarr_latlon(tmpdir):
+    pytest.importorskip('zarr')
+    ds = generate_test_dataset().rename({'y': 'lat', 'x': 'lon'})
+    path = str(tmpdir.join('test_dataset.zarr'))
+    to_zarr(ds, path)
+    ds_read = open_zarr(path)
+    assert 'y' in ds_read.dims and 'x' in ds_read.dims
+    assert_equal(ds_read['lat'].values, ds['lat'].values)
+
+
+@pytest.mark.parametrize('f,fmt', [
+    (nc_path, 'netcdf'), (dim_path, 'beam_dimap'), (tif_path, 'geotiff'),
+    (os.path.join(data_path, 'slc.data', 'C11.img'), 'envi')])
+def test_detect_format(tmpdir, f, fmt):
+    assert detect_format(f) == fmt
+    # The format is detected from the contents, not the extension.
+    renamed = str(tmpdir.join('renamed.dat'))
+    shutil.copy(f, renamed)
+    if fmt == 'envi':
+        shutil.copy(os.path.splitext(f)[0] + '.hdr', str(tmpdir.join(
+            'renamed.hdr')))
+        assert detect_format(renamed) is None
+    else:
+        assert detect_format(renamed) == fmt
+
+
+def test_register_format(tmpdir):
+    path = str(tmpdir.join('test.custom'))
+    with open(path, 'w') as f:
+        f.write('CUSTOM')
+    ds = generate_test_dataset()
+    register_format('custom', lambda p: ds,
+                    detect=lambda p, head: head.startswith(b'CUSTOM'))
+    try:
+        assert detect_format(path) == 'custom'
+        assert open_dataset(path) is ds
+    finally:
+        del FORMATS['custom']
+    assert detect_format(path) is None
+
+
+def test_open_dataset_error(tmpdir):
+    path = str(tmpdir.join('broken.nc'))
+    with open(path, 'wb') as f:
+        f.write(b'\x89HDF\r\n\x1a\n' + b'\0' * 100)
+    with pytest.raises(IOError) as excinfo:
+        open_dataset(path)
+    assert 'netcdf' in str(excinfo.value)
+    assert excinfo.value.__cause__ is not None
+    with pytest.raises(ValueError):
+        open_dataset(nc_path, format='unknown')
+
+
+def test_open_dataset_missing_file(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        open_dataset(str(tmpdir.join('missing.nc')))
+
+
+def test_import_is_lazy():
+    # Importing nd.io must not load the individual format backends.
+    code = ("import sys, nd.io; "
+            "print(any(m in sys.modules for m in "
+            "('nd.io.netcdf_', 'nd.io.beamdimap_', 'nd.io.envi_', "
+            "'nd.io.tiepoints_', 'rasterio')))")
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.strip() == b'False'
@@ -0,0 +1,54 @@
+import pytest
+import numpy as np
+import dask.array as da
+from numpy.testing import assert_allclose
+from nd.io import TiePointGrid
+
+
+rows = np.linspace(0, 99, 6)
+cols = 0.5 + 10 * np.arange(8)
+
+
+def _linear(r, c):
+    return 60 - 0.01 * r[:, np.newaxis] + 0.002 * c[np.newaxis, :]
+
+
+@pytest.mark.parametrize('order', [1, 3])
+def test_interp_linear(order):
+    # A linear function is reproduced exactly by any spline order,
+    # including at fractional pixel positions and beyond the outermost tie
+    # points.
+    tpg = TiePointGrid(_linear(rows, cols), rows, cols, order=order)
+    r = np.array([0, 3.5, 17, 98, 105])
+    c = np.arange(0, 71, 7)
+    assert_allclose(tpg.interp(r, c), _linear(r, c))
+
+
+def test_interp_at_tie_points():
+    values = np.random.rand(len(rows), len(cols))
+    tpg = TiePointGrid(values, rows, cols)
+    assert_allclose(tpg.interp(rows, cols), values, atol=1e-10)
+
+
+def test_interp_dtype():
+    values = _linear(rows, cols).astype(np.float32)
+    tpg = TiePointGrid(values, rows, cols)
+    assert tpg.interp(rows, cols).dtype == np.float32
+
+
+def test_to_dataarray():
+    tpg = TiePointGrid(_linear(rows, cols), rows, cols)
+    arr = tpg.to_dataarray((100, 71), chunks={'y': 30, 'x': 20}, name='lat')
+    assert isinstance(arr.data, da.Array)
+    assert arr.dims == ('y', 'x')
+    assert arr.chunks == ((30, 30, 30, 10), (20, 20, 20, 11))
+    assert_allclose(arr.values, tpg.interp(np.arange(100), np.arange(71)))
+    # Evaluating a window only computes the required blocks.
+    window = arr[40:50, 25:30]
+    assert_allclose(window.values, _linear(np.arange(40, 50),
+                                           np.arange(25, 30)))
+
+
+def test_shape_mismatch():
+    with pytest.raises(ValueError):
+        TiePointGrid(np.zeros((3, 4)), rows, cols)
@@ -0,0 +1,132 @@
+import numpy as np
+import xarray as xr
+import dask.array as da
+from scipy.interpolate import RectBivariateSpline
+
+
+class TiePointGrid:
+    """
+    A quantity that is sampled on a sparse, regular grid of image pixels,
+    such as the latitude and longitude tie point grids of a SAR product.
+
+    The grid is stored at its native resolution and interpolated to image
+    pixels on demand, either for arbitrary windows with :meth:`interp`, or
+    lazily for the entire image with :meth:`to_dataarray`.
+
+    Parameters
+    ----------
+    values : array-like, shape (m, n)
+        The values at the tie points.
+    rows : array-like, shape (m,)
+        The image row index of each row of tie points. May be fractional.
+    cols : array-like, shape (n,)
+        The image column index of each column of tie points. May be
+        fractional.
+    order : int, optional
+        The order of the interpolating spline, 1 for bilinear and 3 for
+        bicubic interpolation (default: 3). The order is reduced if the grid
+        has too few tie points. Pixels outside the tie point grid are
+        extrapolated.
+    """
+
+    def __init__(self, values, rows, cols, order=3):
+        self.values = np.asarray(values)
+        self.rows = np.asarray(rows, dtype=np.float64)
+        self.cols = np.asarray(cols, dtype=np.float64)
+        if self.values.shape != (len(self.rows), len(self.cols)):
+            raise ValueError('The shape of `values` must match the lengths '
+                             'of `rows` and `cols`.')
+        self.order = order
+        # Widen the domain of the spline so that pixels beyond the outermost
+        # tie points are extrapolated rather than clamped.
+        row_span = self.rows.max() - self.rows.min()
+        col_span = self.cols.max() - self.cols.min()
+        bbox = [self.rows.min() - row_span, self.rows.max() + row_span,
+                self.cols.min() - col_span, self.cols.max() + col_span]
+        self._spline = RectBivariateSpline(
+            self.rows, self.cols, self.values, bbox=bbox,
+            kx=min(order, len(self.rows) - 1),
+            ky=min(order, len(self.cols) - 1))
+
+    @property
+    def dtype(self):
+        return np.result_type(self.values.dtype, np.float32)
+
+    @classmethod
+    def from_dataset(cls, ds, name, order=3):
+        """
+        Create a tie point grid from the coordinate ``tp_<name>`` of a
+        dataset, as created by :meth:`nd.io.open_beam_dimap`.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or xarray.DataArray
+            The dataset.
+        name : str
+            The name of the tie point grid, e.g. ``'latitude'``.
+        order : int, optional
+            The order of the interpolating spline (default: 3).
+
+        Returns
+        -------
+        TiePointGrid
+            The tie point grid.
+        """
+        tpg = ds.coords['tp_' + name].transpose('tp_y', 'tp_x')
+        return cls(tpg.values, tpg['tp_y'].values, tpg['tp_x'].values,
+                   order=order)
+
+    def interp(self, rows, cols):
+        """
+        Interpolate the tie point grid to the image pixels on the grid
+        spanned by `rows` and `cols`.
+
+        Parameters
+        ----------
+        rows : array-like
+            The image row indices.
+        cols : array-like
+            The image column indices.
+
+        Returns
+        -------
+        numpy.ndarray, shape (len(rows), len(cols))
+            The interpolated values.
+        """
+        rows = np.asarray(rows, dtype=np.float64)
+        cols = np.asarray(cols, dtype=np.float64)
+        return self._spline(rows, cols, grid=True).astype(self.dtype)
+
+    def to_dataarray(self, shape, chunks=None, name=None):
+        """
+        Lazily interpolate the tie point grid to every pixel of an image.
+        Each chunk is only computed when needed.
+
+        Parameters
+        ----------
+        shape : tuple (int, int)
+            The number of rows and columns of the image.
+        chunks : tuple or dict, optional
+            The chunk sizes along ``y`` and ``x``. By default, the chunk sizes
+            are chosen automatically.
+        name : str, optional
+            The name of the DataArray.
+
+        Returns
+        -------
+        xarray.DataArray
+            A dask-backed DataArray with dimensions ``('y', 'x')``.
+        """
+        if isinstance(chunks, dict):
+            chunks = (chunks.get('y', 'auto'), chunks.get('x', 'auto'))
+        elif chunks is None:
+            chunks = 'auto'
+        chunks = da.core.normalize_chunks(chunks, shape=shape,
+                                          dtype=self.dtype)
+
+        def _interp_block(block_info=None):
+            (r0, r1), (c0, c1) = block_info[None]['array-location']
+            return self.interp(np.arange(r0, r1), np.arange(c0, c1))
+
+        data = da.map_blocks(_interp_block, chunks=chunks, dtype=self.dtype)
+        return xr.DataArray(data, dims=('y', 'x'), name=name)
@@ -4,7 +4,7 @@ This module may be used to mosaic and tile multiple satellite image products.
 TODO: Contain buffer information in NetCDF metadata?
 
 """
-from ..io import open_netcdf, to_netcdf, add_time
+from ..io import open_netcdf, to_netcdf, add_time, open_many
 from .. import utils
 import os
 import glob
@@ -14,7 +14,7 @@ import xarray as xr
 from dask import delayed
 
 
-def tile(ds, path, prefix='part', chunks=None, buffer=0):
+def tile(ds, path, prefix='part', chunks=None, buffer=0, **kwargs):
     """Split dataset into tiles and write to disk. If `chunks` is not given,
     use chunks in dataset.
 
@@ -34,6 +34,9 @@ def tile(ds, path, prefix='part', chunks=None, buffer=0):
         The number of overlapping pixels to store around each tile
         (default: 0). Can be given as an integer or per dimension as
         dictionary.
+    **kwargs : dict
+        Extra keyword arguments passed on to :meth:`nd.io.to_netcdf`, e.g.
+        to select the compression of the tiles.
     """
 
     # Prepare output directory
@@ -95,7 +98,7 @@ def tile(ds, path, prefix='part', chunks=None, buffer=0):
         tile_path = os.path.join(path, tile_name)
         if not os.path.isfile(tile_path):
             temp_tile_path = tile_path + '.part'
-            to_netcdf(subset, temp_tile_path)
+            to_netcdf(subset, temp_tile_path, **kwargs)
             os.rename(temp_tile_path, tile_path)
 
     # 2. Then apply itertools to the slices.
@@ -224,9 +227,9 @@ def auto_merge(datasets, buffer='auto', chunks={}):
     # Treat `datasets` as a list of file paths
     if isinstance(datasets[0], str):
         # Pass chunks={} to ensure the dataset is read as a dask array
-        datasets = [add_time(xr.open_dataset(path, chunks=chunks,
-                                             engine='h5netcdf'))
-                    for path in datasets]
+        datasets = [add_time(ds) for ds in open_many(
+            datasets, opener=xr.open_dataset, chunks=chunks,
+            engine='h5netcdf')]
 
     if buffer == 'auto':
         buf_cache = {}
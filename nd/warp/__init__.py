@@ -3,11 +3,13 @@ This module contains all functionality related to reprojecting a
 dataset.
 """
 
-from .warp_ import Reprojection, Resample, Alignment, _parse_crs, get_crs, \
-                   get_transform, get_resolution, get_bounds, get_extent, \
-                   get_common_bounds, get_common_extent, get_common_resolution
+from .warp_ import Reprojection, WarpPlan, Resample, Alignment, _parse_crs, \
+                   get_crs, get_transform, get_resolution, get_bounds, \
+                   get_extent, get_common_bounds, get_common_extent, \
+                   get_common_resolution, get_gcps, get_geolocation
 
 __all__ = ['Reprojection',
+           'WarpPlan',
            'Resample',
            'Alignment',
            '_parse_crs',
@@ -18,4 +20,6 @@ __all__ = ['Reprojection',
            'get_extent',
            'get_common_bounds',
            'get_common_extent',
-           'get_common_resolution']
+           'get_common_resolution',
+           'get_gcps',
+           'get_geolocation']
@@ -1,9 +1,11 @@
 import pytest
-from nd.warp import (Reprojection, Resample, Alignment, get_bounds,
+from nd.warp import (Reprojection, WarpPlan, Resample, Alignment, get_bounds,
                      get_transform, get_crs, get_common_bounds,
                      get_common_extent, get_extent, get_resolution,
-                     get_common_resolution)
-from nd.warp.warp_ import _parse_crs, nrows, ncols, get_dims, _reproject
+                     get_common_resolution, get_gcps, get_geolocation)
+from nd.warp import warp_
+from nd.warp.warp_ import (_parse_crs, nrows, ncols, get_dims, _reproject,
+                           _add_latlon)
 from nd.io import open_dataset, to_netcdf
 from nd.testing import (generate_test_dataset, generate_test_dataarray,
                         assert_equal_crs)
@@ -14,6 +16,7 @@ from numpy.testing import (assert_equal, assert_almost_equal, assert_raises,
 from xarray.testing import assert_equal as xr_assert_equal
 from xarray.testing import assert_identical as xr_assert_identical
 import os
+import tracemalloc
 from rasterio.crs import CRS
 from rasterio.coords import BoundingBox
 from rasterio.errors import CRSError
@@ -298,6 +301,46 @@ def test_get_extent_dataarray():
     assert_equal(extent, get_extent(da))
 
 
+def _add_tie_point_grids(ds):
+    # Add linear latitude and longitude tie point grids to a dataset.
+    rows = np.linspace(0, nrows(ds) - 1, 4)
+    cols = np.linspace(0, ncols(ds) - 1, 5)
+    lat = 60 - 0.1 * rows[:, np.newaxis] + 0.01 * cols
+    lon = -10 + 0.2 * cols + 0.02 * rows[:, np.newaxis]
+    return ds.assign_coords(tp_y=rows, tp_x=cols,
+                            tp_latitude=(('tp_y', 'tp_x'), lat),
+                            tp_longitude=(('tp_y', 'tp_x'), lon))
+
+
+def test_get_extent_tie_point_grids():
+    ds = _add_tie_point_grids(generate_test_dataset())
+    del ds.attrs['crs']
+    extent = get_extent(ds)
+    assert_almost_equal(extent, (ds.tp_longitude.min(), ds.tp_latitude.min(),
+                                 ds.tp_longitude.max(), ds.tp_latitude.max()))
+
+
+def test_get_gcps():
+    ds = _add_tie_point_grids(generate_test_dataset())
+    gcps = get_gcps(ds)
+    assert len(gcps) == ds.tp_latitude.size
+    # rasterio locates the center of the first pixel at (0.5, 0.5).
+    assert (gcps[0].row, gcps[0].col) == (0.5, 0.5)
+    assert (gcps[0].x, gcps[0].y) == (-10, 60)
+
+
+def test_get_geolocation():
+    ds = _add_tie_point_grids(generate_test_dataset()).chunk({'y': 7})
+    lat, lon = get_geolocation(ds)
+    assert lat.dims == ('y', 'x')
+    assert lat.chunks[0] == ds.chunks['y']
+    rows = np.arange(nrows(ds))[:, np.newaxis]
+    cols = np.arange(ncols(ds))
+    assert_almost_equal(lat.values, 60 - 0.1 * rows + 0.01 * cols)
+    assert_almost_equal(lon.values, -10 + 0.2 * cols + 0.02 * rows)
+    xr_assert_equal(lat['x'], ds['x'])
+
+
 def test_get_common_bounds():
     bounds = [
         (-10.0, 50.0, 0.0, 60.0),
@@ -435,6 +478,102 @@ def test_reproject(generator):
         assert_equal_crs(get_crs(proj), dst_crs)
 
 
+def test_reproject_dataset_equals_dataarrays():
+    # Warping a dataset gives the same result as warping each variable alone.
+    ds = generate_test_dataset(crs=epsg4326, var=['a', 'b', 'c'])
+    ds['b'] = ds['b'].astype(np.float32)
+    ds['d'] = ds['a'].isel(time=0, drop=True)
+    projected = _reproject(ds, dst_crs=sinusoidal)
+    for v in ds.data_vars:
+        expected = _reproject(ds[[v]], dst_crs=sinusoidal)[v]
+        assert projected[v].dtype == ds[v].dtype
+        xr_assert_equal(projected[v].transpose(*expected.dims), expected)
+
+
+def test_reproject_warps_each_variable_once(monkeypatch):
+    ds = generate_test_dataset(crs=epsg4326, var=['a', 'b'])
+    ds = _reproject(ds, dst_crs=sinusoidal)
+    ds = ds.assign_coords(lat=ds['lat'].compute(), lon=ds['lon'].compute())
+    calls = []
+    reproject = rasterio.warp.reproject
+
+    def _count(source, *args, **kwargs):
+        calls.append(source.shape)
+        return reproject(source, *args, **kwargs)
+
+    monkeypatch.setattr(rasterio.warp, 'reproject', _count)
+    projected = _reproject(ds, dst_crs=epsg4326)
+    # One multi-band warp per variable, and the lat/lon coordinates are
+    # generated rather than warped.
+    assert calls == [(ds.dims['time'], nrows(ds), ncols(ds))] * 2
+    assert isinstance(projected['a'].data, np.ndarray)
+
+
+def test_reproject_memory():
+    ds = generate_test_dataset(ny=200, nx=200, ntime=10, var=['a', 'b', 'c'],
+                               crs=epsg4326)
+    ds = ds.transpose('time', 'y', 'x').astype(np.float32)
+    for v in ds.data_vars:
+        ds[v] = ds[v].copy(data=np.ascontiguousarray(ds[v].values))
+    tracemalloc.start()
+    try:
+        projected = _reproject(ds, dst_crs=epsg4326, latlon=False)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # The variables are not copied into a common stack: at most one
+    # variable-sized temporary exists besides the output.
+    assert peak < projected.nbytes + 1.5 * ds['a'].nbytes
+
+
+@pytest.mark.parametrize('latlon', [True, False])
+def test_latlon_option(latlon):
+    ds = generate_test_dataset(crs=epsg4326)
+    proj = Reprojection(crs=sinusoidal, latlon=latlon)
+    results = [proj.apply(ds),
+               proj.plan(ds).apply(ds, latlon=latlon),
+               Resample(width=15, latlon=latlon).apply(ds)]
+    for result in results:
+        assert ('lat' in result.coords) == latlon
+        assert ('lon' in result.coords) == latlon
+
+
+def test_add_latlon_geographic():
+    ds = generate_test_dataset(crs=epsg4326)
+    _add_latlon(ds)
+    assert ds['lat'].dims == ('y',)
+    assert ds['lon'].dims == ('x',)
+    assert_equal(ds['lat'].values, ds['y'].values)
+    assert_equal(ds['lon'].values, ds['x'].values)
+
+
+def test_add_latlon_projected():
+    ds = _reproject(generate_test_dataset(crs=epsg4326), dst_crs=sinusoidal,
+                    latlon=False)
+    assert 'lat' not in ds.coords
+    _add_latlon(ds)
+    assert ds['lat'].dims == ('y', 'x')
+    assert ds['lat'].chunks is not None
+    xgrid, ygrid = np.meshgrid(ds['x'], ds['y'])
+    lon, lat = rasterio.warp.transform(sinusoidal, epsg4326, xgrid.flatten(),
+                                       ygrid.flatten())
+    assert_almost_equal(ds['lat'].values.flatten(), lat)
+    assert_almost_equal(ds['lon'].values.flatten(), lon)
+    extent = get_extent(ds)
+    assert_almost_equal(extent, (min(lon), min(lat), max(lon), max(lat)))
+
+
+def test_add_latlon_chunks():
+    ds = _reproject(generate_test_dataset(crs=epsg4326), dst_crs=sinusoidal,
+                    latlon=False)
+    chunked = ds.chunk({'y': 7, 'x': 6})
+    _add_latlon(ds)
+    _add_latlon(chunked)
+    assert chunked['lat'].chunks == (chunked.chunks['y'], chunked.chunks['x'])
+    xr_assert_equal(chunked['lat'].compute(), ds['lat'].compute())
+    xr_assert_equal(chunked['lon'].compute(), ds['lon'].compute())
+
+
 def test_reprojection_nan_values():
     src_crs = epsg4326
     dst_crs = sinusoidal
@@ -481,6 +620,136 @@ def test_reproject_coordinates():
         assert_equal(ds[c].dims, warped[c].dims)
 
 
+def _smooth_dataset():
+    ds = generate_test_dataset(crs=epsg4326, nx=40, ny=30, ntime=2,
+                               var=['a', 'b'])
+    rows, cols = np.meshgrid(np.arange(30), np.arange(40), indexing='ij')
+    field = np.sin(rows / 5.) + np.cos(cols / 7.)
+    for v in ds.data_vars:
+        ds[v] = xr.DataArray(field, dims=('y', 'x')) * xr.ones_like(ds[v])
+    return ds
+
+
+@pytest.mark.parametrize('resampling', ['nearest', 'bilinear', 'cubic'])
+def test_warp_plan(resampling):
+    ds = _smooth_dataset()
+    proj = Reprojection(crs=sinusoidal,
+                        resampling=rasterio.warp.Resampling[resampling])
+    plan = proj.plan(ds)
+    expected = proj.apply(ds)
+    warped = plan.apply(ds)
+    xr_assert_equal(warped['x'], expected['x'])
+    xr_assert_equal(warped['y'], expected['y'])
+    assert_equal(warped.attrs, expected.attrs)
+    for v in ds.data_vars:
+        assert_equal(warped[v].dims, expected[v].dims)
+        a = warped[v].values
+        b = expected[v].values
+        assert (np.isnan(a) == np.isnan(b)).mean() > 0.98
+        both = ~np.isnan(a) & ~np.isnan(b)
+        assert np.abs(a - b)[both].mean() < 0.05
+
+
+@pytest.mark.parametrize('resampling', ['nearest', 'cubic'])
+def test_warp_plan_blocks(monkeypatch, resampling):
+    ds = _smooth_dataset()
+    plan = WarpPlan.from_dataset(ds, crs=sinusoidal, resampling=resampling)
+    expected = plan.apply(ds)
+    # Compute the kernel taps for a few pixels at a time.
+    monkeypatch.setattr(warp_, '_PLAN_BLOCK_PIXELS', 50)
+    xr_assert_identical(plan.apply(ds), expected)
+
+
+def test_warp_plan_memory():
+    ds = generate_test_dataset(ny=800, nx=800, ntime=1, var=['a'],
+                               crs=epsg4326)
+    plan = WarpPlan.from_dataset(ds, crs=sinusoidal, resampling='cubic')
+    stack = ds['a'].transpose('time', 'y', 'x').values.astype(np.float32)
+    output = np.full((1,) + plan.dst_shape, np.nan, dtype=np.float32)
+    tracemalloc.start()
+    try:
+        plan._warp(stack, output)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # The plan only stores the float32 source coordinates. The kernel taps
+    # and weights of cubic resampling (128 bytes per pixel) are computed
+    # for one block of pixels at a time.
+    assert plan.coords.dtype == np.float32
+    assert peak < 200 * warp_._PLAN_BLOCK_PIXELS
+    assert peak < 32 * plan.valid.sum()
+
+
+def test_warp_plan_dataarray():
+    ds = _smooth_dataset()
+    plan = WarpPlan.from_dataset(ds, crs=sinusoidal)
+    da = ds['a'].assign_attrs(ds.attrs)
+    xr_assert_equal(plan.apply(da), plan.apply(ds)['a'])
+
+
+def test_warp_plan_save_load(tmpdir):
+    ds = _smooth_dataset()
+    plan = WarpPlan.from_dataset(ds, crs=sinusoidal, resampling='bilinear')
+    path = str(tmpdir.join('plan.npz'))
+    plan.save(path)
+    loaded = WarpPlan.load(path)
+    assert loaded.resampling == plan.resampling
+    assert_equal_crs(loaded.dst_crs, plan.dst_crs)
+    xr_assert_identical(loaded.apply(ds), plan.apply(ds))
+
+
+def test_warp_plan_source_mismatch():
+    ds = _smooth_dataset()
+    plan = WarpPlan.from_dataset(ds, crs=sinusoidal)
+    with assert_raises_regex(ValueError, 'does not match the source grid'):
+        plan.apply(ds.isel(x=slice(1, None)))
+
+
+def test_warp_plan_invalid_resampling():
+    ds = _smooth_dataset()
+    with assert_raises_regex(ValueError, 'Unsupported resampling method'):
+        WarpPlan.from_dataset(ds, crs=sinusoidal, resampling='average')
+
+
+@pytest.mark.parametrize('resampling', ['nearest', 'cubic'])
+def test_reproject_lazy(resampling):
+    ds = _smooth_dataset()
+    kwargs = {'crs': sinusoidal,
+              'resampling': rasterio.warp.Resampling[resampling]}
+    expected = Reprojection(**kwargs).apply(ds)
+    warped = Reprojection(**kwargs).apply(ds.chunk({'time': 1}))
+    assert warped['a'].chunks is not None
+    warped = warped.compute()
+    for v in ds.data_vars:
+        a = warped[v].transpose(*expected[v].dims).values
+        b = expected[v].values
+        assert (np.isnan(a) == np.isnan(b)).mean() > 0.98
+        both = ~np.isnan(a) & ~np.isnan(b)
+        assert np.abs(a - b)[both].mean() < 0.05
+
+
+def test_reproject_chunks():
+    ds = _smooth_dataset()
+    resampled = Resample(width=25, chunks={'y': 8, 'x': 10}).apply(ds)
+    ychunks, xchunks = resampled['a'].transpose(..., 'y', 'x').chunks[-2:]
+    assert set(ychunks[:-1]) == {8} and set(xchunks[:-1]) == {10}
+    xr.testing.assert_allclose(resampled.compute(),
+                               Resample(width=25).apply(ds))
+
+
+def test_reproject_lazy_outside_source():
+    # Tiles that don't overlap the source are NaN.
+    ds = _smooth_dataset()
+    bounds = get_bounds(ds)
+    extent = (bounds.left, bounds.bottom, bounds.right + 2 * (
+        bounds.right - bounds.left), bounds.top)
+    warped = Reprojection(crs=epsg4326, extent=extent, width=120, height=30,
+                          chunks={'y': 30, 'x': 40}).apply(ds)
+    values = warped['a'].transpose('time', 'y', 'x').values
+    assert np.isnan(values[..., 90:]).all()
+    assert not np.isnan(values[..., 5:35]).any()
+
+
 @pytest.mark.parametrize('extent', [
     None, (-10.0, 50.0, 0.0, 60.0)
 ])
@@ -517,6 +786,64 @@ def test_alignment(tmpdir, extent, from_files):
         xr_assert_equal(ds['y'], aligned[0]['y'])
 
 
+def _write_alignment_inputs(tmpdir):
+    datapath = tmpdir.mkdir('data')
+    bounds = [
+        (-10.0, 50.0, 0.0, 60.0),
+        (-12.0, 40.0, -2.0, 52.0),
+        (-13.0, 50.0, -3.0, 60.0),
+    ]
+    files = []
+    for i, ext in enumerate(bounds):
+        f = str(datapath.join('data_%d.nc' % i))
+        to_netcdf(generate_test_dataset(extent=ext), f)
+        files.append(f)
+    return files
+
+
+def test_alignment_parallel(tmpdir):
+    files = _write_alignment_inputs(tmpdir)
+    serial = tmpdir.mkdir('serial')
+    parallel = tmpdir.mkdir('parallel')
+    Alignment().apply(files, path=str(serial))
+    Alignment(njobs=2).apply(files, path=str(parallel))
+    names = sorted(os.listdir(str(serial)))
+    assert names == sorted(os.listdir(str(parallel)))
+    assert len(names) == len(files)
+    for name in names:
+        xr_assert_identical(open_dataset(str(serial.join(name))),
+                            open_dataset(str(parallel.join(name))))
+
+
+def test_alignment_parallel_spawn(tmpdir, monkeypatch):
+    # Worker processes forked from a parent that has run dask's thread
+    # pool or GDAL may deadlock on inherited locks, so they are spawned.
+    contexts = []
+    executor = warp_.ProcessPoolExecutor
+
+    def _executor(*args, **kwargs):
+        contexts.append(kwargs.get('mp_context'))
+        return executor(*args, **kwargs)
+
+    monkeypatch.setattr(warp_, 'ProcessPoolExecutor', _executor)
+    files = _write_alignment_inputs(tmpdir)
+    path = tmpdir.mkdir('aligned')
+    Alignment(njobs=2).apply(files, path=str(path))
+    assert len(path.listdir()) == len(files)
+    assert [c.get_start_method() for c in contexts] == ['spawn']
+
+
+@pytest.mark.parametrize('overwrite', [False, True])
+def test_alignment_existing_outputs(tmpdir, overwrite):
+    files = _write_alignment_inputs(tmpdir)
+    path = tmpdir.mkdir('aligned')
+    existing = path.join('data_0_aligned.nc')
+    existing.write('existing')
+    Alignment(overwrite=overwrite).apply(files, path=str(path))
+    assert len(path.listdir()) == len(files)
+    assert (existing.read_binary() == b'existing') != overwrite
+
+
 # def test_align(tmpdir):
 #     path = tmpdir.mkdir('aligned')
 #     # [llcrnrlon, llcrnrlat, urcrnrlon, urcrnrlat]
@@ -1,14 +1,20 @@
 import glob
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import xarray as xr
 import rasterio.warp
+import dask
+import dask.array
 from rasterio.coords import BoundingBox
 from rasterio.crs import CRS
 from rasterio.errors import CRSError
+from rasterio.control import GroundControlPoint
 from affine import Affine
 from ..algorithm import Algorithm
-from ..io import to_netcdf, open_dataset
+from ..io import to_netcdf, open_dataset, open_many, TiePointGrid
+from ._warp import c_valid
 
 
 def _parse_crs(crs):
@@ -223,11 +229,23 @@ def get_extent(ds):
     # Check if latitude and longitude are stored as coordinates.
     #
     if 'lon' in ds.coords and 'lat' in ds.coords:
+        # The coordinates may be lazy (see _add_latlon).
         return BoundingBox(
-            left=ds.lon.values.min(),
-            bottom=ds.lat.values.min(),
-            right=ds.lon.values.max(),
-            top=ds.lat.values.max()
+            left=float(ds.lon.min()),
+            bottom=float(ds.lat.min()),
+            right=float(ds.lon.max()),
+            top=float(ds.lat.max())
+        )
+
+    #
+    # Or as tie point grids?
+    #
+    if 'tp_longitude' in ds.coords and 'tp_latitude' in ds.coords:
+        return BoundingBox(
+            left=ds.tp_longitude.values.min(),
+            bottom=ds.tp_latitude.values.min(),
+            right=ds.tp_longitude.values.max(),
+            top=ds.tp_latitude.values.max()
         )
 
     #
@@ -247,6 +265,74 @@ def get_extent(ds):
     return BoundingBox(*bounds)
 
 
+def get_gcps(ds):
+    """Extract ground control points from the latitude and longitude tie
+    point grids of a dataset.
+
+    The ground control points can be used to geocode the dataset, e.g. with
+    ``rasterio.warp.reproject(..., gcps=gcps, src_crs='epsg:4326')``.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The input dataset. Must contain the tie point grid coordinates
+        ``tp_latitude`` and ``tp_longitude`` (see
+        :meth:`nd.io.open_beam_dimap`).
+
+    Returns
+    -------
+    list of rasterio.control.GroundControlPoint
+        One ground control point per tie point.
+    """
+
+    lat = ds.coords['tp_latitude'].transpose('tp_y', 'tp_x').values
+    lon = ds.coords['tp_longitude'].transpose('tp_y', 'tp_x').values
+    rows = ds.coords['tp_y'].values
+    cols = ds.coords['tp_x'].values
+    # rasterio refers to the center of the first pixel as (0.5, 0.5).
+    return [GroundControlPoint(row=row + 0.5, col=col + 0.5,
+                               x=lon[i, j], y=lat[i, j])
+            for i, row in enumerate(rows)
+            for j, col in enumerate(cols)]
+
+
+def get_geolocation(ds, order=3, chunks=None):
+    """Interpolate the latitude and longitude of every pixel from the tie
+    point grids of a dataset.
+
+    The interpolation is lazy, so selecting a window of the result only
+    evaluates the pixels within that window.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The input dataset. Must contain the tie point grid coordinates
+        ``tp_latitude`` and ``tp_longitude`` (see
+        :meth:`nd.io.open_beam_dimap`).
+    order : int, optional
+        The order of the interpolating spline, 1 for bilinear and 3 for
+        bicubic interpolation (default: 3).
+    chunks : dict, optional
+        The chunk sizes along ``y`` and ``x``. By default, the chunks of the
+        dataset are used if it is dask-backed.
+
+    Returns
+    -------
+    tuple (xarray.DataArray, xarray.DataArray)
+        The latitude and longitude, with dimensions ``('y', 'x')``.
+    """
+
+    shape = (nrows(ds), ncols(ds))
+    if chunks is None and ds.chunks:
+        chunks = {d: ds.chunks[d] for d in ('y', 'x') if d in ds.chunks}
+    result = []
+    for name in ['latitude', 'longitude']:
+        tpg = TiePointGrid.from_dataset(ds, name, order=order)
+        arr = tpg.to_dataarray(shape, chunks=chunks, name=name[:3])
+        result.append(arr.assign_coords(y=ds['y'], x=ds['x']))
+    return tuple(result)
+
+
 def get_common_bounds(datasets):
     """Calculate the common bounding box of the input datasets.
 
@@ -261,16 +347,17 @@ def get_common_bounds(datasets):
         The common bounding box (left, bottom, right, top) in projected
         coordinates.
     """
-    bounds = []
-    common_crs = get_crs(datasets[0])
+    return _common_bounds([get_crs(ds) for ds in datasets],
+                          [get_bounds(ds) for ds in datasets])
 
-    for ds in datasets:
-        ds_bounds = get_bounds(ds)
-        crs = get_crs(ds)
-        proj_bounds = rasterio.warp.transform_bounds(
-            crs, common_crs, **ds_bounds._asdict()
-        )
-        bounds.append(proj_bounds)
+
+def _common_bounds(crs, bounds):
+    """Calculate the common bounding box from the CRS and bounds of several
+    datasets, in the CRS of the first dataset.
+    """
+    common_crs = crs[0]
+    bounds = [rasterio.warp.transform_bounds(c, common_crs, *b)
+              for c, b in zip(crs, bounds)]
 
     # Get largest extent:
     bounds = np.array(bounds)
@@ -326,14 +413,22 @@ def get_common_resolution(datasets, mode='min'):
         Returns the common resolution as (x, y).
     """
 
+    return _common_resolution([get_crs(ds) for ds in datasets],
+                              [get_resolution(ds) for ds in datasets],
+                              mode=mode)
+
+
+def _common_resolution(crs, resolutions, mode='min'):
+    """Determine the common resolution from the CRS and resolutions of
+    several datasets.
+    """
     if mode not in ['min', 'max', 'mean']:
         raise ValueError("Unsupported mode: '{}'".format(mode))
 
     # Raise an error if not all CRS are equal.
-    crs = [get_crs(ds) for ds in datasets]
     if not all(map(lambda c: c == crs[0], crs)):
         raise ValueError('All datasets must have the same projection.')
-    resolutions = np.array([get_resolution(ds) for ds in datasets])
+    resolutions = np.array(resolutions)
     if mode == 'min':
         return tuple(resolutions.min(axis=0))
     elif mode == 'max':
@@ -357,75 +452,128 @@ def ncols(ds):
     return get_dims(ds)['x']
 
 
-def _add_latlon(ds, n=50):
+def _latlon_block(ys, xs, crs, block_info=None):
+    """Compute the latitude and longitude of a block of pixels.
+
+    Parameters
+    ----------
+    ys, xs : numpy.ndarray
+        The y and x coordinates of the entire array.
+    crs : str
+        The CRS of the coordinates as WKT string.
+    block_info : dict
+        Provided by ``dask.array.map_blocks``.
+
+    Returns
+    -------
+    numpy.ndarray, shape (2, rows, cols)
+        The latitude and longitude of every pixel in the block.
+    """
+    (_, _), (r0, r1), (c0, c1) = block_info[None]['array-location']
+    xgrid, ygrid = np.meshgrid(xs[c0:c1], ys[r0:r1])
+    lon, lat = rasterio.warp.transform(crs, CRS(init='epsg:4326'),
+                                       xgrid.ravel(), ygrid.ravel())
+    return np.stack([np.reshape(lat, xgrid.shape),
+                     np.reshape(lon, xgrid.shape)])
+
+
+def _add_latlon(ds):
     """Add latitude and longitude coordinates to a dataset.
 
     This is required to allow e.g. SNAP to correctly determine the gecoding
     from the dataset when displaying the data.
 
+    If the CRS of the dataset is geographic, the coordinates are
+    one-dimensional copies of ``y`` and ``x``. Otherwise they are lazy,
+    two-dimensional dask arrays with the latitude and longitude of every
+    pixel. A block is only computed when it is accessed, e.g. when the
+    dataset is written to disk, and both coordinates share the same
+    transformation.
+
     Parameters
     ----------
     ds : xarray.Dataset or xarray.DataArray
         The input dataset.
-    n : int, optional
-        The number of points in each dimension (default: 10).
     """
 
+    src_crs = get_crs(ds)
+    if src_crs.is_geographic:
+        ds.coords['lat'] = ('y', ds['y'].values)
+        ds.coords['lon'] = ('x', ds['x'].values)
+        return
+
     nx = ncols(ds)
     ny = nrows(ds)
-    src_crs = get_crs(ds)
-    dst_crs = CRS(init='epsg:4326')
-    idx_x = np.linspace(0, nx - 1, n, dtype=int)
-    idx_y = np.linspace(0, ny - 1, n, dtype=int)
-    xs = ds.x[idx_x]
-    ys = ds.y[idx_y]
-    xgrid, ygrid = np.meshgrid(xs, ys)
-    lon, lat = rasterio.warp.transform(src_crs, dst_crs, xgrid.flatten(),
-                                       ygrid.flatten())
-    lon_sparse = np.empty((ny, nx))
-    lat_sparse = np.empty((ny, nx))
-    lon_sparse[:] = np.nan
-    lat_sparse[:] = np.nan
-    # idx_y needs to be a column vector
-    lon_sparse[idx_y[:, None], idx_x] = np.array(lon).reshape((n, n))
-    lat_sparse[idx_y[:, None], idx_x] = np.array(lat).reshape((n, n))
-    ds.coords['lat'] = (('y', 'x'), lat_sparse)
-    ds.coords['lon'] = (('y', 'x'), lon_sparse)
 
+    # Use the chunks of the data, if any.
+    if isinstance(ds, xr.DataArray):
+        data_chunks = dict(zip(ds.dims, ds.chunks or ()))
+    else:
+        data_chunks = dict(ds.chunks)
+    chunks = dask.array.core.normalize_chunks(
+        (2, data_chunks.get('y', 'auto'), data_chunks.get('x', 'auto')),
+        shape=(2, ny, nx), dtype=np.float64)
 
-def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
-               res=None, extent=None, **kwargs):
-    """Reproject a Dataset or DataArray.
+    latlon = dask.array.map_blocks(
+        _latlon_block, ds['y'].values, ds['x'].values, src_crs.wkt,
+        chunks=chunks, dtype=np.float64, meta=np.array((), np.float64))
+    ds.coords['lat'] = (('y', 'x'), latlon[0])
+    ds.coords['lon'] = (('y', 'x'), latlon[1])
+
+
+# The radius of the resampling kernels in source pixels, before GDAL widens
+# them for downsampling.
+_KERNEL_RADIUS = {
+    rasterio.warp.Resampling.nearest: 1,
+    rasterio.warp.Resampling.bilinear: 1,
+    rasterio.warp.Resampling.cubic: 2,
+    rasterio.warp.Resampling.cubic_spline: 2,
+    rasterio.warp.Resampling.lanczos: 3,
+}
+
+
+def _warp_tile(window, shape, dtype, **kwargs):
+    """Warp a window of source pixels into one output tile.
 
     Parameters
     ----------
-    ds : xarray.Dataset or xarray.DataArray
-        The input dataset
-    dst_crs : CRS-like, optional
-        An object that can be parsed into a CRS. By default, use the same
-        CRS as the input dataset.
-    dst_transform : affine.Affine, optional
-        The geometric transform of the output dataset.
-    width : int, optional
-        The width of the output dataset.
-    height : int, optional
-        The height of the output dataset.
-    res : tuple (float, float), optional
-        The resolution of the output dataset.
-    extent : tuple, optional
-        The output extent. By default this is determined from the input data.
-    **kwargs : dict, optional
-        Extra keyword arguments for ``rasterio.warp.reproject``.
+    window : numpy.ndarray
+        The source window, with dimensions (..., y, x).
+    shape : tuple (int, int, int)
+        The shape of the output tile (nbands, rows, cols).
+    dtype : numpy.dtype
+        The data type of the output tile.
+    **kwargs : dict
+        Keyword arguments for ``rasterio.warp.reproject``.
 
     Returns
     -------
-    xarray.Dataset or xarray.DataArray
-        The projected dataset.
+    numpy.ndarray
+        The output tile.
     """
+    window = np.asarray(window, dtype=dtype)
+    output = np.full(shape, np.nan, dtype=dtype)
+    rasterio.warp.reproject(window.reshape((-1,) + window.shape[-2:]),
+                            output, dst_nodata=np.nan, **kwargs)
+    return output
 
-    if 'resampling' not in kwargs:
-        kwargs['resampling'] = rasterio.warp.Resampling.cubic
 
+def _dst_grid(ds, dst_crs=None, dst_transform=None, width=None, height=None,
+              res=None, extent=None):
+    """Determine the output grid of a reprojection.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset or xarray.DataArray
+        The input dataset
+    dst_crs, dst_transform, width, height, res, extent : optional
+        See :meth:`_reproject`.
+
+    Returns
+    -------
+    tuple (rasterio.crs.CRS, affine.Affine, int, int)
+        The CRS, transform, width and height of the output dataset.
+    """
     src_crs = get_crs(ds)
     src_bounds = get_bounds(ds)
     if extent is not None:
@@ -494,9 +642,68 @@ def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
                 dst_height=height,
                 **src_bounds._asdict())
 
+    return _parse_crs(dst_crs), dst_transform, width, height
+
+
+def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
+               res=None, extent=None, plan=None, chunks=None, latlon=True,
+               **kwargs):
+    """Reproject a Dataset or DataArray.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset or xarray.DataArray
+        The input dataset
+    dst_crs : CRS-like, optional
+        An object that can be parsed into a CRS. By default, use the same
+        CRS as the input dataset.
+    dst_transform : affine.Affine, optional
+        The geometric transform of the output dataset.
+    width : int, optional
+        The width of the output dataset.
+    height : int, optional
+        The height of the output dataset.
+    res : tuple (float, float), optional
+        The resolution of the output dataset.
+    extent : tuple, optional
+        The output extent. By default this is determined from the input data.
+    plan : WarpPlan, optional
+        Use the precomputed source pixel coordinates of a :class:`WarpPlan`
+        instead of GDAL to reproject the arrays defined over ``y`` and
+        ``x``. The output grid is then taken from the plan.
+    chunks : dict, optional
+        The size of the output tiles along ``y`` and ``x``, e.g.
+        ``{'y': 1024, 'x': 1024}``. If given, or if the input is backed by
+        dask arrays, the output is computed lazily: each tile is warped in a
+        separate dask task from the window of source pixels it depends on.
+        By default, the tiles have about the size of a dask chunk.
+    latlon : bool, optional
+        If True (default), add ``lat`` and ``lon`` coordinates to the result
+        (see :meth:`_add_latlon`). They are computed lazily.
+    **kwargs : dict, optional
+        Extra keyword arguments for ``rasterio.warp.reproject``.
+
+    Returns
+    -------
+    xarray.Dataset or xarray.DataArray
+        The projected dataset.
+    """
+
+    if 'resampling' not in kwargs:
+        kwargs['resampling'] = rasterio.warp.Resampling.cubic
+
+    src_crs = get_crs(ds)
+    if plan is not None:
+        plan._check_source(ds)
+        dst_crs, dst_transform = plan.dst_crs, plan.dst_transform
+        height, width = plan.dst_shape
+    else:
+        dst_crs, dst_transform, width, height = _dst_grid(
+            ds, dst_crs=dst_crs, dst_transform=dst_transform, width=width,
+            height=height, res=res, extent=extent)
+
     src_transform = get_transform(ds)
     src_dims = get_dims(ds)
-    dst_crs = _parse_crs(dst_crs)
 
     #
     # Prepare new x and y coordinate arrays
@@ -523,29 +730,25 @@ def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
 
     def _reproject_da(da, shape):
         #
-        # Reproject a single data array
+        # Reproject a single one-dimensional coordinate array
         #
-        extra_dims = set(da.dims) - {'y', 'x'}
-        dim_order = tuple(extra_dims) + ('y', 'x')
-        values = da.transpose(*dim_order).values
+        values = da.values
         output = np.zeros(shape, dtype=da.dtype)
         output[:] = np.nan
 
-        # Fix data shape for one-dimensional data
-        if da.ndim == 1:
-            #
-            # NOTE: The stretch factor is necessary because the input data
-            # must extend at least half an original resolution cell in the
-            # independent dimension.
-            #
-            if da.dims == ('x',):
-                stretch_x = int((~src_transform * dst_transform).a / 2 + 1)
-                values = np.vstack([values] * stretch_x)
-                output.shape = (1,) + output.shape
-            elif da.dims == ('y',):
-                stretch_y = int((~src_transform * dst_transform).e / 2 + 1)
-                values = np.vstack([values] * stretch_y).T
-                output.shape = output.shape + (1,)
+        #
+        # NOTE: The stretch factor is necessary because the input data
+        # must extend at least half an original resolution cell in the
+        # independent dimension.
+        #
+        if da.dims == ('x',):
+            stretch_x = int((~src_transform * dst_transform).a / 2 + 1)
+            values = np.vstack([values] * stretch_x)
+            output.shape = (1,) + output.shape
+        elif da.dims == ('y',):
+            stretch_y = int((~src_transform * dst_transform).e / 2 + 1)
+            values = np.vstack([values] * stretch_y).T
+            output.shape = output.shape + (1,)
 
         rasterio.warp.reproject(
             values,
@@ -561,13 +764,134 @@ def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
         # Final reshape in case the input was one-dimensional
         return output.reshape(shape)
 
+    def _reproject_arrays(arrays, lazy):
+        #
+        # Reproject a list of data arrays that are defined over ('y', 'x')
+        # and possibly further dimensions. Each array is warped directly as
+        # a multi-band array, so that GDAL sets up the coordinate
+        # transformation once per array rather than once per band. In the
+        # lazy case, the output tiles and their source windows are
+        # determined once and shared by all arrays.
+        #
+        arrays = [arr.transpose(..., 'y', 'x') for arr in arrays]
+        if lazy and len(arrays) > 0:
+            windows = _src_windows(_dst_tiles(max(
+                int(np.prod(arr.shape[:-2])) for arr in arrays)))
+
+        results = []
+        for arr in arrays:
+            if lazy:
+                output = _reproject_lazy(arr.data, windows)
+            else:
+                output = _reproject_eager(arr.values)
+            results.append((arr.dims, output.reshape(
+                arr.shape[:-2] + (height, width))))
+        return results
+
+    def _reproject_eager(values):
+        source = values.reshape((-1,) + values.shape[-2:])
+        output = np.full((source.shape[0], height, width), np.nan,
+                         dtype=values.dtype)
+        if plan is not None:
+            plan._warp(source, output)
+        else:
+            rasterio.warp.reproject(
+                source, output, src_transform=src_transform,
+                src_crs=src_crs, dst_transform=dst_transform,
+                dst_crs=dst_crs, dst_nodata=np.nan, **kwargs)
+        return output
+
+    def _dst_tiles(nbands):
+        #
+        # Split the output grid into tiles. By default, a tile of all bands
+        # has about the size of a dask chunk.
+        #
+        if isinstance(chunks, dict):
+            tile_chunks = (chunks.get('y', 'auto'), chunks.get('x', 'auto'))
+        elif chunks is None:
+            tile_chunks = ('auto', 'auto')
+        else:
+            tile_chunks = tuple(chunks)
+        _, ychunks, xchunks = dask.array.core.normalize_chunks(
+            (nbands,) + tile_chunks, shape=(nbands, height, width),
+            dtype=np.float64)
+        return ychunks, xchunks
+
+    def _src_window(r0, r1, c0, c1):
+        #
+        # The window of source pixels that an output tile depends on: the
+        # bounds of the tile in the source grid, extended by the footprint of
+        # the resampling kernel. GDAL widens the kernel when downsampling.
+        #
+        bounds = rasterio.transform.array_bounds(
+            r1 - r0, c1 - c0, dst_transform * Affine.translation(c0, r0))
+        if dst_crs != src_crs:
+            bounds = rasterio.warp.transform_bounds(
+                dst_crs, src_crs, *bounds, densify_pts=21)
+        if not np.all(np.isfinite(bounds)):
+            return 0, nrows(ds), 0, ncols(ds)
+        cols, rows = ~src_transform * (np.array(bounds)[[0, 2, 0, 2]],
+                                       np.array(bounds)[[1, 1, 3, 3]])
+        scale = max(1, (rows.max() - rows.min()) / (r1 - r0),
+                    (cols.max() - cols.min()) / (c1 - c0))
+        margin = int(np.ceil(_KERNEL_RADIUS.get(
+            rasterio.warp.Resampling(kwargs['resampling']), 1) * scale)) + 1
+        return (max(0, int(np.floor(rows.min())) - margin),
+                min(nrows(ds), int(np.ceil(rows.max())) + margin),
+                max(0, int(np.floor(cols.min())) - margin),
+                min(ncols(ds), int(np.ceil(cols.max())) + margin))
+
+    def _src_windows(tiles):
+        #
+        # Pair each output tile with the window of source pixels it depends
+        # on. Tiles that do not overlap the source get an empty window.
+        #
+        ychunks, xchunks = tiles
+        windows = []
+        for r0, r1 in zip(np.cumsum((0,) + ychunks[:-1]), np.cumsum(ychunks)):
+            row = []
+            for c0, c1 in zip(np.cumsum((0,) + xchunks[:-1]),
+                              np.cumsum(xchunks)):
+                row.append(((r0, r1, c0, c1), _src_window(r0, r1, c0, c1)))
+            windows.append(row)
+        return windows
+
+    def _reproject_lazy(source, windows):
+        #
+        # Warp each output tile from its own source window in a separate
+        # dask task.
+        #
+        nbands = int(np.prod(source.shape[:-2]))
+        dtype = source.dtype
+        blocks = []
+        for windows_row in windows:
+            row = []
+            for (r0, r1, c0, c1), (rs0, rs1, cs0, cs1) in windows_row:
+                shape = (nbands, r1 - r0, c1 - c0)
+                if rs1 <= rs0 or cs1 <= cs0:
+                    # The tile does not overlap the source.
+                    row.append(dask.array.full(shape, np.nan, dtype=dtype))
+                    continue
+                tile = dask.delayed(_warp_tile, pure=False)(
+                    source[..., rs0:rs1, cs0:cs1], shape, dtype,
+                    src_transform=src_transform * Affine.translation(
+                        cs0, rs0),
+                    src_crs=src_crs,
+                    dst_transform=dst_transform * Affine.translation(c0, r0),
+                    dst_crs=dst_crs, **kwargs)
+                row.append(dask.array.from_delayed(tile, shape, dtype=dtype))
+            blocks.append(row)
+        return dask.array.block(blocks)
+
     if isinstance(ds, xr.Dataset):
         result = xr.Dataset(coords=dst_coords)
 
         #
-        # Also reproject coordinate arrays that are defined over
-        # x and y
+        # Collect the coordinate arrays and data variables that are defined
+        # over x and y. The lat and lon coordinates are not reprojected, as
+        # they are generated anew for the output grid.
         #
+        coord_names = []
         for v in ds.coords:
             #
             # If the projection is the same, also reproject coordinate arrays
@@ -581,22 +905,35 @@ def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
                     result.coords[v] = \
                         (('y',), _reproject_da(ds.coords[v], (height,)))
 
-            if not set(ds.coords[v].dims).issuperset({'x', 'y'}):
+            if v in ('lat', 'lon') or \
+                    not set(ds.coords[v].dims).issuperset({'x', 'y'}):
                 continue
 
-            shape = (height, width)
-            result.coords[v] = (('y', 'x'),
-                                _reproject_da(ds.coords[v], shape))
+            coord_names.append(v)
+
+        var_names = [v for v in ds.data_vars
+                     if set(ds[v].dims) in (set(dst_dims), {'y', 'x'})]
+
+        #
+        # Whether the output is computed lazily depends only on the data
+        # variables, not on (possibly lazy) coordinates.
+        #
+        lazy = plan is None and (chunks is not None or any(
+            ds[v].chunks is not None for v in var_names))
+        names = coord_names + var_names
+        reprojected = dict(zip(names, _reproject_arrays(
+            [ds[v] for v in names], lazy)))
+
+        for v in ds.coords:
+            if v in reprojected:
+                result.coords[v] = reprojected[v]
 
         #
         # Reproject the actual data
         #
         for v in ds.data_vars:
-            if set(ds[v].dims) == set(dst_dims):
-                result[v] = (dst_dims, _reproject_da(ds[v], dst_shape))
-            elif set(ds[v].dims) == {'y', 'x'}:
-                shape = (height, width)
-                result[v] = (dst_dims, _reproject_da(ds[v], shape))
+            if v in reprojected:
+                result[v] = reprojected[v]
             else:
                 result[v] = (ds[v].dims, ds[v])
 
@@ -610,8 +947,10 @@ def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
         #     result.coords['lat'] = (('y',), lat)
 
     elif isinstance(ds, xr.DataArray):
-        result = xr.DataArray(_reproject_da(ds, dst_shape), dims=dst_dims,
-                              coords=dst_coords, name=ds.name)
+        lazy = plan is None and (chunks is not None or ds.chunks is not None)
+        dims, values = _reproject_arrays([ds], lazy)[0]
+        result = xr.DataArray(values, dims=dims, coords=dst_coords,
+                              name=ds.name).transpose(*dst_dims)
 
     result.attrs = ds.attrs
 
@@ -624,7 +963,8 @@ def _reproject(ds, dst_crs=None, dst_transform=None, width=None, height=None,
     result.attrs['lines'] = nrows(result)
     result.attrs['samples'] = ncols(result)
 
-    _add_latlon(result)
+    if latlon:
+        _add_latlon(result)
 
     return result
 
@@ -639,12 +979,30 @@ class Reprojection(Algorithm):
         The output coordinate reference system as dictionary or proj-string
     extent : tuple, optional
         The output extent. By default this is determined from the input data.
+    chunks : dict, optional
+        The size of the output tiles along ``y`` and ``x``. If given, or if
+        the dataset is backed by dask arrays, the projection is computed
+        lazily, tile by tile, and each tile only reads the source pixels it
+        depends on.
+    latlon : bool, optional
+        If True (default), add ``lat`` and ``lon`` coordinates to the
+        result. Unless the output CRS is geographic, they are lazy
+        two-dimensional arrays that are only computed when accessed.
     **kwargs : dict, optional
         Extra keyword arguments for ``rasterio.warp.reproject``.
+
+    Notes
+    -----
+    :meth:`apply` warps each variable with one GDAL call, with all of its
+    bands at once, so GDAL sets up the coordinate transformation once per
+    variable. To share a single coordinate mapping between all variables
+    and datasets on the same grid, create a :class:`WarpPlan` with
+    :meth:`plan`. Computing the plan transforms every output pixel exactly,
+    which only pays off for many bands in total.
     """
 
     def __init__(self, crs, extent=None, res=None, width=None, height=None,
-                 transform=None, **kwargs):
+                 transform=None, latlon=True, **kwargs):
         if transform is not None and (width is None or height is None):
             raise ValueError('If `transform` is given, you must also specify '
                              'the `width` and `height` arguments.')
@@ -660,6 +1018,7 @@ class Reprojection(Algorithm):
         self.width = width
         self.height = height
         self.transform = transform
+        self.latlon = latlon
         self.kwargs = kwargs
 
     def apply(self, ds):
@@ -678,7 +1037,310 @@ class Reprojection(Algorithm):
 
         return _reproject(ds, dst_crs=self.crs, dst_transform=self.transform,
                           width=self.width, height=self.height, res=self.res,
-                          extent=self.extent, **self.kwargs)
+                          extent=self.extent, latlon=self.latlon,
+                          **self.kwargs)
+
+    def plan(self, ds):
+        """Precompute the projection for datasets on the grid of `ds`.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or xarray.DataArray
+            A dataset on the source grid.
+
+        Returns
+        -------
+        WarpPlan
+            A plan that projects datasets on the same grid as `ds`. Only
+            the ``resampling`` keyword argument is taken into account.
+        """
+
+        return WarpPlan.from_dataset(
+            ds, crs=self.crs, extent=self.extent, res=self.res,
+            width=self.width, height=self.height, transform=self.transform,
+            resampling=self.kwargs.get('resampling',
+                                       rasterio.warp.Resampling.cubic))
+
+
+# The number of output pixels for which WarpPlan computes the kernel taps at
+# once.
+_PLAN_BLOCK_PIXELS = 2**16
+
+# The number of taps along each axis of the resampling kernels supported by
+# WarpPlan.
+_PLAN_TAPS = {
+    rasterio.warp.Resampling.nearest: 1,
+    rasterio.warp.Resampling.bilinear: 2,
+    rasterio.warp.Resampling.cubic: 4,
+}
+
+
+def _kernel_taps(coords, size, ntaps):
+    """Return the source indices and weights of a separable resampling
+    kernel along one axis.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray, shape (n,)
+        The source coordinates, in units of pixels with respect to the pixel
+        centres.
+    size : int
+        The size of the source image along the axis. Taps beyond the edge
+        are clamped to the edge.
+    ntaps : int
+        The number of taps: 1 (nearest), 2 (bilinear) or 4 (cubic
+        convolution).
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray or None)
+        The indices and weights, both with shape (ntaps, n). The weights are
+        None for nearest neighbour resampling.
+    """
+    if ntaps == 1:
+        base = np.floor(coords + 0.5).astype(np.intp)
+        return np.clip(base, 0, size - 1)[None], None
+
+    base = np.floor(coords)
+    t = coords - base
+    if ntaps == 2:
+        weights = np.stack([1 - t, t])
+    else:
+        # Cubic convolution (Keys, 1981) with a = -0.5, as in GDAL
+        weights = np.stack([
+            ((-0.5 * t + 1.0) * t - 0.5) * t,
+            (1.5 * t - 2.5) * t * t + 1.0,
+            ((-1.5 * t + 2.0) * t + 0.5) * t,
+            (0.5 * t - 0.5) * t * t,
+        ])
+    offsets = np.arange(ntaps) - (ntaps // 2 - 1)
+    indices = base.astype(np.intp)[None] + offsets[:, None]
+    return np.clip(indices, 0, size - 1), weights
+
+
+class WarpPlan(Algorithm):
+    """A projection onto a fixed output grid, with the source pixel
+    coordinates of every output pixel precomputed.
+
+    Creating the plan evaluates the coordinate transformation once for each
+    output pixel. Applying it to a dataset on the same source grid only
+    interpolates the data at the cached coordinates, so repeated projections,
+    e.g. of many scenes from the same orbit track, skip the coordinate
+    transformation entirely. Plans can be stored with :meth:`save` and
+    restored with :meth:`load`.
+
+    The resampling kernels are applied in numpy rather than GDAL. Unlike
+    GDAL, the plan transforms every pixel exactly rather than approximately,
+    and it does not widen the kernels when downsampling, so the results
+    differ slightly from those of :class:`Reprojection`.
+
+    Parameters
+    ----------
+    src_crs : CRS-like
+        The coordinate reference system of the source grid.
+    src_transform : affine.Affine
+        The geometric transform of the source grid.
+    src_shape : tuple (int, int)
+        The number of rows and columns of the source grid.
+    dst_crs : CRS-like
+        The coordinate reference system of the output grid.
+    dst_transform : affine.Affine
+        The geometric transform of the output grid.
+    dst_shape : tuple (int, int)
+        The number of rows and columns of the output grid.
+    resampling : rasterio.warp.Resampling or str, optional
+        The resampling method, one of ``nearest``, ``bilinear`` or ``cubic``
+        (default: ``cubic``).
+    """
+
+    def __init__(self, src_crs, src_transform, src_shape, dst_crs,
+                 dst_transform, dst_shape, resampling='cubic'):
+        self._set_grids(src_crs, src_transform, src_shape, dst_crs,
+                        dst_transform, dst_shape, resampling)
+        self.valid, self.coords = self._source_coords()
+
+    @classmethod
+    def from_dataset(cls, ds, crs=None, extent=None, res=None, width=None,
+                     height=None, transform=None, resampling='cubic'):
+        """Create a plan for datasets on the grid of `ds`.
+
+        The output grid is determined in the same way as for
+        :class:`Reprojection`.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or xarray.DataArray
+            A dataset on the source grid.
+        crs : dict or str, optional
+            The output coordinate reference system. By default, use the CRS
+            of `ds`.
+        extent, res, width, height, transform : optional
+            The output grid, see :class:`Reprojection`.
+        resampling : rasterio.warp.Resampling or str, optional
+            The resampling method (default: ``cubic``).
+
+        Returns
+        -------
+        WarpPlan
+            The plan.
+        """
+        dst_crs, dst_transform, width, height = _dst_grid(
+            ds, dst_crs=crs, dst_transform=transform, width=width,
+            height=height, res=res, extent=extent)
+        return cls(get_crs(ds), get_transform(ds), (nrows(ds), ncols(ds)),
+                   dst_crs, dst_transform, (height, width),
+                   resampling=resampling)
+
+    def _set_grids(self, src_crs, src_transform, src_shape, dst_crs,
+                   dst_transform, dst_shape, resampling):
+        if isinstance(resampling, str):
+            resampling = rasterio.warp.Resampling[resampling]
+        if resampling not in _PLAN_TAPS:
+            raise ValueError("Unsupported resampling method: '{}'".format(
+                resampling.name))
+        self.src_crs = _parse_crs(src_crs)
+        self.src_transform = Affine(*src_transform[:6])
+        self.src_shape = tuple(int(n) for n in src_shape)
+        self.dst_crs = _parse_crs(dst_crs)
+        self.dst_transform = Affine(*dst_transform[:6])
+        self.dst_shape = tuple(int(n) for n in dst_shape)
+        self.resampling = resampling
+
+    def _source_coords(self):
+        #
+        # Transform the centre of every output pixel into the source grid,
+        # a few rows at a time to limit the memory footprint.
+        #
+        height, width = self.dst_shape
+        coords = np.empty((2, height, width), dtype=np.float32)
+        step = max(1, 2**20 // width)
+        for r0 in range(0, height, step):
+            r1 = min(r0 + step, height)
+            cols, rows = np.meshgrid(np.arange(width) + 0.5,
+                                     np.arange(r0, r1) + 0.5)
+            xs, ys = self.dst_transform * (cols.ravel(), rows.ravel())
+            if self.dst_crs != self.src_crs:
+                xs, ys = rasterio.warp.transform(
+                    self.dst_crs, self.src_crs, xs, ys)
+            src_cols, src_rows = ~self.src_transform * (np.asarray(xs),
+                                                        np.asarray(ys))
+            coords[0, r0:r1] = src_rows.reshape((r1 - r0, width))
+            coords[1, r0:r1] = src_cols.reshape((r1 - r0, width))
+        # Points that cannot be transformed are invalid
+        coords[~np.isfinite(coords)] = -1
+
+        # The source pixels span [0, n] in these coordinates.
+        out_of_range, valid_coords = c_valid(coords, self.src_shape)
+        del coords
+        # Make the coordinates relative to the pixel centres.
+        valid_coords = np.ascontiguousarray(valid_coords) - 0.5
+        return ~out_of_range, valid_coords
+
+    def _warp(self, stack, output):
+        #
+        # Interpolate a stack of bands with shape (nbands, rows, cols) into
+        # the output array with shape (nbands, height, width).
+        #
+        if stack.shape[1:] != self.src_shape or \
+                output.shape[1:] != self.dst_shape:
+            raise ValueError('The arrays do not match the grids of the plan.')
+        src = np.ascontiguousarray(stack).reshape((stack.shape[0], -1))
+        ntaps = _PLAN_TAPS[self.resampling]
+        wdtype = np.result_type(np.empty(0, dtype=src.dtype).real.dtype,
+                                np.float32)
+        # The kernel taps and weights are computed for a few output rows at
+        # a time, so that only the source coordinates are kept in memory.
+        step = max(1, _PLAN_BLOCK_PIXELS // self.dst_shape[1])
+        start = 0
+        for r0 in range(0, self.dst_shape[0], step):
+            valid = self.valid[r0:r0 + step]
+            stop = start + np.count_nonzero(valid)
+            rows, wy = _kernel_taps(self.coords[0, start:stop],
+                                    self.src_shape[0], ntaps)
+            cols, wx = _kernel_taps(self.coords[1, start:stop],
+                                    self.src_shape[1], ntaps)
+            rows *= self.src_shape[1]
+            values = None
+            for i in range(ntaps):
+                for j in range(ntaps):
+                    taps = np.take(src, rows[i] + cols[j], axis=1)
+                    if wy is not None:
+                        taps = taps * (wy[i] * wx[j]).astype(wdtype)
+                    if values is None:
+                        values = taps
+                    else:
+                        values += taps
+            output[:, r0:r0 + step][:, valid] = values
+            start = stop
+
+    def _check_source(self, ds):
+        if get_crs(ds) != self.src_crs or \
+                (nrows(ds), ncols(ds)) != self.src_shape or \
+                not get_transform(ds).almost_equals(self.src_transform):
+            raise ValueError('The dataset does not match the source grid of '
+                             'the warp plan.')
+
+    def apply(self, ds, latlon=True):
+        """Apply the plan to a dataset.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or xarray.DataArray
+            The input dataset. It must be on the source grid of the plan.
+        latlon : bool, optional
+            If True (default), add ``lat`` and ``lon`` coordinates to the
+            result (see :class:`Reprojection`).
+
+        Returns
+        -------
+        xarray.Dataset or xarray.DataArray
+            The projected dataset.
+        """
+
+        return _reproject(ds, plan=self, latlon=latlon,
+                          resampling=self.resampling)
+
+    def save(self, path):
+        """Store the plan on disk.
+
+        Parameters
+        ----------
+        path : str
+            The file path. The file is written in numpy's ``.npz`` format, and
+            the extension ``.npz`` is appended if missing.
+        """
+        np.savez(path, valid=self.valid, coords=self.coords,
+                 src_crs=self.src_crs.wkt,
+                 src_transform=self.src_transform[:6],
+                 src_shape=self.src_shape,
+                 dst_crs=self.dst_crs.wkt,
+                 dst_transform=self.dst_transform[:6],
+                 dst_shape=self.dst_shape,
+                 resampling=self.resampling.name)
+
+    @classmethod
+    def load(cls, path):
+        """Load a plan that was stored with :meth:`save`.
+
+        Parameters
+        ----------
+        path : str
+            The file path.
+
+        Returns
+        -------
+        WarpPlan
+            The plan.
+        """
+        plan = cls.__new__(cls)
+        with np.load(path, allow_pickle=False) as f:
+            plan._set_grids(str(f['src_crs']), tuple(f['src_transform']),
+                            tuple(f['src_shape']), str(f['dst_crs']),
+                            tuple(f['dst_transform']), tuple(f['dst_shape']),
+                            str(f['resampling']))
+            plan.valid = f['valid']
+            plan.coords = f['coords']
+        return plan
 
 
 class Resample(Algorithm):
@@ -694,14 +1356,23 @@ class Resample(Algorithm):
     height : int, optional
         The desired output height. Ignored if the resolution is specified.
         If only the width is given, the height is calculated automatically.
+    chunks : dict, optional
+        The size of the output tiles along ``y`` and ``x``. If given, or if
+        the dataset is backed by dask arrays, the result is computed lazily
+        (see :class:`Reprojection`).
+    latlon : bool, optional
+        If True (default), add ``lat`` and ``lon`` coordinates to the
+        result (see :class:`Reprojection`).
     **kwargs : dict, optional
         Extra keyword arguments for ``rasterio.warp.reproject``.
     """
 
-    def __init__(self, res=None, width=None, height=None, **kwargs):
+    def __init__(self, res=None, width=None, height=None, latlon=True,
+                 **kwargs):
         self.res = res
         self.width = width
         self.height = height
+        self.latlon = latlon
         self.kwargs = kwargs
 
     def apply(self, ds):
@@ -719,12 +1390,58 @@ class Resample(Algorithm):
         """
 
         return _reproject(ds, width=self.width, height=self.height,
-                          res=self.res, **self.kwargs)
+                          res=self.res, latlon=self.latlon, **self.kwargs)
+
+
+def _read_grid(product):
+    """Read the CRS, bounds and resolution of a product.
+
+    Only the metadata and coordinates are read, not the pixels.
+
+    Parameters
+    ----------
+    product : str or xarray.Dataset
+        The file path or the dataset.
+
+    Returns
+    -------
+    tuple (rasterio.crs.CRS, rasterio.coords.BoundingBox, tuple)
+        The CRS, bounds and resolution.
+    """
+    if not isinstance(product, str):
+        return get_crs(product), get_bounds(product), get_resolution(product)
+    ds = open_dataset(product)
+    try:
+        return get_crs(ds), get_bounds(ds), get_resolution(ds)
+    finally:
+        ds.close()
+
+
+def _align_product(product, outfile, proj, scheduler=None):
+    """Reproject a single product and write it to `outfile`.
+
+    The output is first written to a temporary file and then renamed, so
+    that an interrupted run never leaves a partial output behind.
+    """
+    ds = open_dataset(product) if isinstance(product, str) else product
+    partfile = outfile + '.part'
+    try:
+        with dask.config.set(scheduler=scheduler):
+            to_netcdf(proj.apply(ds), partfile)
+    finally:
+        if isinstance(product, str):
+            ds.close()
+    os.replace(partfile, outfile)
+    return outfile
 
 
 class Alignment(Algorithm):
     """Align a list of datasets to the same coordinate grid.
 
+    The common grid is determined from the georeferencing of the datasets
+    only, without reading any pixels. The datasets are then reprojected
+    and written one by one, or concurrently on a pool of processes.
+
     Parameters
     ----------
     target : xarray.Dataset, optional
@@ -735,12 +1452,26 @@ class Alignment(Algorithm):
     extent : tuple, optional
         The bounding box of the output dataset. By default, use the common
         extent of all datasets.
+    chunks : dict, optional
+        If given, e.g. ``{'y': 1024, 'x': 1024}``, the datasets are
+        reprojected lazily in tiles of this size and written to disk tile by
+        tile, which bounds the memory usage (see :class:`Reprojection`).
+    njobs : int, optional
+        The number of worker processes (default: 1). Each process aligns
+        one dataset at a time.
+    overwrite : bool, optional
+        If False (default), skip datasets whose output file already exists,
+        so that an interrupted alignment can be resumed.
     """
 
-    def __init__(self, target=None, crs=None, extent=None):
+    def __init__(self, target=None, crs=None, extent=None, chunks=None,
+                 njobs=1, overwrite=False):
         self.target = target
         self.crs = crs
         self.extent = extent
+        self.chunks = chunks
+        self.njobs = njobs
+        self.overwrite = overwrite
 
     def apply(self, datasets, path):
         """Resample datasets to common extent and resolution.
@@ -762,12 +1493,9 @@ class Alignment(Algorithm):
             raise ValueError("No files found!")
 
         # Treat `datasets` as a list of file paths
-        products = datasets
         if isinstance(datasets[0], str):
-            # Pass chunks={} to ensure the dataset is read as a dask array
             product_names = [os.path.splitext(os.path.split(_)[1])[0]
-                             for _ in products]
-            datasets = [open_dataset(path) for path in datasets]
+                             for _ in datasets]
         else:
             product_names = [ds.metadata.attrs['Abstracted_Metadata:PRODUCT']
                              if 'metadata' in ds else 'data{}'.format(i)
@@ -775,23 +1503,51 @@ class Alignment(Algorithm):
 
         os.makedirs(path, exist_ok=True)
 
+        #
+        # Phase one: Determine the common grid from the metadata.
+        #
+        grids = open_many(datasets, opener=_read_grid)
+        crs_list, bounds, resolutions = zip(*grids)
+
         if self.extent is None:
-            extent = get_common_bounds(datasets)
+            extent = _common_bounds(crs_list, bounds)
         else:
             extent = self.extent
 
         # This is the resolution in the source CRS.
         # TODO: Need to reproject into target dataset.
-        res = get_common_resolution(datasets)
+        res = _common_resolution(crs_list, resolutions)
 
         crs = self.crs
         if crs is None:
-            crs = get_crs(datasets[0])
+            crs = crs_list[0]
 
-        proj = Reprojection(crs=crs, extent=extent, res=res)
-        for name, ds in zip(product_names, products):
+        proj = Reprojection(crs=crs, extent=extent, res=res,
+                            chunks=self.chunks)
+
+        #
+        # Phase two: Reproject and write the datasets.
+        #
+        jobs = []
+        for name, ds in zip(product_names, datasets):
             outfile = os.path.join(path, name + '_aligned.nc')
-            if isinstance(ds, str):
-                ds = open_dataset(ds)
-            res = proj.apply(ds)
-            to_netcdf(res, outfile)
+            if self.overwrite or not os.path.exists(outfile):
+                jobs.append((ds, outfile))
+
+        if self.njobs == 1 or len(jobs) < 2:
+            for ds, outfile in jobs:
+                _align_product(ds, outfile, proj)
+            return
+
+        # Each process is busy with its own product, so the dask tasks
+        # within a product are computed in the main thread. The processes
+        # are spawned rather than forked, as forking a process that runs
+        # GDAL or dask threads may deadlock.
+        with ProcessPoolExecutor(
+                max_workers=self.njobs,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_align_product, ds, outfile, proj,
+                                       scheduler='synchronous')
+                       for ds, outfile in jobs]
+            for future in futures:
+                future.result()